@@ -11,6 +11,7 @@ import scipy.io as sio
 import scipy.sparse as sp
 from mindspore import Tensor
 import mindspore
+from graph_store import GraphStore, edges_to_csr
 from utils import get_train_val_test, get_train_val_test_gcn
 
 
@@ -31,6 +32,9 @@ class Dataset():
         random seed for splitting training/validation/test.
     require_mask :
         setting require_mask True to get training, validation and test mask (self.train_mask, self.val_mask, self.test_mask)
+    use_store :
+        keep a preprocessed, memory-mapped copy of the dataset under root/processed (see `GraphStore`). It is
+        built on the first run and only opened afterwards; seeded splits are stored with it.
 
     Examples
     --------
@@ -42,7 +46,7 @@ class Dataset():
 	>>> idx_train, idx_val, idx_test = data.idx_train, data.idx_val, data.idx_test
     """
 
-    def __init__(self, root, name, setting='nettack', seed=None, require_mask=False):
+    def __init__(self, root, name, setting='nettack', seed=None, require_mask=False, use_store=True):
         self.name = name.lower()
         self.setting = setting.lower()
 
@@ -60,6 +64,9 @@ class Dataset():
         self.require_mask = require_mask
 
         self.require_lcc = True if setting == 'nettack' else False
+        self.use_store = use_store
+        self.store_path = osp.join(self.root, 'processed', self.name + ('_lcc' if self.require_lcc else ''))
+        self.store = None
         self.adj, self.features, self.labels = self.load_data()
 
         self.init_adj = self.init_matrix(self.adj)
@@ -69,14 +76,41 @@ class Dataset():
 
     def get_train_val_test(self):
         """Get training, validation, test splits according to self.setting (either 'nettack' or 'gcn').
+        Seeded splits are drawn once and then read from the store.
         """
+        split = '{}_{}'.format(self.setting, self.seed)
+        cached = self.store is not None and self.seed is not None
+        if cached and self.store.has_split(split):
+            return self.store.load_split(split)
+
         if self.setting == 'nettack':
-            return get_train_val_test(nnodes=self.adj.shape[0], val_size=0.1, test_size=0.8, stratify=self.labels, seed=self.seed)
+            idx = get_train_val_test(nnodes=self.adj.shape[0], val_size=0.1, test_size=0.8, stratify=self.labels, seed=self.seed)
         if self.setting == 'gcn':
-            return get_train_val_test_gcn(self.labels, seed=self.seed)
+            idx = get_train_val_test_gcn(self.labels, seed=self.seed)
+        if cached:
+            self.store.save_split(split, *idx, rng_state=np.random.get_state())
+        return idx
 
     def load_data(self):
         print('Loading {} dataset...'.format(self.name))
+        if self.use_store:
+            if GraphStore.exists(self.store_path):
+                self.store = GraphStore(self.store_path)
+            else:
+                adj, features, labels = self.load_raw()
+                self.store = GraphStore.build(self.store_path, adj, features, labels, name=self.name,
+                                              require_lcc=self.require_lcc)
+            return self.store.adj, self.store.features, self.store.labels
+        return self.load_raw()
+
+    def edge_index(self):
+        """(2, E) edge list of self.adj, taken from the CSR arrays without any dense intermediate."""
+        if self.store is not None:
+            return self.store.edge_index()
+        adj = self.adj.tocoo()
+        return np.vstack((adj.row, adj.col)).astype(np.int64)
+
+    def load_raw(self):
         if self.name == 'pubmed':
             return self.load_pubmed()
 
@@ -123,10 +157,7 @@ class Dataset():
         features = sp.csr_matrix(features)
         edges = data["edges"]
         label = data["label"]
-        adj = np.zeros((2277, 2277)) 
-        for edge in edges:
-            adj[edge[0], edge[1]]=1
-        adj = sp.csr_matrix(adj)
+        adj = edges_to_csr(edges[:, 0], edges[:, 1], 2277)
         return adj, features, label
 
     def load_squirrel(self):
@@ -138,10 +169,7 @@ class Dataset():
         features = sp.csr_matrix(features)
         edges = data["edges"]
         label = data["label"]
-        adj = np.zeros((5201, 5201)) 
-        for edge in edges:
-            adj[edge[0], edge[1]]=1
-        adj = sp.csr_matrix(adj)
+        adj = edges_to_csr(edges[:, 0], edges[:, 1], 5201)
         return adj, features, label
 
     def download_npz(self):
@@ -197,19 +225,12 @@ class Dataset():
 
     def load_AIDS(self):
         dataset = 'AIDS'
-        g = np.zeros((1429, 1429))
-        with open("./"+self.root+"/"+'%s/%s_A.txt' % (dataset, dataset), 'r') as f:
-            for _ in range(2948):
-                row = f.readline().strip().replace(',',' ').split()
-                i, j = [int(w) for w in row]
-                g[i-1][j-1] = 1
-        adj = sp.csr_matrix(g)
-
-        features = []
-        with open("./"+self.root+"/"+'%s/%s_node_attributes.txt' % (dataset, dataset), 'r') as f:
-            for _ in range(1429):
-                row = f.readline().strip().replace(',',' ').split()
-                features.append([float(w) for w in row])
+        edges = np.loadtxt("./"+self.root+"/"+'%s/%s_A.txt' % (dataset, dataset), delimiter=',',
+                           dtype=np.int64, max_rows=2948, ndmin=2)
+        adj = edges_to_csr(edges[:, 0] - 1, edges[:, 1] - 1, 1429)
+
+        features = np.loadtxt("./"+self.root+"/"+'%s/%s_node_attributes.txt' % (dataset, dataset),
+                              delimiter=',', max_rows=1429, ndmin=2)
         features = sp.csr_matrix(features)
 
         labels = np.loadtxt("./"+self.root+"/"+'%s/%s_node_labels.txt' % (dataset, dataset))
@@ -219,19 +240,12 @@ class Dataset():
 
     def load_enzyme(self):
         dataset = 'ENZYMES'
-        g = np.zeros((6254, 6254))
-        with open("./"+self.root+"/"+'%s/%s_A.txt' % (dataset, dataset), 'r') as f:
-            for _ in range(23914):
-                row = f.readline().strip().replace(',',' ').split()
-                i, j = [int(w) for w in row]
-                g[i-1][j-1] = 1
-        adj = sp.csr_matrix(g)
-
-        features = []
-        with open("./"+self.root+"/"+'%s/%s_node_attributes.txt' % (dataset, dataset), 'r') as f:
-            for _ in range(6254):
-                row = f.readline().strip().replace(',',' ').split()
-                features.append([float(w) for w in row])
+        edges = np.loadtxt("./"+self.root+"/"+'%s/%s_A.txt' % (dataset, dataset), delimiter=',',
+                           dtype=np.int64, max_rows=23914, ndmin=2)
+        adj = edges_to_csr(edges[:, 0] - 1, edges[:, 1] - 1, 6254)
+
+        features = np.loadtxt("./"+self.root+"/"+'%s/%s_node_attributes.txt' % (dataset, dataset),
+                              delimiter=',', max_rows=6254, ndmin=2)
         features = sp.csr_matrix(features)
 
         labels = np.loadtxt("./"+self.root+"/"+'%s/%s_node_labels.txt' % (dataset, dataset))
@@ -241,23 +255,13 @@ class Dataset():
 
     def load_usair(self):
         dataset = 'usair'
-        node_dict = {}
         f = np.loadtxt("./"+self.root+"/"+'%s/%s_lable.txt' % (dataset, dataset))
         id = f[:, 0]
         labels = f[:, 1]
-        for i in range(len(id)):
-            node_dict[id[i]] = i
-        g = np.zeros((1190, 1190))
-        with open("./"+self.root+"/"+'%s/%s_A.txt' % (dataset, dataset), 'r') as f:
-            for _ in range(13582):
-                row = f.readline().strip().split()
-                i, j = [int(w) for w in row]
-                g[node_dict[i]][node_dict[j]] = 1
-                g[node_dict[j]][node_dict[i]] = 1
-        adj = sp.csr_matrix(g)
-
-        features = np.identity(1190)
-        features = sp.csr_matrix(features)
+        edges = np.loadtxt("./"+self.root+"/"+'%s/%s_A.txt' % (dataset, dataset), dtype=np.int64, max_rows=13582, ndmin=2)
+        adj = edges_to_csr(node_index(id, edges[:, 0]), node_index(id, edges[:, 1]), 1190, symmetric=True)
+
+        features = sp.identity(1190, format='csr')
 
         labels = np.array(labels, dtype='int8')
 
@@ -265,23 +269,13 @@ class Dataset():
 
     def load_europe(self):
         dataset = 'europe'
-        node_dict = {}
         f = np.loadtxt('%s/%s_lable.txt' % (dataset, dataset))
         id = f[:, 0]
         labels = f[:, 1]
-        for i in range(len(id)):
-            node_dict[id[i]] = i
-        g = np.zeros((399, 399))
-        with open('%s/%s_A.txt' % (dataset, dataset), 'r') as f:
-            for _ in range(5995):
-                row = f.readline().strip().split()
-                i, j = [int(w) for w in row]
-                g[node_dict[i]][node_dict[j]] = 1
-                g[node_dict[j]][node_dict[i]] = 1
-        adj = sp.csr_matrix(g)
-
-        features = np.identity(399)
-        features = sp.csr_matrix(features)
+        edges = np.loadtxt('%s/%s_A.txt' % (dataset, dataset), dtype=np.int64, max_rows=5995, ndmin=2)
+        adj = edges_to_csr(node_index(id, edges[:, 0]), node_index(id, edges[:, 1]), 399, symmetric=True)
+
+        features = sp.identity(399, format='csr')
 
         labels = np.array(labels, dtype='int8')
 
@@ -289,23 +283,13 @@ class Dataset():
 
     def load_brazil(self):
         dataset = 'brazil'
-        node_dict = {}
         f = np.loadtxt("./"+self.root+"/"+'%s/%s_lable.txt' % (dataset, dataset))
         id = f[:, 0]
         labels = f[:, 1]
-        for i in range(len(id)):
-            node_dict[id[i]] = i
-        g = np.zeros((131, 131))
-        with open("./"+self.root+"/"+'%s/%s_A.txt' % (dataset, dataset), 'r') as f:
-            for _ in range(1074):
-                row = f.readline().strip().split()
-                i, j = [int(w) for w in row]
-                g[node_dict[i]][node_dict[j]] = 1
-                g[node_dict[j]][node_dict[i]] = 1
-        adj = sp.csr_matrix(g)
-
-        features = np.identity(131)
-        features = sp.csr_matrix(features)
+        edges = np.loadtxt("./"+self.root+"/"+'%s/%s_A.txt' % (dataset, dataset), dtype=np.int64, max_rows=1074, ndmin=2)
+        adj = edges_to_csr(node_index(id, edges[:, 0]), node_index(id, edges[:, 1]), 131, symmetric=True)
+
+        features = sp.identity(131, format='csr')
 
         labels = np.array(labels, dtype='int8')
 
@@ -317,8 +301,7 @@ class Dataset():
         lable = data['group'].todense()
         labels = np.array(np.argmax(lable, 1).squeeze(1)).squeeze()
 
-        features = np.identity(10312)
-        features = sp.csr_matrix(features)
+        features = sp.identity(10312, format='csr')
 
         labels = np.array(labels, dtype='int8')
 
@@ -380,7 +363,7 @@ class Dataset():
                     features = None
                 labels = loader.get('labels')
         if features is None:
-            features = np.eye(adj.shape[0])
+            features = sp.identity(adj.shape[0], format='csr')
         features = sp.csr_matrix(features, dtype=np.float32)
         return adj, features, labels
 
@@ -432,9 +415,13 @@ class Dataset():
 
     def init_matrix(self, adj):
         n = adj.shape[0]
-        result = np.zeros((n, n))
+        return sp.csr_matrix((n, n))
+
 
-        return sp.csr_matrix(result)
+def node_index(ids, nodes):
+    """Row of every node id of `nodes` in `ids`."""
+    order = np.argsort(ids, kind='stable')
+    return order[np.searchsorted(ids, nodes, sorter=order)]
 
 
 def parse_index_file(filename):
@@ -0,0 +1,131 @@
+import json
+import os
+import pickle
+import shutil
+
+import numpy as np
+import scipy.sparse as sp
+
+# bumped whenever the loaders change what ends up in a store
+FORMAT_VERSION = 1
+
+
+class GraphStore(object):
+    """Preprocessed on-disk copy of a dataset.
+
+    The adjacency and the features are kept as CSR triplets
+    (`<name>_indptr`, `<name>_indices`, `<name>_data`) of `.npy` files next to
+    the labels, the splits and a `meta.json`. Opening a store only reads the
+    meta file: every array is memory-mapped (copy-on-write), so the matrices
+    are paged in on first use and never go through a dense N x N array.
+
+    >>> if GraphStore.exists(path):
+    ...     store = GraphStore(path)
+    ... else:
+    ...     store = GraphStore.build(path, adj, features, labels, name='cora')
+    >>> adj, features, labels = store.adj, store.features, store.labels
+    """
+
+    def __init__(self, path, mmap_mode='c'):
+        self.path = path
+        self.mmap_mode = mmap_mode
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)
+
+    @staticmethod
+    def exists(path):
+        meta = os.path.join(path, 'meta.json')
+        if not os.path.exists(meta):
+            return False
+        with open(meta) as f:
+            return json.load(f).get('version') == FORMAT_VERSION
+
+    @classmethod
+    def build(cls, path, adj, features, labels, **meta):
+        """Write a store at once and open it. The store only becomes visible
+        once complete, so concurrent runs never open a partial one.
+        """
+        tmp = '{}.{}.tmp'.format(path, os.getpid())
+        os.makedirs(tmp, exist_ok=True)
+        meta = dict(meta, version=FORMAT_VERSION)
+        for name, mx in [('adj', adj), ('features', features)]:
+            mx = sp.csr_matrix(mx)
+            mx.sort_indices()
+            np.save(os.path.join(tmp, name + '_indptr.npy'), mx.indptr)
+            np.save(os.path.join(tmp, name + '_indices.npy'), mx.indices)
+            np.save(os.path.join(tmp, name + '_data.npy'), mx.data)
+            meta[name + '_shape'] = list(mx.shape)
+        np.save(os.path.join(tmp, 'labels.npy'), np.asarray(labels))
+        with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+            json.dump(meta, f, sort_keys=True)
+        if os.path.exists(path):
+            # an outdated store, or another run built it first
+            if cls.exists(path):
+                shutil.rmtree(tmp)
+                return cls(path)
+            shutil.rmtree(path)
+        os.replace(tmp, path)
+        return cls(path)
+
+    def load_array(self, name):
+        return np.load(os.path.join(self.path, name + '.npy'), mmap_mode=self.mmap_mode)
+
+    def load_csr(self, name):
+        """CSR matrix on top of the memory-mapped triplet, nothing is copied."""
+        return sp.csr_matrix((self.load_array(name + '_data'), self.load_array(name + '_indices'),
+                              self.load_array(name + '_indptr')),
+                             shape=tuple(self.meta[name + '_shape']), copy=False)
+
+    @property
+    def num_nodes(self):
+        return self.meta['adj_shape'][0]
+
+    @property
+    def adj(self):
+        return self.load_csr('adj')
+
+    @property
+    def features(self):
+        return self.load_csr('features')
+
+    @property
+    def labels(self):
+        return self.load_array('labels')
+
+    def edge_index(self):
+        """(row, col) of the stored edges, read straight from the CSR arrays."""
+        indptr = self.load_array('adj_indptr')
+        row = np.repeat(np.arange(self.num_nodes, dtype=np.int64), np.diff(indptr))
+        return np.vstack((row, self.load_array('adj_indices')))
+
+    def has_split(self, name):
+        return os.path.exists(os.path.join(self.path, 'split_{}.npz'.format(name)))
+
+    def save_split(self, name, idx_train, idx_val, idx_test, rng_state=None):
+        """Store a split. `rng_state` is the numpy RNG state after drawing it,
+        restored by `load_split` so that a seeded run sees the same random
+        stream whether the split was drawn or loaded.
+        """
+        path = os.path.join(self.path, 'split_{}.npz'.format(name))
+        tmp = '{}.{}.tmp.npz'.format(path[:-len('.npz')], os.getpid())
+        state = np.frombuffer(pickle.dumps(rng_state), dtype=np.uint8)
+        np.savez(tmp, idx_train=idx_train, idx_val=idx_val, idx_test=idx_test, rng_state=state)
+        os.replace(tmp, path)
+
+    def load_split(self, name):
+        with np.load(os.path.join(self.path, 'split_{}.npz'.format(name))) as split:
+            rng_state = pickle.loads(split['rng_state'].tobytes())
+            if rng_state is not None:
+                np.random.set_state(rng_state)
+            return split['idx_train'], split['idx_val'], split['idx_test']
+
+
+def edges_to_csr(row, col, num_nodes, symmetric=False):
+    """Unweighted CSR adjacency of an edge list, duplicated edges count once."""
+    row, col = np.asarray(row, dtype=np.int64), np.asarray(col, dtype=np.int64)
+    if symmetric:
+        row, col = np.concatenate([row, col]), np.concatenate([col, row])
+    adj = sp.csr_matrix((np.ones(len(row)), (row, col)), shape=(num_nodes, num_nodes))
+    adj.sum_duplicates()
+    adj.data[:] = 1
+    return adj
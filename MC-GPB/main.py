@@ -7,6 +7,7 @@ import numpy as np
 import torch.nn.functional as F
 from mind_dataset import Dataset
 
+import measures
 import mindspore
 
 import random
@@ -92,28 +93,12 @@ def metric(ori_adj, inference_adj, idx):
     return AUC_adj
 
 
-def homo_hetero_edge_extractor(adj, y):
-    homo_adj = np.zeros_like(adj)
-    hetero_adj = np.zeros_like(adj)
-
-    for row in range(adj.shape[0]):
-        tmp = np.nonzero(adj[row])
-        if len(tmp) == 0:
-            continue
-        cols = tmp[0]
-        for col in cols:
-            if y[row] == y[col]:
-                homo_adj[row][col] = 1
-            else:
-                hetero_adj[row][col] = 1
-
-    return homo_adj, hetero_adj
-
-
 def adj_auc(ori_adj, inference_adj, y):
 
-    def auc_ap_calc(gt_adj, pred_adj):
-        real_edge = gt_adj.reshape(-1)
+    def auc_ap_calc(edges, pred_adj):
+        # ground truth of the flattened N x N score, set from the edge set only
+        real_edge = np.zeros(pred_adj.size, dtype=bool)
+        real_edge[edges.row * pred_adj.shape[1] + edges.col] = True
         pred_edge = pred_adj.reshape(-1)
         fpr, tpr, _ = roc_curve(real_edge, pred_edge)
         return auc(fpr, tpr), average_precision_score(real_edge, pred_edge)
@@ -147,7 +132,12 @@ parser.add_argument('--nlabel', type=float, default=0.1)
 
 parser.add_argument('--arch', type=str, default='gcn')
 parser.add_argument('--nlayer', type=int, default=2)
-parser.add_argument('--MI_type', type=str, default='KDE')
+parser.add_argument('--MI_type', type=str, default='KDE',
+                    choices=['KDE', 'IXZ', 'DP', 'linear_HSIC', 'linear_CKA'])
+parser.add_argument('--compile_measures', action='store_true',
+                    help='wrap the --MI_type estimator in torch.compile')
+parser.add_argument('--profile_measures', action='store_true',
+                    help='time every --MI_type call and print the cost per measure at the end')
 
 parser.add_argument('--layer_MI', nargs='+',
                     help='the layer MI constrain')
@@ -163,6 +153,7 @@ parser.add_argument('--device', type=str, default='cuda:0')
 args = parser.parse_args()
 
 setup_seed(args.seed)
+measures.options.update(compile=args.compile_measures, profile=args.profile_measures)
 
 # global device 
 # device= torch.device(args.device if torch.cuda.is_available() else "cpu")
@@ -335,3 +326,6 @@ os.makedirs(path, exist_ok=True)
 #     victim_model.state_dict(),
 #     os.path.join(path, f'{args.dataset}_{args.arch}_{args.nlayer}.pt')
 # )
+
+if args.profile_measures:
+    print(measures.report())
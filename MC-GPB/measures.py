@@ -0,0 +1,13 @@
+"""The dependence-measure registry of MC-GRA/measures.py, shared by both
+projects. MC-GPB resolves its --MI_type measures from the 'graph' registry;
+`utils` inside the shared module is the MC-GPB one.
+"""
+import importlib.util
+import os
+import sys
+
+_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'MC-GRA', 'measures.py')
+_spec = importlib.util.spec_from_file_location(__name__, _path)
+_module = importlib.util.module_from_spec(_spec)
+sys.modules[__name__] = _module
+_spec.loader.exec_module(_module)
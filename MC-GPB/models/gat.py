@@ -5,6 +5,7 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 import torch.optim as optim
+import measures
 import utils
 from torchmetrics import AUROC
 from tqdm import trange
@@ -269,7 +270,7 @@ class GAT(nn.Module):
         best_loss_val = 100
         best_acc_val = 0
 
-        IAZ_func = getattr(utils, MI_type)  # MI, HSIC, LP, linear_CKA
+        IAZ_func = measures.resolve(MI_type, registry='graph')  # KDE, IXZ, DP, linear_HSIC, linear_CKA
 
         def dot_product_decode(Z,):
             Z = torch.matmul(Z, Z.t())
@@ -6,6 +6,7 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 import torch.optim as optim
+import measures
 import utils
 from torch.nn.modules.module import Module
 from torch.nn.parameter import Parameter
@@ -345,7 +346,7 @@ class GCN(nn.Module):
         best_loss_val = 100
         best_acc_val = 0
 
-        IAZ_func = getattr(utils, MI_type) # MI, HSIC, LP, linear_CKA
+        IAZ_func = measures.resolve(MI_type, registry='graph')  # KDE, IXZ, DP, linear_HSIC, linear_CKA
 
         def dot_product_decode(Z,):
             Z = torch.matmul(Z, Z.t())
@@ -367,24 +368,10 @@ class GCN(nn.Module):
         IYZ = torch.zeros((train_iters, self.nlayer+1))
         full_losses = [[] for _ in range(4)]
 
-        def homo_hetero_edge_extractor(adj, y):
-            homo_adj = np.zeros_like(adj)
-            hetero_adj = np.zeros_like(adj)
-
-            for row in range(adj.shape[0]):
-                tmp = np.nonzero(adj[row])
-                if len(tmp) == 0: continue
-                cols = tmp[0]
-                for col in cols:
-                    if y[row] == y[col]:
-                        homo_adj[row][col] = 1
-                    else:
-                        hetero_adj[row][col] = 1
-
-            return homo_adj, hetero_adj
-        
-        homo_adj, hetero_adj = homo_hetero_edge_extractor(self.origin_adj.cpu().numpy(), labels.cpu().numpy())
-        edge_index = torch.tensor(hetero_adj).nonzero()
+        _, hetero = utils.homo_hetero_edge_extractor(
+            self.origin_adj.cpu().numpy(), labels.cpu().numpy())
+        edge_index = torch.from_numpy(
+            np.vstack((hetero.row, hetero.col)).T.astype(np.int64))
 
         if edge_index.size(0) > 1000:
             sample_size = 1000 
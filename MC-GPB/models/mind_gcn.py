@@ -10,6 +10,7 @@ from mindspore import Tensor
 from mindspore.experimental import optim
 import random
 import mind_utils
+import measures
 import utils
 from tqdm import trange 
 
@@ -283,7 +284,7 @@ class GCN(nn.Cell):
         best_acc_val = 0
 
 
-        self.IAZ_func = getattr(utils, MI_type)  # MI, HSIC, LP, linear_CKA
+        self.IAZ_func = measures.resolve(MI_type, registry='graph')  # KDE, IXZ, DP, linear_HSIC, linear_CKA
 
 #         def dot_product_decode(Z,):
 #             Z = torch.matmul(Z, Z.t())
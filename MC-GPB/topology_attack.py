@@ -1,6 +1,7 @@
 import numpy as np
 import scipy.sparse as sp
 import torch
+import triangular
 import utils
 from base_attack import BaseAttack
 from torch import optim
@@ -22,7 +23,6 @@ class PGDAttack(BaseAttack):
         self.modified_adj = None
         self.modified_features = None
         self.edge_select = None
-        self.complementary = None
         self.embedding = embedding
         if attack_structure:
             assert nnodes is not None, 'Please give nnodes='
@@ -174,84 +174,30 @@ class PGDAttack(BaseAttack):
         return loss_smooth_feat
 
     def projection(self, num_edges):
-        if torch.clamp(self.adj_changes, 0, 1).sum() > num_edges:
-            # print('high')
-            left = (self.adj_changes - 1).min()
-            right = self.adj_changes.max()
-            miu = self.bisection(left, right, num_edges, epsilon=1e-5)
-            self.adj_changes.data.copy_(torch.clamp(
-                self.adj_changes.data - miu, min=0, max=1))
-        else:
-            self.adj_changes.data.copy_(torch.clamp(
-                self.adj_changes.data, min=0, max=1))
+        self.adj_changes.data.copy_(utils.project_budget(self.adj_changes.data, num_edges))
 
     def get_modified_adj2(self):
 
-        m = torch.zeros((self.nnodes, self.nnodes)).to(self.device)
-        tril_indices = torch.tril_indices(
-            row=self.nnodes, col=self.nnodes, offset=-1)
-        m[tril_indices[0], tril_indices[1]] = self.adj_changes
-        m = m + m.t()
-
-        return m
+        return triangular.unpack(self.adj_changes, self.nnodes)
 
     def get_modified_adj(self, ori_adj):
 
-        if self.complementary is None:
-            self.complementary = torch.ones_like(
-                ori_adj) - torch.eye(self.nnodes).to(self.device)
-
-        m = torch.zeros((self.nnodes, self.nnodes)).to(self.device)
-        tril_indices = torch.tril_indices(
-            row=self.nnodes, col=self.nnodes, offset=-1)
-        m[tril_indices[0], tril_indices[1]] = self.adj_changes
-        m = m + m.t()
-
-        modified_adj = self.complementary * m + ori_adj
+        # sym(changes) has a zero diagonal, no complementary mask is needed
+        modified_adj = triangular.unpack(self.adj_changes, self.nnodes) + ori_adj
 
         return modified_adj
 
-    def SVD(self):
-        m = torch.zeros((self.nnodes, self.nnodes)).to(self.device)
-        tril_indices = torch.tril_indices(
-            row=self.nnodes, col=self.nnodes, offset=-1)
-        m[tril_indices[0], tril_indices[1]] = self.adj_changes.detach()
-        m = m + m.t()
-        U, S, V = np.linalg.svd(m.cpu().numpy())
-        U, S, V = torch.FloatTensor(U).to(self.device), torch.FloatTensor(S).to(self.device), torch.FloatTensor(V).to(
-            self.device)
-        alpha = 0.02
-        tmp = torch.zeros_like(S).to(self.device)
-        diag_S = torch.diag(torch.where(S > alpha, S, tmp))
-        adj = torch.matmul(torch.matmul(U, diag_S), V)
-        return adj[tril_indices[0], tril_indices[1]]
+    def SVD(self, alpha=0.02, max_rank=None):
+        # sym(changes) is symmetric: its singular values above alpha are the
+        # |eigenvalues| above alpha, U diag(S) V = sum of lambda u u^T over them
+        values, vectors = triangular.sym_eigsh(self.adj_changes.detach(), alpha, self.nnodes,
+                                               max_rank=max_rank)
+        return triangular.pack_lowrank(vectors, values)
 
     def filter(self, Z):
         A = torch.zeros(Z.size()).to(self.device)
         return torch.where(Z > 0.9, Z, A)
 
-    def bisection(self, a, b, num_edges, epsilon):
-        def func(x):
-            return torch.clamp(self.adj_changes - x, 0, 1).sum() - num_edges
-
-        miu = a
-        while ((b - a) >= epsilon):
-            miu = (a + b) / 2
-            # Check if middle point is root
-            if (func(miu) == 0.0):
-                break
-            # Decide the side to repeat the steps
-            if (func(miu) * func(a) < 0):
-                b = miu
-            else:
-                a = miu
-        # print("The value of root is : ","%.4f" % miu)
-        return miu
-
     def dot_product_decode(self, Z):
         # Z = F.normalize(Z, p=2, dim=1)
-        A_pred = torch.relu(torch.matmul(Z, Z.t()))
-        # A_pred = torch.matmul(Z, Z.t())
-        tril_indices = torch.tril_indices(
-            row=self.nnodes, col=self.nnodes, offset=-1)
-        return A_pred[tril_indices[0], tril_indices[1]]
+        return torch.relu(triangular.pack(torch.matmul(Z, Z.t())))
@@ -0,0 +1,171 @@
+import math
+import warnings
+
+import torch
+import torch.nn.functional as F
+
+# The attacks keep a symmetric N x N matrix with a zero diagonal (the edge
+# changes) as its strict lower triangle in row-major order, the order of
+# torch.tril_indices(N, N, -1): pair (i, j), i > j, is at i * (i - 1) / 2 + j.
+
+
+def num_pairs(n):
+    return n * (n - 1) // 2
+
+
+def num_nodes(m):
+    """N of a packed vector of m = N * (N - 1) / 2 entries."""
+    return int(round((1 + math.sqrt(1 + 8 * m)) / 2))
+
+
+def _unpack_index(start, end, n, device='cpu'):
+    """1 + packed position of every (i, j) of the rows start..end - 1, 0 on
+    the diagonal: i * (i - 1) / 2 + j + 1 below it, j * (j - 1) / 2 + i + 1
+    above. Computed on the fly, nothing of size N x N is kept."""
+    # int32 whenever it can address the pairs, it halves the temporaries
+    dtype = torch.int32 if num_pairs(n) < 2 ** 31 - 1 else torch.int64
+    rows = torch.arange(start, end, device=device, dtype=dtype).unsqueeze(1)
+    cols = torch.arange(n, device=device, dtype=dtype)
+    tri = cols * (cols - 1) // 2 + 1
+    index = torch.where(cols.unsqueeze(0) < rows, tri[start:end].unsqueeze(1) + cols, tri + rows)
+    index[:, start:end].diagonal().zero_()
+    return index
+
+
+def _gather(padded, start, end, n):
+    """Rows start..end - 1 of sym(v), `padded` is v with a leading 0."""
+    index = _unpack_index(start, end, n, padded.device)
+    return padded.index_select(0, index.view(-1)).view(end - start, n)
+
+
+def _lower(block, start):
+    """Entries of the row block `block` (rows start..) below the diagonal, in
+    packed order."""
+    end = start + block.shape[0]
+    rows = torch.arange(start, end, device=block.device).unsqueeze(1)
+    return block[:, :end][torch.arange(end, device=block.device).unsqueeze(0) < rows]
+
+
+def pack(A, block_size=1024):
+    """Strict lower triangle of a square matrix, as a vector."""
+    n = A.shape[0]
+    return torch.cat([_lower(A[start:start + block_size], start) for start in range(0, n, block_size)])
+
+
+def unpack(v, n=None, block_size=1024):
+    """sym(v): the symmetric matrix of zero diagonal whose lower triangle is
+    `v`. A gather per row block writes both triangles, there is no scatter
+    into zeros followed by m + m.t().
+    """
+    n = num_nodes(v.shape[0]) if n is None else n
+    padded = F.pad(v, (1, 0))
+    return torch.cat([_gather(padded, start, min(start + block_size, n), n) for start in range(0, n, block_size)])
+
+
+def sym_matmul(v, X, n=None, block_size=1024):
+    """sym(v) @ X, built in row blocks so that at most a [block_size, N]
+    slice of sym(v) (and of its index) exists at any time.
+
+    Parameters
+    ----------
+    v : torch.Tensor
+        packed lower triangle, N * (N - 1) / 2 entries
+    X : torch.Tensor
+        [N, d] (or [N]) right-hand side
+    """
+    n = num_nodes(v.shape[0]) if n is None else n
+    padded = F.pad(v, (1, 0))
+    return torch.cat([torch.matmul(_gather(padded, start, min(start + block_size, n), n), X)
+                      for start in range(0, n, block_size)])
+
+
+def _top(values, W, k):
+    order = values.abs().argsort(descending=True)[:k]
+    return values[order], W[:, order]
+
+
+def sym_eigsh(v, threshold, n=None, rank=32, max_rank=None, oversample=10, n_iter=4, max_iter=50,
+              tol=1e-3, dense_max=2048, block_size=1024, seed=0):
+    """Eigenpairs of sym(v) whose eigenvalue exceeds `threshold` in absolute
+    value (its singular values above `threshold`), largest first.
+
+    Up to `dense_max` nodes, a dense eigh of sym(v) is exact and cheap. Beyond,
+    sym(v) is never built: the pairs come from subspace iteration on
+    `sym_matmul` products. Once the k-th Ritz value exceeds `threshold` the
+    rank k is doubled (the iteration goes on from the current subspace);
+    otherwise the iteration stops when the pairs above `threshold` have a
+    residual ||sym(v) q - lambda q|| of at most `tol` * |lambda_max| and the
+    largest pair below cannot cross `threshold` within its residual, after
+    `n_iter` and at most `max_iter` iterations. The rank never exceeds `max_rank`
+    (`dense_max` if None), so neither an N x N matrix nor an O(N^3)
+    decomposition is involved. A warning tells when eigenvalues above
+    `threshold` are dropped by `max_rank`, or when the iteration does not
+    converge.
+
+    Returns
+    -------
+    tuple
+        (values, vectors) of shapes [k] and [N, k]
+    """
+    n = num_nodes(v.shape[0]) if n is None else n
+    if n <= dense_max:
+        values, vectors = _top(*torch.linalg.eigh(unpack(v, n, block_size)), n)
+        keep = values.abs() > threshold
+        values, vectors = values[keep], vectors[:, keep]
+        if max_rank is not None and values.shape[0] > max_rank:
+            warnings.warn('sym_eigsh: {} eigenvalues above {}, only the max_rank={} largest are kept'.format(
+                values.shape[0], threshold, max_rank))
+            values, vectors = values[:max_rank], vectors[:, :max_rank]
+        return values, vectors
+
+    cap = min(n, dense_max if max_rank is None else max_rank)
+    generator = torch.Generator(device=v.device).manual_seed(seed)
+    k = min(rank, cap)
+    Q = v.new_zeros(n, 0)
+    while True:
+        # k pairs from a subspace of (about) 2k vectors: the last pairs converge
+        # at the rate |lambda_2k / lambda_k|
+        size = min(k + max(oversample, k), n)
+        extra = torch.randn(n, size - Q.shape[1], generator=generator, device=v.device, dtype=v.dtype)
+        Q, _ = torch.linalg.qr(torch.cat([Q, extra], dim=1))
+        converged = False
+        for it in range(max_iter):
+            if it > 0:
+                Q, _ = torch.linalg.qr(AQ)
+            # Rayleigh-Ritz on span(Q); sym(v) Q is also the next power step
+            AQ = sym_matmul(v, Q, n, block_size)
+            B = torch.matmul(Q.t(), AQ)
+            values, W = _top(*torch.linalg.eigh((B + B.t()) / 2), k)
+            more = values[-1].abs() > threshold and k < cap
+            if it >= n_iter:
+                if more:
+                    break
+                # the returned pairs, and the largest one below threshold, which
+                # only has to stay below it within its residual
+                m = min(int((values.abs() > threshold).sum()) + 1, k)
+                residual = torch.matmul(AQ, W[:, :m]) - torch.matmul(Q, W[:, :m]) * values[:m]
+                bound = torch.full_like(values[:m], tol * values[0].abs())
+                if values[m - 1].abs() <= threshold:
+                    bound[m - 1] = max(bound[m - 1], threshold - values[m - 1].abs())
+                if bool((residual.norm(dim=0) <= bound).all()):
+                    converged = True
+                    break
+        if more:
+            k = min(2 * k, cap)
+            continue
+        if not converged:
+            warnings.warn('sym_eigsh: rank {} not converged to tol={} in {} iterations'.format(k, tol, max_iter))
+        if values[-1].abs() > threshold and k < n:
+            warnings.warn('sym_eigsh: the {} largest eigenvalues all exceed {}, the rest are dropped by '
+                          'max_rank={}'.format(k, threshold, cap))
+        keep = values.abs() > threshold
+        return values[keep], torch.matmul(Q, W[:, keep])
+
+
+def pack_lowrank(U, values, block_size=1024):
+    """pack(U diag(values) U^T), reconstructed in row blocks: only the lower
+    triangle entries are kept, at most a [block_size, N] block exists."""
+    n = U.shape[0]
+    scaled = U * values
+    return torch.cat([_lower(torch.matmul(scaled[start:start + block_size], U[:start + block_size].t()), start)
+                      for start in range(0, n, block_size)])
@@ -2,7 +2,7 @@ import math
 
 import numpy as np
 import scipy.sparse as sp
-# import torch
+import torch
 # import torch.nn as nn
 import torch.nn.functional as F
 import torch.sparse as ts
@@ -577,6 +577,39 @@ def get_splits_each_class(labels, train_size):
         np.random.permutation(idx_test)
 
 
+def budget_threshold(values, budget):
+    """Exact miu with sum(clamp(values - miu, 0, 1)) == budget.
+
+    The sum is piecewise linear and decreasing in miu, with breakpoints at
+    `values` and `values - 1`: one sort of the breakpoints and a cumulative
+    sum give it at every breakpoint, and miu is interpolated on the segment
+    that crosses `budget`.
+    """
+    x = values.detach().flatten().double()
+    points, order = torch.sort(torch.cat([x, x - 1]), descending=True)
+    # number of entries strictly inside (0, 1) right below each breakpoint
+    count = torch.cumsum(torch.cat([torch.ones_like(x), -torch.ones_like(x)])[order], 0)
+    total = torch.cat([x.new_zeros(1), torch.cumsum(count[:-1] * (points[:-1] - points[1:]), 0)])
+    k = torch.searchsorted(total, x.new_tensor([budget])).clamp(1, len(total) - 1)
+    miu = points[k - 1] - (budget - total[k - 1]) / count[k - 1]
+    return miu.to(values.dtype)
+
+
+def project_budget(values, num_edges):
+    """Euclidean projection of the edge scores onto {0 <= x <= 1, sum(x) <= num_edges}.
+
+    Sparse tensors (candidate pairs) project their stored values, the
+    implicit zeros stay in the set.
+    """
+    if values.is_sparse:
+        values = values.coalesce()
+        return torch.sparse_coo_tensor(values.indices(), project_budget(values.values(), num_edges),
+                                       values.shape)
+    if torch.clamp(values, 0, 1).sum() > num_edges:
+        values = values - budget_threshold(values, num_edges)
+    return torch.clamp(values, 0, 1)
+
+
 def unravel_index(index, array_shape):
     rows = index // array_shape[1]
     cols = index % array_shape[1]
@@ -765,25 +798,58 @@ def reshape_mx(mx, shape):
     return sp.csr_matrix((mx.data, (indices[0], indices[1])), shape=shape)
 
 
-def IXZ(X, Z):
+def homo_hetero_edge_extractor(adj, y):
+    """Split the edges of a graph into homophilous (same label) and
+    heterophilous (different label) edges with one label comparison.
+
+    Parameters
+    ----------
+    adj : numpy.array or scipy.sparse matrix
+        adjacency matrix
+    y : numpy.array
+        node labels
+
+    Returns
+    -------
+    tuple
+        (homo, hetero) edge sets as scipy.sparse.coo_matrix, in row-major order
+    """
+    adj = sp.coo_matrix(adj)
+    adj.eliminate_zeros()
+    y = np.asarray(y).reshape(-1)
+    row, col = adj.row, adj.col
+    order = np.lexsort((col, row))
+    row, col = row[order], col[order]
+    same = y[row] == y[col]
+    ones = np.ones(len(row), dtype=np.float32)
+
+    homo = sp.coo_matrix((ones[same], (row[same], col[same])), shape=adj.shape)
+    hetero = sp.coo_matrix(
+        (ones[~same], (row[~same], col[~same])), shape=adj.shape)
+    return homo, hetero
+
+
+def IXZ(X, Z, MI=None):
     A_Z = torch.sigmoid(Z@Z.T).unsqueeze(0)
     A_X = torch.sigmoid(X@X.T).unsqueeze(0)
 
     input1 = torch.cat([A_X, A_Z])
     input2 = torch.cat([A_Z, A_Z])
-    MI = MutualInformation(sigma=0.4, num_bins=A_Z.shape[0], normalize=True)
+    if MI is None:
+        MI = MutualInformation(sigma=0.4, num_bins=A_Z.shape[0], normalize=True)
 
     return MI(input1, input2)[0]
 
 
-def KDE(A, Z):
+def KDE(A, Z, MI=None):
     A_Z = ops.unsqueeze(Z@Z.T, 0)
     A_A = ops.unsqueeze(A, 0)
 
     input1 = ops.cat([A_A, A_Z])
     input2 = ops.cat([A_Z, A_Z])
-    
-    MI = MutualInformation(sigma=0.4, num_bins=A_Z.shape[0], normalize=True)
+
+    if MI is None:
+        MI = MutualInformation(sigma=0.4, num_bins=A_Z.shape[0], normalize=True)
 
     return MI(input1, input2)[0]
 
@@ -822,15 +888,26 @@ def setup_seed(seed):
 
 
 class CudaCKA(object):
-    def __init__(self, device):
+    """HSIC / CKA between two sets of node representations.
+
+    The linear estimators work in feature space: with column-centered X_c
+    and Y_c, HSIC(X, Y) = ||X_c^T Y_c||_F^2, which costs O(N * d * e) and
+    builds no N x N centering or Gram matrix. `kernel_HSIC` centers the RBF
+    Gram matrices by subtracting row / column means, or, with
+    `approx='rff'` (random Fourier features) or `approx='nystrom'`, runs the
+    same feature-space estimator on an explicit `n_components` feature map.
+    """
+
+    def __init__(self, device, approx=None, n_components=256, seed=0):
+        assert approx in [None, 'rff', 'nystrom'], 'approx should be None, rff or nystrom'
         self.device = device
+        self.approx = approx
+        self.n_components = n_components
+        self.seed = seed
 
     def centering(self, K):
-        n = K.shape[0]
-        unit = torch.ones([n, n], device=self.device)
-        I = torch.eye(n, device=self.device)
-        H = I - unit / n
-        return torch.matmul(torch.matmul(H, K), H)
+        """H K H with H = I - 11^T / n, without forming H."""
+        return K - K.mean(0, keepdim=True) - K.mean(1, keepdim=True) + K.mean()
 
     def rbf(self, X, sigma=None):
         GX = torch.matmul(X, X.T)
@@ -842,14 +919,51 @@ class CudaCKA(object):
         KX = torch.exp(KX)
         return KX
 
+    def median_sigma(self, X, max_samples=1000):
+        """Median heuristic of `rbf`, on a fixed subsample of the rows."""
+        generator = torch.Generator().manual_seed(self.seed)
+        idx = torch.randperm(X.shape[0], generator=generator)[:max_samples].to(X.device)
+        dist = torch.cdist(X[idx], X[idx]).pow(2)
+        return math.sqrt(torch.median(dist[dist != 0]).item())
+
+    def feature_map(self, X, sigma=None):
+        """Explicit features phi(X) with phi(x)^T phi(y) ~ rbf(x, y)."""
+        X = X.float()
+        if sigma is None:
+            sigma = self.median_sigma(X)
+        # fixed per input dimension, so the estimate is a smooth function across steps
+        generator = torch.Generator().manual_seed(self.seed + X.shape[1])
+        if self.approx == 'rff':
+            W = torch.randn(X.shape[1], self.n_components,
+                            generator=generator).to(X.device) / sigma
+            b = torch.rand(self.n_components, generator=generator).to(X.device) * 2 * math.pi
+            return math.sqrt(2. / self.n_components) * torch.cos(torch.matmul(X, W) + b)
+
+        idx = torch.randperm(X.shape[0], generator=generator)[:self.n_components].to(X.device)
+        K_nm = torch.exp(-torch.cdist(X, X[idx]).pow(2) * 0.5 / (sigma * sigma))
+        K_mm = K_nm[idx]
+        eigval, eigvec = torch.linalg.eigh(K_mm)
+        inv_sqrt = eigvec * eigval.clamp(min=1e-8).rsqrt().unsqueeze(0)
+        return torch.matmul(K_nm, torch.matmul(inv_sqrt, eigvec.T))
+
+    def feature_HSIC(self, X, Y):
+        """||X_c^T Y_c||_F^2, evaluated in the cheaper of feature / sample space."""
+        return self.centered_HSIC(X - X.mean(0, keepdim=True), Y - Y.mean(0, keepdim=True))
+
+    def centered_HSIC(self, X, Y):
+        """`feature_HSIC` of inputs whose columns are already centered."""
+        n = X.shape[0]
+        if X.shape[1] * Y.shape[1] <= n * (X.shape[1] + Y.shape[1]):
+            return torch.sum(torch.matmul(X.T, Y) ** 2)
+        return torch.sum(torch.matmul(X, X.T) * torch.matmul(Y, Y.T))
+
     def kernel_HSIC(self, X, Y, sigma):
+        if self.approx is not None:
+            return self.feature_HSIC(self.feature_map(X, sigma), self.feature_map(Y, sigma))
         return torch.sum(self.centering(self.rbf(X, sigma)) * self.centering(self.rbf(Y, sigma)))
 
     def linear_HSIC(self, X, Y):
-        L_X = torch.matmul(X, X.T)
-        L_Y = torch.matmul(Y, Y.T)
-        # L_Y = Y
-        return torch.sum(self.centering(L_X) * self.centering(L_Y))
+        return self.feature_HSIC(X, Y)
 
     def linear_CKA(self, X, Y):
         hsic = self.linear_HSIC(X, Y)
@@ -866,21 +980,45 @@ class CudaCKA(object):
 
 
 class MutualInformation(nn.Cell):
+    """Normalized KDE mutual information between two (B x) N x M inputs,
+    with one Gaussian bin per column.
+
+    Only the active bins, the columns whose kernel value exceeds `tol` for
+    some row, are materialized, and the joint pdf is accumulated over them
+    in `chunk_size` x `chunk_size` blocks, so memory no longer grows with M^2.
+    `max_bins` caps the active bins per input, `estimator='histogram'` uses
+    hard nearest-bin counts instead (no gradient, for monitoring).
+    """
 
-    def __init__(self,sigma=0.4, num_bins=256, normalize=True):
+    def __init__(self,sigma=0.4, num_bins=256, normalize=True, chunk_size=1024, tol=1e-12,
+                 max_bins=None, estimator='kde'):
         super(MutualInformation, self).__init__()
+        assert estimator in ['kde', 'histogram'], 'estimator should be kde or histogram'
 
         self.sigma = 2*sigma**2
         self.num_bins = num_bins
         self.normalize = normalize
         self.epsilon = 1e-10
-
-        self.bins = ops.linspace(
-            0, num_bins, num_bins).float()
-
-    def marginalPdf(self, values):
-        
-        residuals = values - ops.unsqueeze(ops.unsqueeze(self.bins, 0), 0)
+        self.chunk_size = chunk_size
+        self.tol = tol
+        self.max_bins = max_bins
+        self.estimator = estimator
+
+        self.bins = np.linspace(0, num_bins, num_bins).astype(np.float32)
+
+    def active_bins(self, values):
+        radius = self.sigma * math.sqrt(-2 * math.log(self.tol))
+        values = values.asnumpy()
+        dist = np.concatenate([np.abs(values[:, :, i:i + self.chunk_size] - self.bins[i:i + self.chunk_size]
+                                      ).min(axis=(0, 1))
+                               for i in range(0, values.shape[2], self.chunk_size)])
+        active = np.nonzero(dist < radius)[0]
+        if self.max_bins is not None and len(active) > self.max_bins:
+            active = np.sort(active[np.argsort(dist[active])[:self.max_bins]])
+        return active
+
+    def marginalPdf(self, values, active):
+        residuals = ops.gather(values, Tensor(active), 2) - Tensor(self.bins[active])
         kernel_values = ops.exp(-0.5*(residuals / self.sigma).pow(2))
 
         pdf = ops.mean(kernel_values, axis=1)
@@ -889,26 +1027,54 @@ class MutualInformation(nn.Cell):
 
         return pdf, kernel_values
 
-    def jointPdf(self, kernel_values1, kernel_values2):
-            
-        joint_kernel_values = ops.matmul(
-            ops.transpose(kernel_values1, (0, 2, 1)), kernel_values2)
-        normalization = ops.sum(joint_kernel_values, dim=(
-            1, 2)).view(-1, 1, 1) + self.epsilon
-        pdf = joint_kernel_values / normalization
-
-        return pdf
+    def jointEntropy(self, kernel_values1, kernel_values2):
+        # sum_ij (K1^T K2)_ij = sum_n rowsum1_n * rowsum2_n, without the joint
+        normalization = ops.sum(ops.sum(kernel_values1, dim=2) * ops.sum(kernel_values2, dim=2),
+                                dim=1).view(-1, 1, 1) + self.epsilon
+        entropy = 0
+        for i in range(0, kernel_values1.shape[2], self.chunk_size):
+            for j in range(0, kernel_values2.shape[2], self.chunk_size):
+                pdf = ops.matmul(ops.transpose(kernel_values1[:, :, i:i + self.chunk_size], (0, 2, 1)),
+                                 kernel_values2[:, :, j:j + self.chunk_size]) / normalization
+                entropy = entropy - ops.sum(pdf*ops.log2(pdf + self.epsilon), dim=(1, 2))
+        return entropy
+
+    def histogramEntropies(self, input1, input2):
+        step = self.num_bins / max(self.num_bins - 1, 1)
+
+        def hits(values, b):
+            active = self.active_bins(values[b:b + 1])
+            v = values[b].asnumpy()[:, active]
+            rows, cols = np.nonzero(np.abs(v - self.bins[active]) < step / 2)
+            return sp.csr_matrix((np.ones(len(rows)), (rows, active[cols])),
+                                 shape=(values.shape[1], values.shape[2]))
+
+        def entropy(counts):
+            p = counts[counts > 0] / max(counts.sum(), self.epsilon)
+            return -np.sum(p * np.log2(p + self.epsilon))
+
+        H = []
+        for b in range(input1.shape[0]):
+            hits1, hits2 = hits(input1, b), hits(input2, b)
+            H.append([entropy(np.asarray(hits1.sum(0)).ravel()),
+                      entropy(np.asarray(hits2.sum(0)).ravel()),
+                      entropy((hits1.T @ hits2).data)])
+        H = Tensor(np.array(H, dtype=np.float32))
+        return H[:, 0], H[:, 1], H[:, 2]
 
     def getMutualInformation(self, input1, input2):
-        pdf_x1, kernel_values1 = self.marginalPdf(input1)
-        pdf_x2, kernel_values2 = self.marginalPdf(input2)
-    
-        pdf_x1x2 = self.jointPdf(kernel_values1, kernel_values2)
-
-        H_x1 = -ops.sum(pdf_x1*ops.log2(pdf_x1 + self.epsilon), dim=1)
-        H_x2 = -ops.sum(pdf_x2*ops.log2(pdf_x2 + self.epsilon), dim=1)
-        H_x1x2 = -ops.sum(pdf_x1x2*ops.log2(pdf_x1x2 +
-                            self.epsilon), dim=(1, 2))
+        if input1.ndim == 2:
+            input1, input2 = ops.unsqueeze(input1, 0), ops.unsqueeze(input2, 0)
+
+        if self.estimator == 'histogram':
+            H_x1, H_x2, H_x1x2 = self.histogramEntropies(input1, input2)
+        else:
+            pdf_x1, kernel_values1 = self.marginalPdf(input1, self.active_bins(input1))
+            pdf_x2, kernel_values2 = self.marginalPdf(input2, self.active_bins(input2))
+
+            H_x1 = -ops.sum(pdf_x1*ops.log2(pdf_x1 + self.epsilon), dim=1)
+            H_x2 = -ops.sum(pdf_x2*ops.log2(pdf_x2 + self.epsilon), dim=1)
+            H_x1x2 = self.jointEntropy(kernel_values1, kernel_values2)
 
         mutual_information = H_x1 + H_x2 - H_x1x2
 
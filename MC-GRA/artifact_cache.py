@@ -0,0 +1,105 @@
+import hashlib
+import json
+import os
+import pickle
+import random
+import shutil
+
+import numpy as np
+import torch
+
+# sources whose changes invalidate the cached victim models and embeddings
+CODE_FILES = ['mind_dataset.py', 'graph_store.py', 'sparse_graph.py', 'utils.py',
+              'models/gcn.py', 'models/graphsage.py', 'models/gat.py']
+
+
+def code_version(files=CODE_FILES, root=os.path.dirname(os.path.abspath(__file__))):
+    """Hash of the sources that produce the cached artifacts."""
+    sha = hashlib.sha1()
+    for name in files:
+        path = os.path.join(root, name)
+        # a renamed source must not silently drop out of the key
+        if not os.path.exists(path):
+            raise FileNotFoundError('{} is listed in CODE_FILES but does not exist'.format(path))
+        with open(path, 'rb') as f:
+            sha.update(f.read())
+    return sha.hexdigest()[:12]
+
+
+class ArtifactCache(object):
+    """Content-addressed store for the trained victim model, its embedding
+    model and the precomputed prior matrices.
+
+    Every entry is a directory named by the hash of its key (dataset, arch,
+    nlayers, hidden, seed, code version, ...). Weights are stored with
+    `torch.save`, embeddings as `.npy` files that are memory-mapped on load,
+    so a cache hit costs little more than opening the files.
+
+    >>> cache = ArtifactCache('./cache')
+    >>> key = cache.key(dataset='cora', arch='gcn', nlayers=2, hidden=16, seed=15)
+    >>> if cache.has(key):
+    ...     H_A = cache.load_array(key, 'H_A')
+    """
+
+    def __init__(self, root='./cache'):
+        self.root = root
+
+    def key(self, **fields):
+        fields.setdefault('code', code_version())
+        blob = json.dumps(fields, sort_keys=True)
+        return hashlib.sha1(blob.encode()).hexdigest()[:16], fields
+
+    def path(self, key):
+        return os.path.join(self.root, key[0])
+
+    def has(self, key):
+        return os.path.exists(os.path.join(self.path(key), 'meta.json'))
+
+    def save(self, key, states=None, arrays=None):
+        """Write an entry at once: `states` are name -> state_dict, `arrays`
+        name -> tensor. The entry only becomes visible once complete.
+        """
+        tmp = '{}.{}.tmp'.format(self.path(key), os.getpid())
+        os.makedirs(tmp, exist_ok=True)
+        for name, state in (states or {}).items():
+            torch.save(state, os.path.join(tmp, name + '.pt'))
+        for name, array in (arrays or {}).items():
+            if isinstance(array, torch.Tensor):
+                array = array.detach().cpu().numpy()
+            np.save(os.path.join(tmp, name + '.npy'), array)
+        with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+            json.dump(key[1], f, sort_keys=True)
+        if os.path.exists(self.path(key)):
+            shutil.rmtree(tmp)
+            return
+        os.replace(tmp, self.path(key))
+
+    def load_state(self, key, name, device='cpu'):
+        return torch.load(os.path.join(self.path(key), name + '.pt'), map_location=device)
+
+    def load_array(self, key, name, mmap=True):
+        """Memory-mapped (copy-on-write) tensor of a cached array."""
+        path = os.path.join(self.path(key), name + '.npy')
+        return torch.from_numpy(np.load(path, mmap_mode='c' if mmap else None))
+
+    def has_array(self, key, name):
+        return os.path.exists(os.path.join(self.path(key), name + '.npy'))
+
+
+def get_rng_state():
+    """RNG state after building the artifacts, restored on a cache hit so that
+    the attack sees the same random stream as in an uncached run."""
+    state = {'torch': torch.get_rng_state(), 'numpy': np.random.get_state(),
+             'random': random.getstate()}
+    if torch.cuda.is_available():
+        state['cuda'] = torch.cuda.get_rng_state_all()
+    return pickle.dumps(state)
+
+
+def set_rng_state(blob):
+    state = pickle.loads(blob)
+    torch.set_rng_state(state['torch'])
+    np.random.set_state(state['numpy'])
+    random.setstate(state['random'])
+    if 'cuda' in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state['cuda'])
@@ -84,6 +84,9 @@ class BaseAttack(Module):
                 'modified_adj is None! Please perturb the graph first.'
         name = name + '.npz'
         modified_adj = self.modified_adj
+        if hasattr(modified_adj, 'dense'):
+            # decoder.FusedDecoder
+            modified_adj = modified_adj.dense()
 
         if type(modified_adj) is torch.Tensor:
             sparse_adj = utils.to_scipy(modified_adj)
@@ -0,0 +1,227 @@
+import decoder
+import scipy.sparse as sp
+import sparse_graph
+import torch
+from noise import AdjacencyNoise
+from search import TrialPruned
+from sparse_attack import SparsePGDAttack
+from torch.nn import functional as F
+from torch.nn.parameter import Parameter
+from tqdm import tqdm
+from utils import Align_Parameter_Cora, project_budget
+
+
+class BatchedSparsePGDAttack(SparsePGDAttack):
+    """`SparsePGDAttack` for B hyperparameter configurations at once.
+
+    Every configuration optimizes its own candidate weights, but the B
+    perturbed graphs are stacked into one block-diagonal graph of B * N
+    nodes, so the victim and embedding forwards of all configurations are a
+    single sparse matmul per layer. The frozen terms (original edge list,
+    feature scores, H_A, Y_A) are computed once and shared. A loss term is
+    skipped when its weight is zero in every configuration.
+
+    Parameters
+    ----------
+    configs : list
+        one dict per configuration with 'lr', 'weight_sup' and 'weight_param'
+        (w1..w10, as in `SparsePGDAttack.attack`)
+    """
+
+    def __init__(self, model=None, embedding=None, H_A=None, Y_A=None, nnodes=None, candidates=None,
+                 configs=None, loss_type='CE', device='cpu'):
+        super(BatchedSparsePGDAttack, self).__init__(model=model, embedding=embedding, H_A=H_A, Y_A=Y_A,
+                                                     nnodes=nnodes, candidates=candidates,
+                                                     parameterization='edge', loss_type=loss_type,
+                                                     device=device)
+        assert configs, 'Please give configs='
+        self.configs = configs
+        self.nbatch = len(configs)
+        del self.adj_changes
+        self.adj_changes = torch.nn.ParameterList(
+            [Parameter(torch.zeros(self.candidates.shape[1])) for _ in configs])
+        self.edge_scores = None
+        self.pruned = [False] * self.nbatch
+
+    def batch_index(self, edge_index):
+        """Copies of `edge_index` for the B graphs of the block-diagonal batch."""
+        offset = torch.arange(self.nbatch, device=edge_index.device).repeat_interleave(
+            edge_index.shape[1]) * self.nnodes
+        return edge_index.repeat(1, self.nbatch) + offset
+
+    def get_batched_modified(self, ori_edge_index, ori_edge_weight, edge_weight):
+        """(edge_index, edge_weight) of the B perturbed graphs, `edge_weight`
+        holds the [B, M] candidate weights.
+        """
+        cand_index = torch.cat([self.candidates, self.candidates.flip(0)], dim=1)
+        edge_index = torch.cat([self.batch_index(ori_edge_index), self.batch_index(cand_index)], dim=1)
+        edge_weight = torch.cat([ori_edge_weight.repeat(self.nbatch),
+                                 torch.cat([edge_weight, edge_weight], dim=1).flatten()])
+        return edge_index, edge_weight
+
+    def get_batched_adj(self, ori_edge_index, ori_edge_weight, edge_weight):
+        """Normalized (edge_index, edge_weight) of the B perturbed graphs."""
+        return sparse_graph.gcn_norm(*self.get_batched_modified(ori_edge_index, ori_edge_weight, edge_weight),
+                                     self.nbatch * self.nnodes)
+
+    def batch_candidate_norm(self, edge_index, edge_weight, candidate_weight):
+        """`candidate_norm` of every graph of the batch, [B, M]."""
+        deg = edge_weight.new_ones(self.nbatch * self.nnodes).index_add(0, edge_index[0], edge_weight)
+        deg_inv_sqrt = deg.pow(-0.5).view(self.nbatch, self.nnodes)
+        row, col = self.candidates
+        return deg_inv_sqrt[:, row] * candidate_weight * deg_inv_sqrt[:, col]
+
+    def batch_embed_perturbation(self, batch_features, edge_weight):
+        """`embed_perturbation` of every graph of the batch, [B, N, d]."""
+        cand_index = torch.cat([self.candidates, self.candidates.flip(0)], dim=1)
+        adj = self.model_input(self.batch_index(cand_index), torch.cat([edge_weight, edge_weight], dim=1).flatten(),
+                               self.nbatch * self.nnodes)
+        self.embedding.set_layers(2)
+        return self.embedding(batch_features, adj).view(self.nbatch, self.nnodes, -1)
+
+    def batch_decode_perturbation(self, em):
+        """`decode_perturbation` of every graph of the batch, [B, M]."""
+        return torch.stack([self.decode_perturbation(z) for z in em])
+
+    def batch_entropy(self, edge_index, edge_weight):
+        """`Info_entropy` of the normalized weights of every graph of the batch."""
+        batch = edge_index[0] // self.nnodes
+        prob = torch.clamp(edge_weight, 1e-4, 1-1e-4)
+        total = prob.new_zeros(self.nbatch).index_add(0, batch, prob * torch.log2(prob))
+        return -total / torch.bincount(batch, minlength=self.nbatch)
+
+    def attack(self, args, features, ori_adj, labels, idx_attack, num_edges, epochs=200,
+               callbacks=None, report_every=20, **kwargs):
+        '''
+            Parameters:
+            features:               node features (torch.Tensor)
+            ori_adj:                initial adjacency, scipy matrix or tensor
+            labels:                 node labels (torch.LongTensor)
+            idx_attack:             index of nodes for recovery.
+            num_edges:              edge budget of the projection, per configuration.
+            epochs:                 epochs for recovery training.
+            callbacks:              one callback per configuration (or None), called as
+                                    callback(epoch, (edge_index, edge_weight)); a
+                                    configuration whose callback raises TrialPruned is frozen.
+        '''
+        self.args = args
+        B, N = self.nbatch, self.nnodes
+        optimizer = torch.optim.Adam([{'params': [p], 'lr': config['lr']}
+                                      for p, config in zip(self.adj_changes, self.configs)])
+        callbacks = callbacks or [None] * B
+
+        victim_model = self.surrogate
+        victim_model.eval()
+        self.embedding.eval()
+        features = features.to(self.device)
+        labels = labels.to(self.device)
+        ori_edge_index, ori_edge_weight = sparse_graph.adj_to_edge_index(
+            ori_adj, device=self.device)
+
+        weights = torch.tensor([config['weight_param'] for config in self.configs],
+                               dtype=torch.float, device=self.device)
+        weight_sup = torch.tensor([config['weight_sup'] for config in self.configs],
+                                  dtype=torch.float, device=self.device)
+        active = torch.ones(B, device=self.device)
+        calc_pairs, calc = self.get_measure(args.measure)
+        if calc_pairs is None and weights[:, :2].any():
+            raise ValueError('--measure {} has no form on the candidate pairs, c1 / c2 (w1, w2) '
+                             'need HSIC, CKA, MSELoss, KL or DP'.format(args.measure))
+
+        # shared by all configurations
+        feature_score = decoder.feature_source(features, args.dataset).pairs(self.candidates)
+        H_A = self.H_A.detach().to(self.device)[idx_attack]
+        Y_A = self.Y_A.detach().to(self.device)[idx_attack]
+        ori_candidate = sparse_graph.edge_lookup(ori_edge_index, ori_edge_weight,
+                                                 self.candidates, N)
+        batch_features = features.repeat(B, 1)
+        batch_labels = labels[idx_attack].repeat(B)
+        # the same noise for every configuration, as in separate runs
+        noise = AdjacencyNoise.from_args(args, self.candidates, self.device, mode='sparse')
+
+        for t in tqdm(range(epochs)):
+            optimizer.zero_grad()
+            edge_weight = torch.stack(list(self.adj_changes))
+            graph_weight = self.noisy_weight(noise, ori_candidate, edge_weight, t)
+            modified_index, modified_weight = self.get_batched_modified(
+                ori_edge_index, ori_edge_weight, graph_weight)
+            edge_index, norm_weight = sparse_graph.gcn_norm(modified_index, modified_weight, B * N)
+            adj_norm = self.model_input(edge_index, norm_weight, B * N)
+            output = victim_model(batch_features, adj_norm).view(B, N, -1)[:, idx_attack]
+
+            sup = F.nll_loss(output.reshape(-1, output.shape[2]), batch_labels,
+                             reduction='none').view(B, -1).mean(1)
+            loss = weight_sup * (sup + torch.norm(edge_weight, p=2, dim=1) * 0.001)
+
+            w = weights
+            if w[:, 0].any():
+                loss = loss + w[:, 0] * torch.stack([calc_pairs(feature_score, x) for x in graph_weight]) * \
+                    1000 * Align_Parameter_Cora["c1"]
+            if w[:, 1].any() or w[:, 6].any() or w[:, 8].any():
+                em = self.batch_embed_perturbation(batch_features, graph_weight)
+            if w[:, 1].any() or w[:, 6].any():
+                decoded = self.batch_decode_perturbation(em) + ori_candidate
+            if w[:, 1].any():
+                cand_norm = self.batch_candidate_norm(modified_index, modified_weight,
+                                                      ori_candidate + graph_weight)
+                loss = loss + w[:, 1] * torch.stack([calc_pairs(x, y) for x, y in zip(cand_norm, decoded)]) * \
+                    100 * Align_Parameter_Cora["c2"]
+            if w[:, 5].any():
+                loss = loss + w[:, 5] * self.batch_entropy(edge_index, norm_weight) * \
+                    100 * Align_Parameter_Cora["c6"]
+            if w[:, 6].any():
+                prob = torch.clamp(decoded, 1e-4, 1-1e-4)
+                loss = loss + w[:, 6] * -torch.mean(prob * torch.log2(prob), dim=1) * \
+                    Align_Parameter_Cora["c7"]
+            if w[:, 7].any():
+                loss = loss + w[:, 7] * torch.clamp(torch.sum(torch.abs(edge_weight), dim=1),
+                                                    min=0.01) * 0.0001 * Align_Parameter_Cora["c8"]
+            if w[:, 8].any():
+                loss = loss + w[:, 8] * torch.stack([calc(H_A, x) for x in em[:, idx_attack]]) * \
+                    Align_Parameter_Cora["c9"]
+            if w[:, 9].any():
+                prob = torch.softmax(output, dim=2)
+                loss = loss + w[:, 9] * torch.stack([calc(Y_A, x) for x in prob]) * \
+                    Align_Parameter_Cora["c10"]
+
+            # the configurations are independent, the sum keeps their gradients apart
+            torch.sum(active * loss).backward()
+            optimizer.step()
+            for p in self.adj_changes:
+                p.data.copy_(project_budget(p.data, num_edges))
+
+            if (t + 1) % report_every == 0:
+                for b, callback in enumerate(callbacks):
+                    if callback is None or self.pruned[b]:
+                        continue
+                    try:
+                        callback(t + 1, (self.candidates, self.adj_changes[b].detach()))
+                    except TrialPruned:
+                        self.pruned[b] = True
+                        active[b] = 0
+                        optimizer.param_groups[b]['lr'] = 0
+                if all(self.pruned):
+                    break
+
+        with torch.no_grad():
+            edge_weight = torch.stack(list(self.adj_changes)).detach()
+            adj_norm = self.model_input(*self.get_batched_adj(
+                ori_edge_index, ori_edge_weight, edge_weight), B * N)
+            self.embedding.set_layers(1)
+            H_A1 = self.embedding(batch_features, adj_norm).view(B, N, -1)
+            self.embedding.set_layers(2)
+            H_A2 = self.embedding(batch_features, adj_norm).view(B, N, -1)
+            Y_A2 = victim_model(batch_features, adj_norm).view(B, N, -1)
+
+            shared = self.fused_score(features, labels, [])
+            scores = edge_weight + shared
+            for Z in [H_A1, H_A2, Y_A2]:
+                scores = scores + torch.stack([self.decode_source(z).pairs(self.candidates) for z in Z])
+
+        self.edge_index = self.candidates
+        self.edge_scores = scores
+        row, col = self.candidates.cpu().numpy()
+        self.modified_adj = [sp.coo_matrix((score, (row, col)), shape=(N, N))
+                             for score in scores.cpu().numpy()]
+
+        return 0, 0, 0, 0
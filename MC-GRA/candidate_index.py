@@ -0,0 +1,103 @@
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+
+def blocked_topk(Z, k, block_size=1024, normalize=True):
+    """Exact top-k nearest neighbours of every row of Z under the inner product,
+    evaluated in row blocks so that only a [block_size, N] slice of Z @ Z.T
+    exists at any time.
+
+    Parameters
+    ----------
+    Z : torch.Tensor
+        [N, d] node embeddings
+    k : int
+        number of neighbours per node (self excluded)
+    block_size : int
+        number of rows scored at once
+    normalize : bool
+        whether to L2-normalize the rows first (cosine similarity)
+
+    Returns
+    -------
+    tuple
+        (scores, indices), both of shape [N, k]
+    """
+    Z = Z.detach().float()
+    if normalize:
+        Z = F.normalize(Z, p=2, dim=1)
+    n = Z.shape[0]
+    k = min(k, n - 1)
+    scores, indices = [], []
+    for start in range(0, n, block_size):
+        end = min(start + block_size, n)
+        sim = torch.matmul(Z[start:end], Z.t())
+        rows = torch.arange(end - start, device=Z.device)
+        sim[rows, rows + start] = -float('inf')
+        s, i = torch.topk(sim, k, dim=1)
+        scores.append(s)
+        indices.append(i)
+    return torch.cat(scores), torch.cat(indices)
+
+
+def approx_topk(Z, k, n_proj=32, oversample=4, block_size=1024, normalize=True, seed=0):
+    """Approximate top-k: shortlist k * oversample neighbours with a random
+    projection sketch of Z, then re-rank the shortlist with the exact scores.
+    """
+    Z = Z.detach().float()
+    if normalize:
+        Z = F.normalize(Z, p=2, dim=1)
+    if Z.shape[1] <= n_proj:
+        return blocked_topk(Z, k, block_size, normalize=False)
+
+    generator = torch.Generator(device='cpu').manual_seed(seed)
+    proj = torch.randn(Z.shape[1], n_proj, generator=generator).to(Z.device)
+    sketch = torch.matmul(Z, proj) / np.sqrt(n_proj)
+    _, shortlist = blocked_topk(sketch, k * oversample,
+                                block_size, normalize=False)
+
+    exact = torch.cat([(Z[s:s + block_size].unsqueeze(1) * Z[shortlist[s:s + block_size]]).sum(-1)
+                       for s in range(0, Z.shape[0], block_size)])
+    scores, order = torch.topk(exact, min(k, shortlist.shape[1]), dim=1)
+    return scores, torch.gather(shortlist, 1, order)
+
+
+def build_candidates(sources, k, idx=None, block_size=1024, approximate=False):
+    """Union of the per-node top-k neighbours under every score source.
+
+    Parameters
+    ----------
+    sources : list
+        embeddings ([N, d] tensors) whose inner products are the attack
+        priors, e.g. features, H_A and Y_A
+    k : int
+        neighbours kept per node and per source
+    idx : numpy.array
+        restrict the candidates to pairs among these nodes (idx_attack)
+    approximate : bool
+        use the random projection shortlist instead of the exact search
+
+    Returns
+    -------
+    torch.LongTensor
+        [2, M] unique lower-triangle candidate pairs (row > col)
+    """
+    search = approx_topk if approximate else blocked_topk
+    nnodes = sources[0].shape[0]
+    if idx is None:
+        idx = np.arange(nnodes)
+    idx = torch.as_tensor(np.sort(np.asarray(idx)), dtype=torch.long)
+
+    keys = []
+    for Z in sources:
+        Z = Z.to_dense() if Z.is_sparse else Z
+        _, neighbours = search(Z[idx.to(Z.device)], k, block_size=block_size)
+        neighbours = idx[neighbours.cpu()]
+        rows = idx.unsqueeze(1).expand_as(neighbours)
+        row = torch.maximum(rows, neighbours).reshape(-1)
+        col = torch.minimum(rows, neighbours).reshape(-1)
+        keys.append(row * nnodes + col)
+
+    keys = torch.unique(torch.cat(keys))
+    return torch.stack([keys // nnodes, keys % nnodes])
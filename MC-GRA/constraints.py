@@ -0,0 +1,145 @@
+from collections import OrderedDict
+
+import torch
+from forward_cache import frozen_forward
+from utils import Align_Parameter_Cora
+
+
+class ConstraintEngine(object):
+    """Weighted loss terms of an attack epoch, evaluated over a dependency
+    graph of their intermediates.
+
+    `node` registers an intermediate computed from other nodes or from the
+    inputs given to `evaluate`, `term` a loss term weight * fn(*deps). The
+    graph is planned once: only the nodes reachable from a term of non-zero
+    weight are computed, each once per `evaluate`, so a term of zero weight
+    costs nothing and an intermediate shared by several terms (adj_norm, the
+    embedding of the perturbation, a centered input) is computed once.
+    Static nodes (fixed targets such as feature_adj or H_A, and the nodes
+    only derived from them) are computed once, without gradients, and kept
+    across epochs.
+
+    >>> engine = ConstraintEngine()
+    >>> engine.node('adj_norm', utils.normalize_adj_tensor, ['modified_adj'])
+    >>> engine.term('c6', w6, Info_entropy, ['adj_norm'])
+    >>> loss, values = engine.evaluate(loss, modified_adj=modified_adj)
+    """
+
+    def __init__(self):
+        self.nodes = OrderedDict()
+        self.terms = OrderedDict()
+        self.static = set()
+        self.static_values = {}
+        self._plan = None
+
+    def node(self, name, fn, deps=(), static=False):
+        self.nodes[name] = (fn, list(deps))
+        if static or (deps and all(dep in self.static for dep in deps)):
+            self.static.add(name)
+        self._plan = None
+        return name
+
+    def term(self, name, weight, fn, deps=()):
+        self.terms[name] = (weight, fn, list(deps))
+        self._plan = None
+
+    def measure_term(self, name, weight, measure, x, y):
+        """weight * measure(x, y), with x and y prepared once per node
+        (`measures.Measure.prepare`) and shared with the other terms."""
+        if not hasattr(measure, 'prepare'):
+            return self.term(name, weight, measure, [x, y])
+        self.term(name, weight, measure.pair, [self.prepared(measure, x), self.prepared(measure, y)])
+
+    def prepared(self, measure, name):
+        key = '{}({})'.format(measure.name, name)
+        if key not in self.nodes:
+            self.node(key, measure.prepare, [name])
+        return key
+
+    def active(self):
+        return [name for name, (weight, _, _) in self.terms.items() if weight != 0]
+
+    def plan(self):
+        """Nodes needed by the active terms, in dependency order."""
+        if self._plan is None:
+            order, seen = [], set()
+
+            def visit(name):
+                if name in seen or name not in self.nodes:
+                    return
+                seen.add(name)
+                for dep in self.nodes[name][1]:
+                    visit(dep)
+                order.append(name)
+
+            for name in self.active():
+                for dep in self.terms[name][2]:
+                    visit(dep)
+            self._plan = order
+        return self._plan
+
+    def evaluate(self, loss=0, **inputs):
+        """Add the active terms to `loss`. Returns the loss and every computed
+        value (inputs, nodes and terms) by name."""
+        values = dict(inputs)
+        for name in self.plan():
+            fn, deps = self.nodes[name]
+            if name in self.static_values:
+                values[name] = self.static_values[name]
+            elif name in self.static:
+                with torch.no_grad():
+                    values[name] = self.static_values[name] = fn(*[values[dep] for dep in deps])
+            else:
+                values[name] = fn(*[values[dep] for dep in deps])
+        for name in self.active():
+            weight, fn, deps = self.terms[name]
+            values[name] = weight * fn(*[values[dep] for dep in deps])
+            loss = loss + values[name]
+        return loss, values
+
+
+def add_mcgra_terms(engine, attack, victim_model, calc, weight_param, ori_adj, adj, ori_features,
+                    feature_adj, idx_attack, entropy, calc2=None):
+    """The c1, c2, c6 .. c10 constraints of the dense MC-GRA attacks.
+
+    Every epoch provides `modified_adj` and `adj_norm`. The perturbation
+    embedding (depth 2) feeds both the decoded graph of c2 / c7 and c9, and
+    the victim is only run on `modified_adj` when c10 is active.
+    `calc2` (default `calc`) is the measure of c9 / c10.
+    """
+    w1, w2, _, _, _, w6, w7, w8, w9, w10 = weight_param
+    calc2 = calc if calc2 is None else calc2
+    embedding = attack.embedding
+
+    def embed(features, adj):
+        embedding.set_layers(2)
+        return embedding(features, adj)
+
+    def modified_after(em):
+        attack.adj_changes_after = attack.dot_product_decode(em)
+        return attack.get_modified_adj_after(ori_adj)
+
+    def H_A():
+        embedding.set_layers(2)
+        return frozen_forward(embedding, ori_features, adj)[idx_attack]
+
+    engine.node('em_after', lambda m: embed(ori_features, m - ori_adj), ['modified_adj'])
+    engine.node('modified_adj1', modified_after, ['em_after'])
+    engine.node('em_attack', lambda em: em[idx_attack], ['em_after'])
+    engine.node('H_A_attack', H_A, static=True)
+    engine.node('Y_A_attack', lambda: frozen_forward(victim_model, ori_features, adj)[idx_attack], static=True)
+    engine.node('output2', lambda m: victim_model(ori_features, m), ['modified_adj'])
+    engine.node('prob2_attack', lambda out: out[idx_attack].softmax(dim=1), ['output2'])
+
+    # feature_adj is fixed, c1 is dropped once for a constant one
+    w1 = w1 if feature_adj.max() != feature_adj.min() else 0
+    engine.node('feature_adj', lambda: feature_adj, static=True)
+    engine.measure_term('c1', w1 * 1000 * Align_Parameter_Cora["c1"], calc, 'feature_adj', 'adj_norm')
+    engine.measure_term('c2', w2 * 100 * Align_Parameter_Cora["c2"], calc, 'adj_norm', 'modified_adj1')
+    engine.term('c6', w6 * 100 * Align_Parameter_Cora["c6"], entropy, ['adj_norm'])
+    engine.term('c7', w7 * Align_Parameter_Cora["c7"], entropy, ['modified_adj1'])
+    engine.term('c8', w8 * 0.0001 * Align_Parameter_Cora["c8"],
+                lambda: attack.adj_changes.abs().sum().clamp(min=0.01))
+    engine.measure_term('c9', w9 * Align_Parameter_Cora["c9"], calc2, 'H_A_attack', 'em_attack')
+    engine.measure_term('c10', w10 * Align_Parameter_Cora["c10"], calc2, 'Y_A_attack', 'prob2_attack')
+    return engine
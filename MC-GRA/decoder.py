@@ -0,0 +1,252 @@
+import torch
+import torch.nn.functional as F
+
+
+class DecodeSource(object):
+    """Inner-product decoder relu(Z @ Z.T - I) of one embedding, evaluated one
+    row block at a time.
+
+    Parameters
+    ----------
+    Z : torch.Tensor
+        [N, d] embedding
+    weight : float
+        weight of this source in the fused score
+    normalize : bool
+        L2 (or `p`) normalize the rows of Z before the inner product
+    p : int
+        norm used by `normalize`
+    row_normalize : bool
+        L2 normalize the rows of Z @ Z.T (polblogs / usair variants)
+    sigmoid : bool
+        squash the decoded scores with a sigmoid
+    """
+
+    def __init__(self, Z, weight=1., normalize=True, p=2, row_normalize=False, sigmoid=False):
+        Z = Z.detach().float()
+        self.Z = F.normalize(Z, p=p, dim=1) if normalize else Z
+        self.weight = weight
+        self.row_normalize = row_normalize
+        self.sigmoid = sigmoid
+        self.row_norms = None
+
+    def gram_row_norms(self, block_size=1024):
+        # row norms of Z @ Z.T, needed to score single pairs under row_normalize
+        if self.row_norms is None:
+            n = self.Z.shape[0]
+            self.row_norms = torch.cat([torch.matmul(self.Z[s:s + block_size], self.Z.t()).norm(dim=1)
+                                        for s in range(0, n, block_size)])
+        return self.row_norms
+
+    def block(self, start, end):
+        block = torch.matmul(self.Z[start:end], self.Z.t())
+        if self.row_normalize:
+            block = F.normalize(block, p=2, dim=1)
+        rows = torch.arange(end - start, device=block.device)
+        block[rows, rows + start] -= 1
+        block = torch.relu(block)
+        if self.sigmoid:
+            block = torch.sigmoid(block)
+        return block
+
+    def pairs(self, edge_index, block_size=2 ** 20):
+        # at most [block_size, d] rows are gathered at a time
+        return torch.cat([self._pairs(row, col) for row, col in
+                          zip(edge_index[0].split(block_size), edge_index[1].split(block_size))])
+
+    def _pairs(self, row, col):
+        score = (self.Z[row] * self.Z[col]).sum(1)
+        if self.row_normalize:
+            score = score / self.gram_row_norms()[row].clamp(min=1e-12)
+        score = torch.relu(score - (row == col).float())
+        if self.sigmoid:
+            score = torch.sigmoid(score)
+        return score
+
+
+class DenseSource(object):
+    """A score that is already available per row block, e.g. the optimized
+    adjacency or the label-agreement matrix.
+
+    Parameters
+    ----------
+    block_fn : callable or torch.Tensor
+        block_fn(start, end) -> [end - start, N], or a dense [N, N] tensor
+    """
+
+    def __init__(self, block_fn, weight=1.):
+        self.matrix = block_fn if isinstance(block_fn, torch.Tensor) else None
+        self.block_fn = block_fn
+        self.weight = weight
+
+    def block(self, start, end):
+        if self.matrix is not None:
+            return self.matrix[start:end]
+        return self.block_fn(start, end)
+
+    def pairs(self, edge_index):
+        row, col = edge_index
+        if self.matrix is not None:
+            return self.matrix[row, col]
+        score = torch.zeros(row.shape[0])
+        for r in torch.unique(row):
+            mask = row == r
+            score[mask] = self.block_fn(int(r), int(r) + 1)[0, col[mask]].cpu()
+        return score.to(row.device)
+
+
+class LabelSource(object):
+    """Label-agreement score 1[y_i == y_j], kept as the rank-C product
+    onehot @ onehot.T instead of a dense N x N matrix.
+
+    Parameters
+    ----------
+    labels : torch.LongTensor
+        node labels
+    """
+
+    def __init__(self, labels, weight=1.):
+        self.labels = torch.as_tensor(labels, dtype=torch.long)
+        self.onehot = F.one_hot(self.labels).float()
+        self.weight = weight
+
+    def block(self, start, end):
+        return torch.matmul(self.onehot[start:end], self.onehot.t())
+
+    def pairs(self, edge_index):
+        row, col = edge_index
+        labels = self.labels.to(row.device)
+        return (labels[row] == labels[col]).float()
+
+
+class FusedDecoder(object):
+    """Weighted sum of several decoded score matrices, streamed in row blocks.
+
+    Peak memory is one [block_size, N] block per call instead of one dense
+    N x N tensor per source.
+
+    >>> decoder = FusedDecoder([DecodeSource(H_A), DecodeSource(features, sigmoid=True)])
+    >>> values, indices = decoder.topk(50)
+    >>> edge_index, edge_score = decoder.threshold(0.9)
+    """
+
+    def __init__(self, sources, nnodes=None, block_size=1024):
+        self.sources = sources
+        self.nnodes = nnodes if nnodes is not None else sources[0].Z.shape[0]
+        self.block_size = block_size
+
+    def blocks(self):
+        for start in range(0, self.nnodes, self.block_size):
+            end = min(start + self.block_size, self.nnodes)
+            fused = None
+            for source in self.sources:
+                block = source.weight * source.block(start, end)
+                fused = block if fused is None else fused + block
+            yield start, end, fused
+
+    def dense(self):
+        """Materialize the fused N x N score (small graphs / dense metrics)."""
+        return torch.cat([block for _, _, block in self.blocks()])
+
+    def mean(self):
+        """Mean of the fused score (the density of the reconstruction)."""
+        total = sum(block.sum() for _, _, block in self.blocks())
+        return total / self.nnodes ** 2
+
+    def topk(self, k):
+        """Streaming per-row top-k of the fused score, self loops excluded."""
+        values, indices = [], []
+        for start, end, block in self.blocks():
+            rows = torch.arange(end - start, device=block.device)
+            block[rows, rows + start] = -float('inf')
+            v, i = torch.topk(block, min(k, self.nnodes - 1), dim=1)
+            values.append(v)
+            indices.append(i)
+        return torch.cat(values), torch.cat(indices)
+
+    def threshold(self, tau):
+        """Lower-triangle pairs whose fused score exceeds tau, as (edge_index, values)."""
+        edge_index, values = [], []
+        for start, end, block in self.blocks():
+            rows = torch.arange(start, end, device=block.device).unsqueeze(1)
+            cols = torch.arange(self.nnodes, device=block.device).unsqueeze(0)
+            row, col = torch.nonzero((block > tau) & (cols < rows), as_tuple=True)
+            values.append(block[row, col])
+            edge_index.append(torch.stack([row + start, col]))
+        return torch.cat(edge_index, dim=1), torch.cat(values)
+
+    def pairs(self, edge_index):
+        """Fused score of the given pairs only."""
+        score = None
+        for source in self.sources:
+            s = source.weight * source.pairs(edge_index)
+            score = s if score is None else score + s
+        return score
+
+
+def dot_product_decode(Z, normalize=True, p=2, row_normalize=False, sigmoid=False):
+    """Dense relu(Z @ Z.T - I) decoder, shared by main.py and the attacks.
+    """
+    source = DecodeSource(Z, normalize=normalize, p=p,
+                          row_normalize=row_normalize, sigmoid=sigmoid)
+    return source.block(0, source.Z.shape[0])
+
+
+def feature_source(features, dataset):
+    """Per-dataset decoder of the feature prior feature_adj (main.py)."""
+    if dataset in ['cora', 'citeseer', 'AIDS']:
+        return DecodeSource(features, normalize=False, sigmoid=True)
+    return DecodeSource(features, normalize=True)
+
+
+def embedding_source(Z, args, parameterization='edge'):
+    """Per-dataset inner-product decoder of an embedding in the final fusion.
+
+    The rules are those of the dense attack of the given parameterization:
+    'edge' for topology_attack, 'gcn' / 'gaussian' for gcn_parameterized and
+    gaussian_parameterized.
+    """
+    Z = Z.detach()
+    if parameterization != 'edge':
+        if args.dataset in ['cora', 'citeseer']:
+            return DecodeSource(Z, normalize=False, sigmoid=True)
+        elif args.dataset == 'AIDS':
+            return DecodeSource(Z, normalize=False)
+        return DecodeSource(Z, normalize=True)
+
+    if args.dataset in ['cora', 'AIDS']:
+        return DecodeSource(Z, normalize=False, sigmoid=True)
+
+    elif args.dataset == 'citeseer':
+        return DecodeSource(Z, normalize=True, sigmoid=True)
+
+    elif args.dataset == 'brazil':
+        return DecodeSource(Z, normalize=False)
+
+    elif args.dataset in ['polblogs', 'usair']:
+        if args.dataset == 'polblogs' and \
+                args.useH_A and args.useY_A and args.useY:
+            return DecodeSource(Z, normalize=False, row_normalize=True)
+
+        elif args.dataset == 'usair' and \
+                args.useY and not args.useH_A and not args.useY_A:
+            return DecodeSource(Z, normalize=True, p=3)
+
+        elif args.dataset == 'usair' and \
+                not args.useY and args.useH_A and args.useY_A:
+            return DecodeSource(Z, normalize=True, p=2)
+
+        elif args.dataset == 'usair' and \
+                args.useY and args.useH_A and not args.useY_A:
+            return DecodeSource(Z, normalize=True, p=5)
+
+        return DecodeSource(Z, normalize=False, row_normalize=True)
+
+    return DecodeSource(Z, normalize=True)
+
+
+def label_agreement(labels):
+    """Dense 1[y_i == y_j] matrix, replacing the saved_data/<dataset>.npy file.
+    """
+    source = LabelSource(labels)
+    return source.block(0, source.labels.shape[0])
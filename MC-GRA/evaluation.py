@@ -0,0 +1,197 @@
+import numpy as np
+import scipy.sparse as sp
+import torch
+
+
+def rank_auc(pos, neg):
+    """Exact ROC AUC from positive and negative scores (Mann-Whitney U, ties count 1/2).
+    """
+    pos = np.sort(np.asarray(pos, dtype=np.float64))
+    counts = _RankCounts(pos)
+    counts.add(neg)
+    return counts.auc()
+
+
+class _RankCounts(object):
+    """Accumulates, for a fixed sorted set of positive scores, the rank
+    statistics of a stream of negative scores: enough for the exact AUC and AP.
+    """
+
+    def __init__(self, pos):
+        self.pos = pos
+        self.num_neg = 0
+        self.greater = 0.
+        self.ties = 0.
+        # neg_at[i]: number of negatives whose score falls in [pos[i], pos[i+1])
+        self.neg_at = np.zeros(len(pos) + 1, dtype=np.int64)
+
+    def add(self, neg, implicit=0, implicit_value=0.):
+        neg = np.asarray(neg, dtype=np.float64).reshape(-1)
+        if implicit > 0:
+            self._add(np.array([implicit_value]), weight=implicit)
+        if len(neg):
+            self._add(neg)
+
+    def _add(self, neg, weight=1):
+        left = np.searchsorted(self.pos, neg, side='left')
+        right = np.searchsorted(self.pos, neg, side='right')
+        self.num_neg += weight * len(neg)
+        self.greater += weight * float(np.sum(len(self.pos) - right))
+        self.ties += weight * float(np.sum(right - left))
+        np.add.at(self.neg_at, right, weight)
+
+    def auc(self):
+        if len(self.pos) == 0 or self.num_neg == 0:
+            return float('nan')
+        return (self.greater + 0.5 * self.ties) / (len(self.pos) * self.num_neg)
+
+    def ap(self):
+        """Average precision, each positive ranked at its score (ties count as hits)."""
+        if len(self.pos) == 0:
+            return float('nan')
+        npos = len(self.pos)
+        # negatives scoring >= pos[i]
+        neg_ge = np.cumsum(self.neg_at[::-1])[::-1][1:]
+        pos_ge = npos - np.searchsorted(self.pos, self.pos, side='left')
+        return float(np.mean(pos_ge / (pos_ge + neg_ge)))
+
+
+class EdgeEvaluator(object):
+    """AUC / AP of a reconstructed adjacency on several node subsets in a
+    single pass, without flattening |idx|^2 scores or calling roc_curve.
+
+    Scores are evaluated over unordered node pairs (i > j) of each subset.
+    The positives are the true edges; the negatives are either every
+    non-edge pair, streamed in row blocks (`mode='exact'`, exact rank
+    statistics), or a per-node stratified sample of non-edge pairs
+    (`mode='sampled'`).
+
+    Parameters
+    ----------
+    adj : scipy.sparse matrix
+        ground-truth adjacency
+    subsets : dict
+        name -> node indices, e.g. {'attack': idx_attack, 'train': idx_train}
+    mode : str
+        'exact' or 'sampled'
+    num_neg : int
+        number of negative pairs per positive pair in the 'sampled' mode
+    block_size : int
+        rows scored at once in the 'exact' mode
+    """
+
+    def __init__(self, adj, subsets, mode='exact', num_neg=10, block_size=1024, seed=0):
+        assert mode in ['exact', 'sampled'], 'mode should be exact or sampled'
+        self.adj = sp.csr_matrix(adj)
+        self.nnodes = self.adj.shape[0]
+        self.mode = mode
+        self.num_neg = num_neg
+        self.block_size = block_size
+        self.rng = np.random.RandomState(seed)
+
+        self.masks = {}
+        self.positives = {}
+        self.negatives = {}
+        lower = sp.tril(self.adj, k=-1).tocoo()
+        for name, idx in subsets.items():
+            mask = np.zeros(self.nnodes, dtype=bool)
+            mask[np.asarray(idx)] = True
+            keep = mask[lower.row] & mask[lower.col]
+            self.masks[name] = mask
+            self.positives[name] = np.vstack((lower.row[keep], lower.col[keep]))
+            if mode == 'sampled':
+                self.negatives[name] = self._sample_negatives(
+                    mask, self.positives[name].shape[1] * num_neg)
+
+    def _sample_negatives(self, mask, num):
+        # stratified by node: every node of the subset draws the same number of partners
+        nodes = np.nonzero(mask)[0]
+        per_node = max(1, int(np.ceil(num / max(len(nodes), 1))))
+        row = np.repeat(nodes, per_node)
+        col = nodes[self.rng.randint(0, len(nodes), size=len(row))]
+        keep = (row != col) & (np.asarray(self.adj[row, col]).reshape(-1) == 0)
+        row, col = row[keep], col[keep]
+        return np.vstack((np.maximum(row, col), np.minimum(row, col)))
+
+    def evaluate(self, inference_adj):
+        """Evaluate a dense score tensor / array, a `decoder.FusedDecoder`, or a
+        sparse (edge_index, edge_score) pair whose missing entries score 0.
+
+        Returns
+        -------
+        dict
+            name -> {'auc': float, 'ap': float}
+        """
+        if isinstance(inference_adj, tuple):
+            return self._evaluate_sparse(*inference_adj)
+        if self.mode == 'sampled':
+            return self._evaluate_pairs(inference_adj)
+        return self._evaluate_blocks(inference_adj)
+
+    def _score_pairs(self, inference_adj, pairs):
+        if hasattr(inference_adj, 'pairs'):
+            return inference_adj.pairs(torch.as_tensor(pairs)).cpu().numpy()
+        if isinstance(inference_adj, torch.Tensor):
+            return inference_adj[pairs[0], pairs[1]].detach().cpu().numpy()
+        return np.asarray(inference_adj[pairs[0], pairs[1]]).reshape(-1)
+
+    def _evaluate_pairs(self, inference_adj):
+        result = {}
+        for name in self.masks:
+            counts = _RankCounts(np.sort(self._score_pairs(
+                inference_adj, self.positives[name])))
+            counts.add(self._score_pairs(inference_adj, self.negatives[name]))
+            result[name] = {'auc': counts.auc(), 'ap': counts.ap()}
+        return result
+
+    def _blocks(self, inference_adj):
+        if hasattr(inference_adj, 'blocks'):
+            for start, end, block in inference_adj.blocks():
+                yield start, end, block.detach().cpu().numpy()
+            return
+        for start in range(0, self.nnodes, self.block_size):
+            end = min(start + self.block_size, self.nnodes)
+            block = inference_adj[start:end]
+            if isinstance(block, torch.Tensor):
+                block = block.detach().cpu().numpy()
+            yield start, end, np.asarray(block)
+
+    def _evaluate_blocks(self, inference_adj):
+        counts = {name: _RankCounts(np.sort(self._score_pairs(inference_adj, self.positives[name])))
+                  for name in self.masks}
+        cols = np.arange(self.nnodes)
+        for start, end, block in self._blocks(inference_adj):
+            truth = self.adj[start:end].toarray() != 0
+            lower = cols[None, :] < np.arange(start, end)[:, None]
+            for name, mask in self.masks.items():
+                keep = lower & ~truth & mask[start:end, None] & mask[None, :]
+                counts[name].add(block[keep])
+        return {name: {'auc': c.auc(), 'ap': c.ap()} for name, c in counts.items()}
+
+    def _evaluate_sparse(self, edge_index, edge_score):
+        edge_index = edge_index.cpu().numpy() if isinstance(
+            edge_index, torch.Tensor) else np.asarray(edge_index)
+        edge_score = edge_score.detach().cpu().numpy() if isinstance(
+            edge_score, torch.Tensor) else np.asarray(edge_score)
+        row = np.maximum(edge_index[0], edge_index[1])
+        col = np.minimum(edge_index[0], edge_index[1])
+        scores = sp.csr_matrix((edge_score, (row, col)),
+                               shape=(self.nnodes, self.nnodes))
+        truth = np.asarray(self.adj[row, col]).reshape(-1) != 0
+
+        result = {}
+        for name, mask in self.masks.items():
+            pos = self.positives[name]
+            counts = _RankCounts(
+                np.sort(np.asarray(scores[pos[0], pos[1]]).reshape(-1)))
+            keep = mask[row] & mask[col] & ~truth & (row != col)
+            size = int(mask.sum())
+            total_neg = size * (size - 1) // 2 - pos.shape[1]
+            if self.mode == 'sampled':
+                neg = self.negatives[name]
+                counts.add(np.asarray(scores[neg[0], neg[1]]).reshape(-1))
+            else:
+                counts.add(edge_score[keep],
+                           implicit=total_neg - int(keep.sum()))
+            result[name] = {'auc': counts.auc(), 'ap': counts.ap()}
+        return result
@@ -0,0 +1,108 @@
+from collections import OrderedDict
+
+import torch
+
+
+def _input_key(x):
+    # the cache keeps a reference to every input, so id() cannot be reused;
+    # _version changes on any in-place update of a dense tensor
+    if isinstance(x, torch.Tensor) and not x.is_sparse:
+        return (id(x), x._version, tuple(x.shape))
+    return (id(x), )
+
+
+def _parameters(model):
+    # the models keep their layers in plain lists (self.gc, self.attentions),
+    # which model.parameters() does not see
+    params = list(model.parameters())
+    for module in model.modules():
+        for value in vars(module).values():
+            if isinstance(value, (list, tuple)):
+                for layer in value:
+                    if isinstance(layer, torch.nn.Module):
+                        params.extend(layer.parameters())
+    return params
+
+
+def _nbytes(out):
+    if isinstance(out, torch.Tensor):
+        if out.is_sparse:
+            return _nbytes(out._indices()) + _nbytes(out._values())
+        return out.element_size() * out.nelement()
+    if isinstance(out, (list, tuple)):
+        return sum(_nbytes(x) for x in out)
+    return 0
+
+
+def model_version(model):
+    """Changes whenever a parameter is updated in place (optimizer step,
+    load_state_dict) or replaced."""
+    return tuple((id(p), p._version) for p in _parameters(model))
+
+
+class FrozenForwardCache(object):
+    """Memo of forwards of frozen models on fixed inputs, e.g. H_A1, H_A2 and
+    Y_A on the fixed adjacency, or the embedding of the features on the
+    identity, which the attacks would otherwise recompute every epoch.
+
+    An entry is keyed by the model, its current depth (`nlayer`), its
+    parameter versions and the identity / version of every input, so it is
+    invalidated as soon as any of them changes. Models in training mode are
+    never cached (dropout). Results are computed without gradients: they
+    only serve as fixed targets of the attack losses.
+
+    The memo holds at most `max_entries` results and `max_bytes` bytes of
+    outputs, the least recently used go first; a result larger than
+    `max_bytes` is returned without being kept.
+
+    >>> frozen_forward = FrozenForwardCache()
+    >>> embedding.set_layers(1)
+    >>> H_A1 = frozen_forward(embedding, features, adj)
+    """
+
+    def __init__(self, max_entries=32, max_bytes=2 ** 30):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.entries = OrderedDict()
+
+    def __call__(self, model, *inputs):
+        if model.training:
+            return model(*inputs)
+        key = (id(model), getattr(model, 'nlayer', None), model_version(model),
+               tuple(_input_key(x) for x in inputs))
+        return self._get(key, (model, ) + inputs, lambda: model(*inputs))
+
+    def apply(self, fn, *inputs):
+        """Cache fn(*inputs), e.g. the decoded adjacency of a cached embedding.
+        A bound method is keyed by its instance too, and by the instance's
+        parameter versions if it is a module."""
+        owner = getattr(fn, '__self__', None)
+        key = (id(getattr(fn, '__func__', fn)), id(owner),
+               model_version(owner) if isinstance(owner, torch.nn.Module) else None,
+               tuple(_input_key(x) for x in inputs))
+        # fn (a bound method holds its instance) stays referenced, ids are not reused
+        return self._get(key, (fn, ) + inputs, lambda: fn(*inputs))
+
+    def _get(self, key, refs, compute):
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return self.entries[key][1]
+        with torch.no_grad():
+            out = compute()
+        size = _nbytes(out)
+        if size > self.max_bytes:
+            return out
+        self.entries[key] = (refs, out, size)
+        self.nbytes += size
+        while len(self.entries) > self.max_entries or self.nbytes > self.max_bytes:
+            self.nbytes -= self.entries.popitem(last=False)[1][2]
+        return out
+
+    def clear(self):
+        self.entries.clear()
+        self.nbytes = 0
+
+
+# shared by the attacks, so frozen forwards are also reused across search trials
+frozen_forward = FrozenForwardCache()
@@ -1,14 +1,20 @@
 
 from copy import deepcopy
 
+import decoder
+from forward_cache import frozen_forward
 import matplotlib.pyplot as plt
+import measures
 import numpy as np
 import scipy.sparse as sp
 import torch
+import triangular
 import utils
 from base_attack import BaseAttack
+from constraints import ConstraintEngine, add_mcgra_terms
+from noise import AdjacencyNoise
 from sklearn.metrics import auc, average_precision_score, roc_curve
-from torch.nn import KLDivLoss, MSELoss
+from torch.nn import KLDivLoss
 from torch.nn import functional as F
 from torchmetrics import AUROC
 from tqdm import tqdm
@@ -66,10 +72,7 @@ def metric_pool(ori_adj, inference_adj, idx, index_delete):
 
 
 def dot_product_decode(Z):
-    Z = F.normalize(Z, p=2, dim=1)
-    Z = torch.matmul(Z, Z.t())
-    adj = torch.relu(Z-torch.eye(Z.shape[0]).to("cuda"))
-    return adj
+    return decoder.dot_product_decode(Z, normalize=True)
 
 
 def sampling_MI(prob, tau=0.5, reduction='mean'):
@@ -110,8 +113,6 @@ class PGDAttack(BaseAttack):
         self.modified_features = None
         self.edge_select = None
         self.features = features.to(device)
-        self.complementary = None
-        self.complementary_after = None
         self.embedding = embedding
         self.H_A = H_A
         self.Y_A = Y_A
@@ -156,6 +157,7 @@ class PGDAttack(BaseAttack):
             num_edges:              no use in attack.
             epochs:                 epochs for recovery training.
             dropout_rate:           dropout rate in testing.
+            candidates:             (keyword) [2, M] candidate pairs, perturbed by --noise sparse.
         '''
 
         if args.max_eval == 1:
@@ -174,8 +176,6 @@ class PGDAttack(BaseAttack):
         victim_model.eval()
         self.embedding.eval()
         adj = adj.to(self.device)
-        label_adj = np.load("./saved_data/"+args.dataset+".npy")
-        label_adj = torch.Tensor(label_adj).to(self.device)
 
         # lists for drawing
         acc_test_list = []
@@ -188,8 +188,8 @@ class PGDAttack(BaseAttack):
         self.delete_eye(modified_adj)
 
         adj_tmp = torch.eye(adj_norm.shape[0]).to(self.device)
-        em = self.embedding(ori_features, adj_tmp)
-        adj_changes = self.dot_product_decode(em)
+        em = frozen_forward(self.embedding, ori_features, adj_tmp)
+        adj_changes = frozen_forward.apply(self.dot_product_decode, em)
 
         feature_adj = feature_adj.to(self.device)
         w1, w2, _, _, _, w6, w7, w8, w9, w10 = weight_param
@@ -201,118 +201,29 @@ class PGDAttack(BaseAttack):
             w7 = args.w8
             w9 = args.w9
             w10 = args.w10
+        # resolved once, the estimators are reused by every epoch (and trial)
+        calc = measures.resolve(args.measure, self.device)
+        engine = add_mcgra_terms(ConstraintEngine(), self, victim_model, calc,
+                                 [w1, w2, 0, 0, 0, w6, w7, w8, w9, w10], ori_adj, adj, ori_features,
+                                 feature_adj, idx_attack, Info_entropy)
+        noise = AdjacencyNoise.from_args(args, kwargs.get('candidates'), self.device)
         for t in tqdm(range(epochs)):
             optimizer.zero_grad()
             modified_adj = self.get_modified_adj(ori_adj)
-            modified_adj = self.adding_noise(modified_adj, args.eps)
+            modified_adj = noise(modified_adj, t)
             adj_norm = utils.normalize_adj_tensor(modified_adj)
             output = victim_model(ori_features, adj_norm)
-            adj_tmp = torch.eye(adj_norm.shape[0]).to(self.device)
-            em = self.embedding(ori_features, adj_tmp)
-            adj_changes = self.dot_product_decode(em)
+            # the embedding on the identity does not depend on adj_changes
+            em = frozen_forward(self.embedding, ori_features, adj_tmp)
+            adj_changes = frozen_forward.apply(self.dot_product_decode, em)
 
             origin_loss = self._loss(output[idx_attack], labels[idx_attack]) + torch.norm(self.adj_changes,
                                                                                           p=2) * 0.001
             origin_loss_list.append(origin_loss.item())
             loss = weight_supervised*origin_loss
-            self.embedding.set_layers(1)
-            H_A1 = self.embedding(ori_features, adj)
+            # zero-weight terms are skipped, shared intermediates are computed once
             self.embedding.set_layers(2)
-            H_A2 = self.embedding(ori_features, adj)
-            Y_A = victim_model(ori_features, adj)
-
-            em = self.embedding(ori_features, modified_adj-ori_adj)
-            self.adj_changes_after = self.dot_product_decode(em)
-            modified_adj1 = self.get_modified_adj_after(ori_adj)
-            adj_norm2 = utils.normalize_adj_tensor(modified_adj1)
-
-            CKA = CudaCKA(device=self.device)
-            calc = CKA.linear_HSIC
-            calc2 = MSELoss()
-
-            if args.measure == "MSELoss":
-                calc = MSELoss()
-
-            if args.measure == "KL":
-                calc = self.calc_kl
-            if args.measure == "KDE":
-                calc = MutualInformation(
-                    sigma=0.4, num_bins=feature_adj.shape[0], normalize=True)
-
-            if args.measure == "CKA":
-                CKA = CudaCKA(device=self.device)
-                calc = CKA.linear_CKA
-
-            if args.measure == "DP":
-                calc = self.dot_product
-
-            # 10 constrains area:
-            c1 = c2 = _ = _ = _ = c6 = c7 = c8 = c9 = c10 = 0
-            if w1 != 0 and feature_adj.max() != feature_adj.min():
-                c1 = w1 * calc(feature_adj, adj_norm)*1000 * \
-                    Align_Parameter_Cora["c1"]
-                if args.measure == "KDE":
-                    loss += c1[0]
-                elif args.measure == "HSIC":
-                    loss += -c1
-                else:
-                    loss += c1
-            if w2 != 0:
-                c2 = w2 * calc(adj_norm, modified_adj1) * \
-                    100*Align_Parameter_Cora["c2"]
-                if args.measure == "KDE":
-                    loss += c2[0]
-                elif args.measure == "HSIC":
-                    loss += -c2
-                else:
-                    loss += c2
-            if w6 != 0:
-                c6 = w6 * Info_entropy(adj_norm)*100*Align_Parameter_Cora["c6"]
-                loss += c6
-            if w7 != 0:
-                c7 = w7 * Info_entropy(modified_adj1) * \
-                    Align_Parameter_Cora["c7"]
-                loss += c7
-            if w8 != 0:
-                c8 = w8 * torch.clamp(torch.sum(torch.abs(self.adj_changes)),
-                                      min=0.01)*0.0001*Align_Parameter_Cora["c8"]
-                loss += c8
-            if w9 != 0:
-                num_layers = self.embedding.nlayer
-                for i in range(num_layers-1, num_layers):
-                    self.embedding.set_layers(i+1)
-                    em_cur = self.embedding(
-                        ori_features, modified_adj - ori_adj)
-                    H_A_cur = self.embedding(ori_features, adj)
-                    if args.measure == "KDE":
-                        calc2 = MutualInformation(
-                            sigma=0.4, num_bins=H_A1.shape[1], normalize=True)
-                        c9 = w9 * \
-                            (calc2(H_A_cur[idx_attack], em_cur[idx_attack])[
-                             0])*Align_Parameter_Cora["c9"]
-                    elif args.measure == "HSIC":
-                        c9 = -1 * w9 * \
-                            (calc(H_A_cur[idx_attack], em_cur[idx_attack])
-                             )*Align_Parameter_Cora["c9"]
-                    else:
-                        c9 = w9 * \
-                            (calc(H_A_cur[idx_attack], em_cur[idx_attack])
-                             )*Align_Parameter_Cora["c9"]
-                    loss += c9
-            output2 = victim_model(ori_features, modified_adj)
-            if w10 != 0:
-                if args.measure == "KDE":
-                    calc2 = MutualInformation(
-                        sigma=0.4, num_bins=Y_A.shape[1], normalize=True)
-                    c10 = w10 * calc2(Y_A[idx_attack], torch.softmax(output2[idx_attack], dim=1))[
-                        0]*Align_Parameter_Cora["c10"]
-                elif args.measure == "HSIC":
-                    c10 = -w10 * calc(Y_A[idx_attack], torch.softmax(
-                        output2[idx_attack], dim=1))*Align_Parameter_Cora["c10"]
-                else:
-                    c10 = w10 * calc(Y_A[idx_attack], torch.softmax(
-                        output2[idx_attack], dim=1))*Align_Parameter_Cora["c10"]
-                loss += c10
+            loss, _ = engine.evaluate(loss, modified_adj=modified_adj, adj_norm=adj_norm)
 
             loss.backward()
 
@@ -347,20 +258,18 @@ class PGDAttack(BaseAttack):
         self.embedding.set_layers(2)
         H_A2 = self.embedding(ori_features, self.modified_adj)
         Y_A2 = victim_model(ori_features, self.modified_adj)
-        ori_HA = self.dot_product_decode2(self.H_A.detach())
-        ori_YA = self.dot_product_decode2(self.Y_A.detach())
-        H_A1 = self.dot_product_decode2(H_A1.detach())
-        H_A2 = self.dot_product_decode2(H_A2.detach())
-        Y_A2 = self.dot_product_decode2(Y_A2.detach())
-        cur_adj = self.modified_adj + H_A1 + H_A2 + feature_adj + Y_A2
+        # fuse the score sources one row block at a time
+        sources = [decoder.DenseSource(self.modified_adj), self.decode_source(H_A1),
+                   self.decode_source(H_A2), decoder.DenseSource(feature_adj),
+                   self.decode_source(Y_A2)]
         if args.useH_A:
-            cur_adj = cur_adj + ori_HA
+            sources.append(self.decode_source(self.H_A))
         if args.useY_A:
-            cur_adj = cur_adj + ori_YA
+            sources.append(self.decode_source(self.Y_A))
         if args.useY:
-            cur_adj = cur_adj + label_adj
-
-        self.modified_adj = cur_adj.detach()
+            sources.append(decoder.LabelSource(labels))
+        # kept as row blocks, the evaluator streams them; .dense() if the matrix is needed
+        self.modified_adj = decoder.FusedDecoder(sources, nnodes=self.nnodes)
 
         return 0, 0, 0, 0
 
@@ -377,29 +286,12 @@ class PGDAttack(BaseAttack):
         return loss
 
     def projection(self, num_edges):
-        if torch.clamp(self.adj_changes, 0, 1).sum() > num_edges:
-            left = (self.adj_changes - 1).min()
-            right = self.adj_changes.max()
-            miu = self.bisection(left, right, num_edges, epsilon=1e-5)
-            self.adj_changes.data.copy_(torch.clamp(
-                self.adj_changes.data - miu, min=0, max=1))
-        else:
-            self.adj_changes.data.copy_(torch.clamp(
-                self.adj_changes.data, min=0, max=1))
+        self.adj_changes.data.copy_(utils.project_budget(self.adj_changes.data, num_edges))
 
     def get_modified_adj2(self, ori_adj, adj_changes):
 
-        if self.complementary is None:
-            self.complementary = torch.ones_like(
-                ori_adj) - torch.eye(self.nnodes).to(self.device)
-
-        m = torch.zeros((self.nnodes, self.nnodes)).to(self.device)
-        tril_indices = torch.tril_indices(
-            row=self.nnodes, col=self.nnodes, offset=-1)
-        m[tril_indices[0], tril_indices[1]] = adj_changes
-        m = m + m.t()
-
-        modified_adj = self.complementary * m + ori_adj
+        # sym(changes) has a zero diagonal, no complementary mask is needed
+        modified_adj = triangular.unpack(adj_changes, self.nnodes) + ori_adj
 
         return modified_adj
 
@@ -417,73 +309,24 @@ class PGDAttack(BaseAttack):
 
     def get_modified_adj_after(self, ori_adj):
 
-        if self.complementary_after is None:
-            self.complementary_after = torch.ones_like(
-                ori_adj) - torch.eye(self.nnodes).to(self.device)
-
-        m = torch.zeros((self.nnodes, self.nnodes)).to(self.device)
-        tril_indices = torch.tril_indices(
-            row=self.nnodes, col=self.nnodes, offset=-1)
-        m[tril_indices[0], tril_indices[1]] = self.adj_changes_after
-        m = m + m.t()
-
-        modified_adj = self.complementary_after * m + ori_adj
+        # sym(changes) has a zero diagonal, no complementary mask is needed
+        modified_adj = triangular.unpack(self.adj_changes_after, self.nnodes) + ori_adj
 
         return modified_adj
 
-    def bisection(self, a, b, num_edges, epsilon):
-        def func(x):
-            return torch.clamp(self.adj_changes - x, 0, 1).sum() - num_edges
-
-        miu = a
-        while ((b - a) >= epsilon):
-            miu = (a + b) / 2
-            # Check if middle point is root
-            if (func(miu) == 0.0):
-                break
-            # Decide the side to repeat the steps
-            if (func(miu) * func(a) < 0):
-                b = miu
-            else:
-                a = miu
-        # print("The value of root is : ","%.4f" % miu)
-        return miu
-
     def dot_product_decode(self, Z):
         Z = F.normalize(Z, p=2, dim=1)
-        A_pred = torch.relu(torch.matmul(Z, Z.t()))
-        tril_indices = torch.tril_indices(
-            row=self.nnodes, col=self.nnodes, offset=-1)
-        return A_pred[tril_indices[0], tril_indices[1]]
-
-    def dot_product_decode2(self, Z):
-        if self.args.dataset in ['cora', 'citeseer']:
-            Z = torch.matmul(Z, Z.t())
-            _adj = torch.relu(Z-torch.eye(Z.shape[0]).to(self.device))
-            _adj = torch.sigmoid(_adj)
-
-        elif self.args.dataset in ['polblogs', 'usair', 'brazil']:
-            Z = F.normalize(Z, p=2, dim=1)
-            Z = torch.matmul(Z, Z.t()).to(self.device)
-            _adj = torch.relu(Z-torch.eye(Z.shape[0]).to(self.device))
+        return torch.relu(triangular.pack(torch.matmul(Z, Z.t())))
 
-        elif self.args.dataset == 'AIDS':
-            Z = torch.matmul(Z, Z.t())
-            _adj = torch.relu(Z-torch.eye(Z.shape[0]).to(self.device))
-
-        return _adj
+    def decode_source(self, Z):
+        """Per-dataset inner-product decoder of the final fusion."""
+        return decoder.embedding_source(Z, self.args, 'gcn')
 
     def delete_eye(self, A):
         complementary = torch.ones_like(
             A) - torch.eye(self.nnodes).to(self.device)
         A = A*complementary
 
-    def adding_noise(self, modified_adj, eps=0):
-        noise = torch.randn_like(modified_adj)
-        modified_adj += noise*eps
-        modified_adj = torch.clamp(modified_adj, max=1, min=0)
-        return modified_adj
-
     def dot_product(self, X, Y):
         return torch.norm(torch.matmul(Y.t(), X), p=2)
 
@@ -1,19 +1,31 @@
 import argparse
+import artifact_cache
 import os
 import random
+import time
 from copy import deepcopy
 
 import baseline
+import batched_attack
+import candidate_index
+import decoder
 import gaussian_parameterized
 import gcn_parameterized
+import measures
 import numpy as np
+import partition_attack
+import scipy.sparse as sp
+import search
+import sparse_graph
 import torch
 import torch.nn.functional as F
 from dataset import Dataset
+from evaluation import EdgeEvaluator
 from models.gat import GAT, embedding_gat
 from models.gcn import GCN, embedding_GCN
 from models.graphsage import embedding_graphsage, graphsage
 from sklearn.metrics import auc, roc_curve
+from sparse_attack import SparsePGDAttack
 from topology_attack import PGDAttack
 from tqdm import tqdm
 from utils import *
@@ -42,17 +54,8 @@ def test(adj, features, labels, victim_model):
 
 
 def dot_product_decode(Z):
-    if args.dataset == 'cora' or args.dataset == 'citeseer' or args.dataset == 'AIDS':
-        Z = torch.matmul(Z, Z.t())
-        adj = torch.relu(Z-torch.eye(Z.shape[0]))
-        adj = torch.sigmoid(adj)
-
-    if args.dataset == 'brazil' or args.dataset == 'usair' or args.dataset == 'polblogs':
-        Z = F.normalize(Z, p=2, dim=1)
-        Z = torch.matmul(Z, Z.t())
-        adj = torch.relu(Z-torch.eye(Z.shape[0]))
-
-    return adj
+    source = decoder.feature_source(Z, args.dataset)
+    return source.block(0, source.Z.shape[0])
 
 
 def transfer_state_dict(pretrained_dict, model_dict):
@@ -129,6 +132,11 @@ parser.add_argument('--w9', type=float, default=0)
 parser.add_argument('--w10', type=float, default=0)
 parser.add_argument('--eps', type=float, default=0,
                     help="eps for adding noise")
+parser.add_argument('--noise', type=str, default='dense', choices=['dense', 'lowrank', 'sparse'],
+                    help="noise added to the perturbed adjacency: i.i.d. on every entry, low-rank, or only on the candidate pairs")
+parser.add_argument('--noise_rank', type=int, default=8, help="rank of the low-rank noise")
+parser.add_argument('--noise_seed', type=int, default=None,
+                    help="seed of the per-epoch noise, defaults to the torch seed of the run (or search trial)")
 
 parser.add_argument('--useH_A', action='store_true')
 parser.add_argument('--useY_A', action='store_true')
@@ -136,10 +144,53 @@ parser.add_argument('--useY', action='store_true')
 parser.add_argument('--ensemble', action='store_true')
 parser.add_argument('--add_noise', action='store_true')
 parser.add_argument('--defense', action='store_true')
+parser.add_argument('--sparse', action='store_true',
+                    help="optimize an edge list of candidate pairs instead of the dense N x N adjacency")
+parser.add_argument('--parameterization', type=str, default='edge',
+                    choices=['edge', 'gcn', 'gaussian'], help="edge parameterization of the sparse attack")
+parser.add_argument('--candidate_k', type=int, default=0,
+                    help="top-k neighbours per node (from X, H_A and Y_A) kept as candidate pairs, 0 keeps all pairs")
+parser.add_argument('--candidate_block', type=int, default=1024,
+                    help="row block size of the candidate top-k search")
+parser.add_argument('--eval_mode', type=str, default='exact', choices=['exact', 'sampled', 'legacy'],
+                    help="AUC evaluator: exact rank statistics, sampled negatives, or the legacy roc_curve path")
+parser.add_argument('--eval_neg', type=int, default=10,
+                    help="negative pairs per positive pair in the sampled evaluator")
+parser.add_argument('--workers', type=int, default=1,
+                    help="parallel trials in search mode, 0 uses every core")
+parser.add_argument('--patience', type=int, default=0,
+                    help="stop the search after this many trials without improvement, 0 disables it")
+parser.add_argument('--prune', action='store_true',
+                    help="prune trials whose intermediate loss is worse than the median")
+parser.add_argument('--prune_every', type=int, default=20,
+                    help="epochs between the intermediate AUC reports of a search trial")
+parser.add_argument('--no_cache', action='store_true',
+                    help="always retrain the victim model instead of using the artifact cache")
+parser.add_argument('--cache_dir', type=str, default='./cache',
+                    help="directory of the cached victim models and embeddings")
+parser.add_argument('--partitions', type=int, default=0,
+                    help="attack idx_attack in this many node clusters independently (sparse mode), 0 disables it")
+parser.add_argument('--partition_method', type=str, default='kmeans', choices=['kmeans', 'label', 'random'],
+                    help="how idx_attack is clustered for the partitioned attack")
+parser.add_argument('--halo_hops', type=int, default=1,
+                    help="k-hop halo (on the feature kNN graph) added around every cluster")
+parser.add_argument('--approx_candidates', action='store_true',
+                    help="use the approximate (random projection) candidate search")
+parser.add_argument('--sage_batch_size', type=int, default=0,
+                    help="train the sage victim on mini-batches of this many nodes (0: full batch)")
+parser.add_argument('--sage_fanouts', type=str, default='',
+                    help="neighbours sampled per layer in sage mini-batch training, e.g. 10,10 (empty: all)")
+parser.add_argument('--batch_configs', type=int, default=1,
+                    help="search configurations attacked together in one batched sparse attack (needs --sparse)")
+parser.add_argument('--compile_measures', action='store_true',
+                    help="wrap the --measure estimators in torch.compile")
+parser.add_argument('--profile_measures', action='store_true',
+                    help="time every --measure call and print the cost per measure at the end")
 
 args = parser.parse_args()
 
 device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
+measures.options.update(compile=args.compile_measures, profile=args.profile_measures)
 np.random.seed(args.seed)
 random.seed(args.seed)
 torch.manual_seed(args.seed)
@@ -161,19 +212,38 @@ num_edges = int(0.5 * args.density * adj.sum() /
                 adj.shape[0]**2 * len(idx_attack)**2)
 
 adj, features, labels = preprocess(
-    adj, features, labels, preprocess_adj=False, onehot_feature=False)
-
-feature_adj = dot_product_decode(features)
-if args.nofeature:
-    feature_adj = torch.eye(*feature_adj.size())
+    adj, features, labels, preprocess_adj=False, onehot_feature=False, sparse=args.sparse)
+
+# trained victim / embeddings are reused across runs with the same key
+cache = None if args.no_cache else artifact_cache.ArtifactCache(args.cache_dir)
+sage_training = {}
+if args.arch == 'sage' and args.sage_batch_size > 0:
+    sage_training = {'batch_size': args.sage_batch_size,
+                     'fanouts': [int(f) for f in args.sage_fanouts.split(',')] if args.sage_fanouts else None}
+cache_key = None if cache is None else cache.key(
+    dataset=args.dataset, arch=args.arch, nlayers=args.nlayers, hidden=args.hidden,
+    seed=args.seed, defense=args.defense, nofeature=args.nofeature, sparse=args.sparse, **sage_training)
+cached = cache is not None and cache.has(cache_key)
+
+if args.sparse:
+    # keep the adjacency as a sparse tensor, nothing N x N is materialized
+    features = features.to_dense()
+    feature_adj = None
+else:
+    if cached and cache.has_array(cache_key, 'feature_adj'):
+        feature_adj = cache.load_array(cache_key, 'feature_adj')
+    else:
+        feature_adj = dot_product_decode(features)
+    if args.nofeature:
+        feature_adj = torch.eye(*feature_adj.size())
 
-init_adj = torch.FloatTensor(init_adj.todense())
+    init_adj = torch.FloatTensor(init_adj.todense())
 
 
 # Setup Victim Model
 
 if args.arch == "gcn":
-    victim_model = GCN(nfeat=features.shape[1], nclass=labels.max().item() + 1, nhid=16, nlayer=args.nlayers,
+    victim_model = GCN(nfeat=features.shape[1], nclass=labels.max().item() + 1, nhid=args.hidden, nlayer=args.nlayers,
                        dropout=0.5, weight_decay=5e-4, device=device)
     if args.defense:
         victim_model.load_state_dict(torch.load(
@@ -181,10 +251,15 @@ if args.arch == "gcn":
         victim_model = victim_model.to(device)
     else:
         victim_model = victim_model.to(device)
-        victim_model.fit(features, adj, labels, idx_train, idx_val)
+        if cached:
+            victim_model.load_state_dict(
+                cache.load_state(cache_key, 'victim', device))
+            victim_model.eval()
+        else:
+            victim_model.fit(features, adj, labels, idx_train, idx_val)
 
     embedding = embedding_GCN(
-        nfeat=features.shape[1], nhid=16, nlayer=args.nlayers, device=device)
+        nfeat=features.shape[1], nhid=args.hidden, nlayer=args.nlayers, device=device)
     embedding.load_state_dict(transfer_state_dict(
         victim_model.state_dict(), embedding.state_dict()))
 
@@ -192,7 +267,7 @@ if args.arch == "gcn":
 
 
 if args.arch == 'sage':
-    victim_model = graphsage(nfeat=features.shape[1], nclass=labels.max().item() + 1, nhid=16, nlayer=args.nlayers,
+    victim_model = graphsage(nfeat=features.shape[1], nclass=labels.max().item() + 1, nhid=args.hidden, nlayer=args.nlayers,
                              dropout=0.5, weight_decay=5e-4, device=device)
 
     if args.defense:
@@ -201,10 +276,15 @@ if args.arch == 'sage':
         victim_model = victim_model.to(device)
     else:
         victim_model = victim_model.to(device)
-        victim_model.fit(features, adj, labels, idx_train, idx_val)
+        if cached:
+            victim_model.load_state_dict(
+                cache.load_state(cache_key, 'victim', device))
+            victim_model.eval()
+        else:
+            victim_model.fit(features, adj, labels, idx_train, idx_val, **sage_training)
 
     embedding = embedding_graphsage(
-        nfeat=features.shape[1], nhid=16, nlayer=args.nlayers, device=device)
+        nfeat=features.shape[1], nhid=args.hidden, nlayer=args.nlayers, device=device)
     embedding.load_state_dict(transfer_state_dict(
         victim_model.state_dict(), embedding.state_dict()))
     # print(victim_model.state_dict().keys())
@@ -212,7 +292,7 @@ if args.arch == 'sage':
 
 
 if args.arch == 'gat':
-    victim_model = GAT(nfeat=features.shape[1], nclass=labels.max().item() + 1, nhid=16, nlayer=args.nlayers,
+    victim_model = GAT(nfeat=features.shape[1], nclass=labels.max().item() + 1, nhid=args.hidden, nlayer=args.nlayers,
                        dropout=0.5, alpha=0.1, nheads=5, device=device)
 
     if args.defense:
@@ -221,10 +301,15 @@ if args.arch == 'gat':
         victim_model = victim_model.to(device)
     else:
         victim_model = victim_model.to(device)
-        victim_model.fit(features, adj, labels, idx_train,
-                         idx_val, train_iters=200)
-
-    embedding = embedding_gat(nfeat=features.shape[1], nclass=labels.max().item() + 1, nhid=16, nlayer=args.nlayers,
+        if cached:
+            victim_model.load_state_dict(
+                cache.load_state(cache_key, 'victim', device))
+            victim_model.eval()
+        else:
+            victim_model.fit(features, adj, labels, idx_train,
+                             idx_val, train_iters=200)
+
+    embedding = embedding_gat(nfeat=features.shape[1], nclass=labels.max().item() + 1, nhid=args.hidden, nlayer=args.nlayers,
                               dropout=0.5, alpha=0.1, nheads=5, device=device)
     embedding.load_state_dict(transfer_state_dict(
         victim_model.state_dict(), embedding.state_dict()))
@@ -233,13 +318,41 @@ if args.arch == 'gat':
 
 
 embedding = embedding.to(device)
-H_A = embedding(features.to(device), adj.to(device))
-Y_A = victim_model(features.to(device), adj.to(device))
+if cached:
+    H_A, Y_A, H_A1, H_A2 = [cache.load_array(cache_key, name).to(device)
+                            for name in ['H_A', 'Y_A', 'H_A1', 'H_A2']]
+    embedding.set_layers(2)
+    artifact_cache.set_rng_state(cache.load_state(cache_key, 'rng'))
+elif sage_training:
+    # batched like the training, on the same gcn-normalized neighbourhoods
+    def sage_embed():
+        return embedding.embed(features, adj, batch_size=args.sage_batch_size)
+
+    H_A = sage_embed()
+    with torch.no_grad():
+        Y_A = victim_model(features.to(device), sparse_graph.gcn_norm(
+            *sparse_graph.adj_to_edge_index(adj, device=device), adj.shape[0]))
+
+    embedding.set_layers(1)
+    H_A1 = sage_embed()
+    embedding.set_layers(2)
+    H_A2 = sage_embed()
+else:
+    H_A = embedding(features.to(device), adj.to(device))
+    Y_A = victim_model(features.to(device), adj.to(device))
+
+    embedding.set_layers(1)
+    H_A1 = embedding(features.to(device), adj.to(device))
+    embedding.set_layers(2)
+    H_A2 = embedding(features.to(device), adj.to(device))
 
-embedding.set_layers(1)
-H_A1 = embedding(features.to(device), adj.to(device))
-embedding.set_layers(2)
-H_A2 = embedding(features.to(device), adj.to(device))
+if cache is not None and not cached:
+    arrays = {'H_A': H_A, 'Y_A': Y_A, 'H_A1': H_A1, 'H_A2': H_A2}
+    if feature_adj is not None and not args.nofeature:
+        arrays['feature_adj'] = feature_adj
+    cache.save(cache_key, states={'victim': victim_model.state_dict(),
+                                  'rng': artifact_cache.get_rng_state()},
+               arrays=arrays)
 
 
 idx_attack = np.array(random.sample(
@@ -250,18 +363,18 @@ num_edges = int(0.5 * args.density * adj.sum() /
 
 # Setup Attack Model
 
-model = PGDAttack(model=victim_model, embedding=embedding,
-                  nnodes=adj.shape[0], loss_type='CE', device=device)
+if not args.sparse:
+    model = PGDAttack(model=victim_model, embedding=embedding,
+                      nnodes=adj.shape[0], loss_type='CE', device=device)
 
-model = model.to(device)
-
-baseline_model = baseline.PGDAttack(
-    model=victim_model, embedding=embedding, nnodes=adj.shape[0], loss_type="CE", device=device)
-baseline_model = baseline_model.to(device)
+    model = model.to(device)
 
+    baseline_model = baseline.PGDAttack(
+        model=victim_model, embedding=embedding, nnodes=adj.shape[0], loss_type="CE", device=device)
+    baseline_model = baseline_model.to(device)
 
-def objective(arg):
 
+def legacy_index_delete():
     ori_adj = adj.numpy()
     idx = idx_attack
     real_edge = ori_adj[idx, :][:, idx].reshape(-1)
@@ -279,6 +392,184 @@ def objective(arg):
     index_all = np.where(real_edge_all == 0)[0]
     index_delete_all = index_all[:int(
         len(real_edge_all)-2*np.sum(real_edge_all))]
+    return index_delete, index_delete_train, index_delete_all
+
+
+evaluator = None
+
+
+def get_evaluator():
+    global evaluator
+    if evaluator is None:
+        subsets = {'attack': idx_attack, 'train': idx_train,
+                   'all': np.arange(adj.shape[0])}
+        mode = 'sampled' if args.eval_mode == 'sampled' else 'exact'
+        evaluator = EdgeEvaluator(
+            data.adj, subsets, mode=mode, num_neg=args.eval_neg, seed=args.seed)
+    return evaluator
+
+
+sampled_evaluator = None
+
+
+def get_sampled_evaluator():
+    global sampled_evaluator
+    if sampled_evaluator is None:
+        sampled_evaluator = EdgeEvaluator(data.adj, {'attack': idx_attack}, mode='sampled',
+                                          num_neg=args.eval_neg, seed=args.seed)
+    return sampled_evaluator
+
+
+def pruning_callback(arg):
+    """Report the sampled-pair AUC of the current adjacency of a search trial
+    every --prune_every epochs and stop the trial if it is worse than the median
+    of the completed trials at that epoch (see search.MedianPruner)."""
+    trial = arg.get("trial")
+    if trial is None or args.prune_every <= 0:
+        return None
+
+    def callback(epoch, inference_adj):
+        auc = get_sampled_evaluator().evaluate(inference_adj)['attack']['auc']
+        if trial.should_prune(epoch, 1-auc):
+            raise search.TrialPruned()
+    return callback
+
+
+def evaluate_attack(inference_adj):
+    """AUC in the attack / train / whole graph, computed in a single pass."""
+    result = get_evaluator().evaluate(inference_adj)
+    print(f"current auc={result['all']['auc']}, ap={result['all']['ap']}")
+    return result['attack']['auc'], result['train']['auc'], result['all']['auc']
+
+
+def partition_objective(arg, lr, weight_param):
+    parts = partition_attack.partition_nodes(idx_attack, args.partitions, features=features,
+                                             labels=labels, method=args.partition_method, seed=args.seed)
+    # the true edges are the target, the halo is grown on a feature kNN graph
+    knn = candidate_index.build_candidates(
+        [features], max(args.candidate_k, 10), block_size=args.candidate_block,
+        approximate=args.approx_candidates).numpy()
+    halo_adj = sp.coo_matrix((np.ones(knn.shape[1]), (knn[0], knn[1])),
+                             shape=(adj.shape[0], adj.shape[0]))
+    model = partition_attack.PartitionAttack(victim_model, embedding, H_A2, Y_A, adj.shape[0], parts,
+                                             halo_adj + halo_adj.T, hops=args.halo_hops,
+                                             parameterization=args.parameterization,
+                                             n_workers=args.workers, device=device)
+    candidates = get_candidates() if args.candidate_k > 0 else None
+    model.attack(args, lr, arg["weight_sup"], weight_param, features, data.init_adj,
+                 labels, idx_attack, num_edges, epochs=args.epochs, candidates=candidates,
+                 callback=pruning_callback(arg))
+
+    auc, auc_train, auc_all = evaluate_attack(
+        (model.edge_index, model.edge_score))
+    if "trial" in arg:
+        arg["trial"].set_attrs(auc=auc, auc_train=auc_train, auc_all=auc_all)
+        return 1-auc
+
+    os.makedirs("./results/", exist_ok=True)
+    with open(os.path.join("./results", args.log_name), "a") as f:
+        f.write(f"current partition parameter: {args}\n")
+        f.write(f"In attack graph: AUC={auc}\t")
+        f.write(f"In train graph: AUC={auc_train}\t")
+        f.write(f"In Whole Graph: AUC={auc_all}\n")
+        f.write(f"partitions: {[len(p) for p in parts]}\n")
+        f.write(
+            "============================================================================================\n")
+    return 1-auc
+
+
+def get_weight_param(arg):
+    return (arg["w_feature_pgd"], arg["w_pgd_pgdembed"], arg["w_pgd_eyeembed"],
+            arg["w_pgdembed_feature"], arg["w_pgdembed_eyeembed"], arg["w_infoentropy_pgd"],
+            arg["w_infoentropy_pgdembed"], arg["w_size"], arg["w_HA"], arg["w_YA"])
+
+
+def get_candidates():
+    if args.candidate_k > 0:
+        return candidate_index.build_candidates(
+            [features, H_A, Y_A], args.candidate_k, idx=idx_attack,
+            block_size=args.candidate_block, approximate=args.approx_candidates)
+    return sparse_graph.pairs_within(idx_attack)
+
+
+def noise_pairs():
+    """Candidate pairs perturbed by --noise sparse in the dense attacks."""
+    if args.noise == 'sparse' and args.eps != 0:
+        return get_candidates()
+    return None
+
+
+def sparse_objective(arg):
+    lr = 10**arg["lrexp"]
+    weight_param = get_weight_param(arg)
+    args.measure = arg["measure"]
+    args.eps = arg["eps"]
+
+    if args.partitions > 0:
+        return partition_objective(arg, lr, weight_param)
+
+    candidates = get_candidates()
+    model = SparsePGDAttack(model=victim_model, embedding=embedding, H_A=H_A2, Y_A=Y_A,
+                            nnodes=adj.shape[0], candidates=candidates, features=features,
+                            parameterization=args.parameterization, loss_type='CE', device=device)
+    model = model.to(device)
+    model.attack(args, lr, arg["weight_sup"], weight_param, features, data.init_adj,
+                 labels, idx_attack, num_edges, epochs=args.epochs,
+                 callback=pruning_callback(arg), report_every=args.prune_every)
+
+    auc, auc_train, auc_all = evaluate_attack(
+        (model.edge_index, model.edge_score))
+    if "trial" in arg:
+        arg["trial"].set_attrs(auc=auc, auc_train=auc_train, auc_all=auc_all,
+                               candidates=candidates.shape[1])
+        return 1-auc
+
+    os.makedirs("./results/", exist_ok=True)
+    with open(os.path.join("./results", args.log_name), "a") as f:
+        f.write(f"current sparse parameter: {args}\n")
+        f.write(f"In attack graph: AUC={auc}\t")
+        f.write(f"In train graph: AUC={auc_train}\t")
+        f.write(f"In Whole Graph: AUC={auc_all}\n")
+        f.write(f"candidate pairs: {candidates.shape[1]}\n")
+        f.write(
+            "============================================================================================\n")
+    return 1-auc
+
+
+def batched_objective(arg_list):
+    """Attack the search configurations of `arg_list` together, one loss per
+    configuration (None if pruned), see batched_attack."""
+    args.measure = arg_list[0]["measure"]
+    args.eps = arg_list[0]["eps"]
+    configs = [{'lr': 10**arg["lrexp"], 'weight_sup': arg["weight_sup"],
+                'weight_param': get_weight_param(arg)} for arg in arg_list]
+    candidates = get_candidates()
+    model = batched_attack.BatchedSparsePGDAttack(model=victim_model, embedding=embedding, H_A=H_A2,
+                                                  Y_A=Y_A, nnodes=adj.shape[0], candidates=candidates,
+                                                  configs=configs, loss_type='CE', device=device)
+    model = model.to(device)
+    model.attack(args, features, data.init_adj, labels, idx_attack, num_edges, epochs=args.epochs,
+                 callbacks=[pruning_callback(arg) for arg in arg_list], report_every=args.prune_every)
+
+    losses = []
+    for arg, pruned, score in zip(arg_list, model.pruned, model.edge_scores):
+        if pruned:
+            losses.append(None)
+            continue
+        auc, auc_train, auc_all = evaluate_attack((model.edge_index, score))
+        arg["trial"].set_attrs(auc=auc, auc_train=auc_train, auc_all=auc_all,
+                               candidates=candidates.shape[1])
+        losses.append(1-auc)
+    return losses
+
+
+def objective(arg):
+    if args.sparse:
+        return sparse_objective(arg)
+
+    index_delete = None
+    if args.eval_mode == 'legacy':
+        index_delete, index_delete_train, index_delete_all = legacy_index_delete()
 
     lr = arg["lrexp"]
     lr = 10**lr
@@ -303,14 +594,24 @@ def objective(arg):
     model.attack(args, index_delete,
                  lr, 0, weight_sup, weight_param, feature_adj, 0, 0,
                  0, idx_train, idx_val,
-                 idx_test, adj, features, init_adj, labels, idx_attack, num_edges, 0, epochs=args.epochs)
+                 idx_test, adj, features, init_adj, labels, idx_attack, num_edges, 0, epochs=args.epochs,
+                 callback=pruning_callback(arg), report_every=args.prune_every)
 
-    inference_adj = model.modified_adj.cpu()
+    # a decoder.FusedDecoder, streamed in row blocks by the evaluator
+    inference_adj = model.modified_adj
     test(adj, features, labels, victim_model)
-    auc = metric_pool(adj, inference_adj, idx_attack, index_delete)
-    auc_train = metric_pool(adj, inference_adj, idx_train, index_delete_train)
-    auc_all = metric_pool(adj, inference_adj, np.arange(
-        adj.shape[0]), index_delete_all, True)
+    if args.eval_mode == 'legacy':
+        dense_adj = inference_adj.dense().cpu()
+        auc = metric_pool(adj, dense_adj, idx_attack, index_delete)
+        auc_train = metric_pool(adj, dense_adj, idx_train, index_delete_train)
+        auc_all = metric_pool(adj, dense_adj, np.arange(
+            adj.shape[0]), index_delete_all, True)
+    else:
+        auc, auc_train, auc_all = evaluate_attack(inference_adj)
+    if "trial" in arg:
+        arg["trial"].set_attrs(auc=auc, auc_train=auc_train, auc_all=auc_all,
+                               density=inference_adj.mean())
+        return 1-auc
 
     os.makedirs("./results/", exist_ok=True)
     with open(os.path.join("./results", args.log_name), "a") as f:
@@ -410,6 +711,52 @@ def evaluate():
     objective(arg)
 
 
+def search_space():
+    space = {
+        "lrexp": search.Uniform(-4, 0),
+        "weight_sup": search.Choice([0, 1]),
+        "measure": args.measure,
+        "eps": args.eps,
+    }
+    for name in ["w_feature_pgd", "w_pgd_pgdembed", "w_pgd_eyeembed", "w_pgdembed_feature",
+                 "w_pgdembed_eyeembed", "w_infoentropy_pgd", "w_infoentropy_pgdembed",
+                 "w_size", "w_HA", "w_YA"]:
+        space[name] = search.LogUniform(-4, 3, zero_prob=0.5)
+    return space
+
+
+def search_weights():
+    # computed once here and shared with the forked workers
+    search.share_memory(victim_model, embedding, features, adj, init_adj,
+                        feature_adj, H_A, H_A2, Y_A)
+    get_evaluator()
+    get_sampled_evaluator()
+    root = os.path.join("./results", "{}_{}".format(
+        os.path.splitext(args.log_name)[0], time.strftime("%Y%m%d-%H%M%S")))
+    store = search.ResultStore(root)
+    pruner = search.MedianPruner() if args.prune else None
+    if args.batch_configs > 1:
+        assert args.sparse and args.partitions == 0, \
+            '--batch_configs needs the (unpartitioned) sparse attack, add --sparse'
+    engine = search.SearchEngine(batched_objective if args.batch_configs > 1 else objective,
+                                 search_space(), store, n_workers=args.workers,
+                                 max_eval=args.max_eval, patience=args.patience,
+                                 pruner=pruner, seed=args.seed, device=device,
+                                 batch_size=args.batch_configs)
+    best = engine.run()
+
+    os.makedirs("./results/", exist_ok=True)
+    with open(os.path.join("./results", args.log_name), "a") as f:
+        f.write(f"search: {args}\n")
+        f.write(f"trials: {root}\n")
+        if best is not None:
+            f.write(f"best parameter: {best['params']}\n")
+            f.write(f"best result: {best['attrs']}\n")
+        f.write(
+            "============================================================================================\n")
+    return best
+
+
 def notrain_test():
 
     embedding.set_layers(1)
@@ -419,8 +766,7 @@ def notrain_test():
     H_A1 = dot_product_decode(H_A1.detach().cpu())
     H_A2 = dot_product_decode(H_A2.detach().cpu())
     Y_A2 = dot_product_decode(Y_A.detach().cpu())
-    label_adj = np.load("./saved_data/"+args.dataset+".npy")
-    label_adj = torch.Tensor(label_adj)
+    label_adj = decoder.label_agreement(labels)
 
     idx = np.arange(adj.shape[0])
     real_edge = adj[idx, :][:, idx].reshape(-1)
@@ -439,16 +785,9 @@ def notrain_test():
 
 
 def prepare():
-    n = adj.shape[0]
-    label_adj = [[0 for i in range(n)]for j in range(n)]
-    for i in tqdm(range(n)):
-        for j in range(n):
-            if labels[i] == labels[j]:
-                label_adj[i][j] = 1
-            else:
-                label_adj[i][j] = 0
-    label_adj = torch.Tensor(label_adj).numpy()
-    np.save("./saved_data/"+args.dataset+".npy", label_adj)
+    # the label-agreement matrix is now built on the fly from the one-hot
+    # labels (decoder.LabelSource), nothing needs to be saved beforehand
+    print("label agreement is computed on the fly, nothing to prepare")
 
 
 def eval_gaussian():
@@ -490,23 +829,9 @@ def eval_gcn():
 
 
 def gaussian_reparameterize_attack(arg):
-    ori_adj = adj.numpy()
-    idx = idx_attack
-    real_edge = ori_adj[idx, :][:, idx].reshape(-1)
-    index = np.where(real_edge == 0)[0]
-    index_delete = index[:int(len(real_edge)-2*np.sum(real_edge))]
-
-    idx = idx_train
-    real_edge_train = ori_adj[idx, :][:, idx].reshape(-1)
-    index_train = np.where(real_edge_train == 0)[0]
-    index_delete_train = index_train[:int(
-        len(real_edge_train)-2*np.sum(real_edge_train))]
-
-    idx = np.arange(adj.shape[0])
-    real_edge_all = ori_adj[idx, :][:, idx].reshape(-1)
-    index_all = np.where(real_edge_all == 0)[0]
-    index_delete_all = index_all[:int(
-        len(real_edge_all)-2*np.sum(real_edge_all))]
+    index_delete = None
+    if args.eval_mode == 'legacy':
+        index_delete, index_delete_train, index_delete_all = legacy_index_delete()
 
     lr = arg["lrexp"]
     lr = 10**lr
@@ -530,14 +855,20 @@ def gaussian_reparameterize_attack(arg):
     gaussian_model.attack(args, index_delete,
                           lr, 0, weight_sup, weight_param, feature_adj, 0, 0,
                           0, idx_train, idx_val,
-                          idx_test, adj, features, init_adj, labels, idx_attack, num_edges, 0, epochs=args.epochs)
+                          idx_test, adj, features, init_adj, labels, idx_attack, num_edges, 0, epochs=args.epochs,
+                          candidates=noise_pairs())
 
-    inference_adj = gaussian_model.modified_adj.cpu()
+    # a decoder.FusedDecoder, streamed in row blocks by the evaluator
+    inference_adj = gaussian_model.modified_adj
     test(adj, features, labels, victim_model)
-    auc = metric_pool(adj, inference_adj, idx_attack, index_delete)
-    auc_train = metric_pool(adj, inference_adj, idx_train, index_delete_train)
-    auc_all = metric_pool(adj, inference_adj, np.arange(
-        adj.shape[0]), index_delete_all)
+    if args.eval_mode == 'legacy':
+        dense_adj = inference_adj.dense().cpu()
+        auc = metric_pool(adj, dense_adj, idx_attack, index_delete)
+        auc_train = metric_pool(adj, dense_adj, idx_train, index_delete_train)
+        auc_all = metric_pool(adj, dense_adj, np.arange(
+            adj.shape[0]), index_delete_all, True)
+    else:
+        auc, auc_train, auc_all = evaluate_attack(inference_adj)
     os.makedirs("./results/", exist_ok=True)
     with open(os.path.join("./results", args.log_name), "a") as f:
         f.write(f"current gaussian parameter: {args}\n")
@@ -552,23 +883,9 @@ def gaussian_reparameterize_attack(arg):
 
 
 def gcn_reparameterize_attack(arg):
-    ori_adj = adj.numpy()
-    idx = idx_attack
-    real_edge = ori_adj[idx, :][:, idx].reshape(-1)
-    index = np.where(real_edge == 0)[0]
-    index_delete = index[:int(len(real_edge)-2*np.sum(real_edge))]
-
-    idx = idx_train
-    real_edge_train = ori_adj[idx, :][:, idx].reshape(-1)
-    index_train = np.where(real_edge_train == 0)[0]
-    index_delete_train = index_train[:int(
-        len(real_edge_train)-2*np.sum(real_edge_train))]
-
-    idx = np.arange(adj.shape[0])
-    real_edge_all = ori_adj[idx, :][:, idx].reshape(-1)
-    index_all = np.where(real_edge_all == 0)[0]
-    index_delete_all = index_all[:int(
-        len(real_edge_all)-2*np.sum(real_edge_all))]
+    index_delete = None
+    if args.eval_mode == 'legacy':
+        index_delete, index_delete_train, index_delete_all = legacy_index_delete()
 
     lr = arg["lrexp"]
     lr = 10**lr
@@ -592,14 +909,20 @@ def gcn_reparameterize_attack(arg):
     gcn_model.attack(args, index_delete,
                      lr, 0, weight_sup, weight_param, feature_adj, 0, 0,
                      0, idx_train, idx_val,
-                     idx_test, adj, features, init_adj, labels, idx_attack, num_edges, 0, epochs=args.epochs)
+                     idx_test, adj, features, init_adj, labels, idx_attack, num_edges, 0, epochs=args.epochs,
+                     candidates=noise_pairs())
 
-    inference_adj = gcn_model.modified_adj.cpu()
+    # a decoder.FusedDecoder, streamed in row blocks by the evaluator
+    inference_adj = gcn_model.modified_adj
     test(adj, features, labels, victim_model)
-    auc = metric_pool(adj, inference_adj, idx_attack, index_delete)
-    auc_train = metric_pool(adj, inference_adj, idx_train, index_delete_train)
-    auc_all = metric_pool(adj, inference_adj, np.arange(
-        adj.shape[0]), index_delete_all)
+    if args.eval_mode == 'legacy':
+        dense_adj = inference_adj.dense().cpu()
+        auc = metric_pool(adj, dense_adj, idx_attack, index_delete)
+        auc_train = metric_pool(adj, dense_adj, idx_train, index_delete_train)
+        auc_all = metric_pool(adj, dense_adj, np.arange(
+            adj.shape[0]), index_delete_all, True)
+    else:
+        auc, auc_train, auc_all = evaluate_attack(inference_adj)
     os.makedirs("./results/", exist_ok=True)
     with open(os.path.join("./results", args.log_name), "a") as f:
         f.write(f"current gcn parameter: {args}\n")
@@ -619,6 +942,8 @@ if __name__ == '__main__':
         test_baseline()
     if args.mode == "evaluate":
         evaluate()
+    if args.mode == "search":
+        search_weights()
     if args.mode == "notrain_test":
         notrain_test()
     if args.mode == "prepare":
@@ -627,3 +952,5 @@ if __name__ == '__main__':
         eval_gaussian()
     if args.mode == "gcn_attack":
         eval_gcn()
+    if args.profile_measures:
+        print(measures.report())
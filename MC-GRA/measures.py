@@ -0,0 +1,236 @@
+import time
+
+import torch
+import utils
+from torch.nn import MSELoss
+from torch.nn import functional as F
+from utils import CudaCKA, MutualInformation
+
+# defaults of resolve(), set once from the command line
+options = {'compile': False, 'profile': False}
+
+# the one registry of both projects: 'node' measures compare two node
+# representations (MC-GRA --measure), 'graph' measures an adjacency A with
+# an embedding Z (the I(A; Z) terms of MC-GPB, --MI_type)
+_builders = {'node': {}, 'graph': {}}
+# shared by the attacks, so the estimators are also reused across search trials
+_resolved = {}
+
+
+def register(name, registry='node'):
+    """Register builder(device) -> Measure for `name` in `registry`."""
+    def wrap(builder):
+        _builders[registry][name] = builder
+        return builder
+    return wrap
+
+
+class Measure(object):
+    """A dependence measure resolved once, called as measure(X, Y).
+
+    The estimator behind it (CKA, MSE, one KDE per input width) is built on
+    the first resolve and kept, `sign` and `index` turn the raw value into
+    the loss term: HSIC is maximized, the KDE returns one value per batch.
+    With `profile`, every call is timed (synchronizing CUDA).
+
+    measure(X, Y) == measure.pair(measure.prepare(X), measure.prepare(Y)):
+    `prepare` holds the work that only depends on one input, so an input
+    shared by several terms is prepared once (see `constraints`).
+
+    Parameters
+    ----------
+    compilable :
+        whether `setup(compile=True)` may wrap the estimator in
+        `torch.compile` (not for data-dependent shapes, i.e. the KDE)
+    """
+
+    def __init__(self, name, fn, sign=1, index=None, compilable=True):
+        self.name = name
+        self.fn = fn
+        self.sign = sign
+        self.index = index
+        self.compilable = compilable
+        self.profile = False
+        self.calls = 0
+        self.seconds = 0.
+
+    def setup(self, compile=False, profile=False):
+        if compile and self.compilable and hasattr(torch, 'compile'):
+            self.fn = torch.compile(self.fn, dynamic=True)
+        self.profile = profile
+        return self
+
+    def _prepare(self, X):
+        return X
+
+    def _pair(self, X, Y):
+        return self.fn(X, Y)
+
+    def prepare(self, X):
+        return self._timed(self._prepare, X)
+
+    def pair(self, X, Y):
+        value = self._timed(self._pair, X, Y)
+        self.calls += 1
+        if self.index is not None:
+            value = value[self.index]
+        return value if self.sign == 1 else self.sign * value
+
+    def _timed(self, fn, *inputs):
+        if not self.profile:
+            return fn(*inputs)
+        sync = torch.cuda.is_available()
+        if sync:
+            torch.cuda.synchronize()
+        start = time.perf_counter()
+        value = fn(*inputs)
+        if sync:
+            torch.cuda.synchronize()
+        self.seconds += time.perf_counter() - start
+        return value
+
+    def __call__(self, X, Y):
+        return self.pair(self.prepare(X), self.prepare(Y))
+
+
+class CenteredMeasure(Measure):
+    """Linear HSIC / CKA: `prepare` centers the columns once (and takes the
+    self-HSIC of the input for CKA), `pair` is the product of centered inputs.
+    """
+
+    def __init__(self, name, cka, normalized=False, sign=1):
+        super(CenteredMeasure, self).__init__(name, cka.centered_HSIC, sign=sign)
+        self.normalized = normalized
+
+    def _prepare(self, X):
+        X = X - X.mean(0, keepdim=True)
+        return X, torch.sqrt(self.fn(X, X)) if self.normalized else None
+
+    def _pair(self, X, Y):
+        hsic = self.fn(X[0], Y[0])
+        if self.normalized:
+            return hsic / (X[1] * Y[1])
+        return hsic
+
+
+def resolve(name, device='cpu', compile=None, profile=None, registry='node'):
+    """The `Measure` registered as `name` in `registry` (--measure, or
+    --MI_type for 'graph'), built once per device."""
+    compile = options['compile'] if compile is None else compile
+    profile = options['profile'] if profile is None else profile
+    key = (registry, name, str(device), compile, profile)
+    if key not in _resolved:
+        builders = _builders[registry]
+        assert name in builders, 'Unknown measure {}, choose from {}'.format(name, sorted(builders))
+        _resolved[key] = builders[name](device).setup(compile=compile, profile=profile)
+    return _resolved[key]
+
+
+def report():
+    """Calls and time per measure of the profiled measures."""
+    lines = ['{:<10s}{:>10s}{:>12s}{:>12s}'.format('measure', 'calls', 'total (s)', 'ms / call')]
+    for measure in _resolved.values():
+        if measure.profile and measure.calls:
+            lines.append('{:<10s}{:>10d}{:>12.3f}{:>12.3f}'.format(
+                measure.name, measure.calls, measure.seconds, 1000 * measure.seconds / measure.calls))
+    return '\n'.join(lines)
+
+
+class KDEMeasure(object):
+    """One `MutualInformation` per input width (num_bins = width), its bins
+    kept on `device` between calls."""
+
+    def __init__(self, device, sigma=0.4):
+        self.device = device
+        self.sigma = sigma
+        self.estimators = {}
+
+    def __call__(self, X, Y):
+        width = X.shape[-1]
+        if width not in self.estimators:
+            self.estimators[width] = MutualInformation(
+                sigma=self.sigma, num_bins=width, normalize=True).to(self.device)
+        return self.estimators[width](X, Y)
+
+
+def dot_product(X, Y):
+    if X.dim() == 1:
+        return torch.dot(X, Y)
+    return torch.norm(torch.matmul(Y.t(), X), p=2)
+
+
+def calc_kl(X, Y):
+    X = F.softmax(X, dim=-1)
+    Y = F.log_softmax(Y, dim=-1)
+    return F.kl_div(Y, X, reduction="batchmean")
+
+
+@register("HSIC")
+def _hsic(device):
+    return CenteredMeasure("HSIC", CudaCKA(device=device), sign=-1)
+
+
+@register("CKA")
+def _cka(device):
+    return CenteredMeasure("CKA", CudaCKA(device=device), normalized=True)
+
+
+@register("MSELoss")
+def _mse(device):
+    return Measure("MSELoss", MSELoss())
+
+
+@register("KL")
+def _kl(device):
+    return Measure("KL", calc_kl)
+
+
+@register("DP")
+def _dp(device):
+    return Measure("DP", dot_product)
+
+
+@register("KDE")
+def _kde(device):
+    return Measure("KDE", KDEMeasure(device), index=0, compilable=False)
+
+
+class AdjacencyKDEMeasure(object):
+    """`utils.KDE` / `utils.IXZ` of MC-GPB with their `MutualInformation`
+    built once.
+
+    Both size the bins by A_Z.shape[0] of the unsqueezed 1 x N x N input,
+    i.e. a single bin, which is kept as is.
+    """
+
+    def __init__(self, fn, sigma=0.4):
+        self.fn = fn
+        self.MI = MutualInformation(sigma=sigma, num_bins=1, normalize=True)
+
+    def __call__(self, A, Z):
+        return self.fn(A, Z, MI=self.MI)
+
+
+@register("KDE", registry='graph')
+def _graph_kde(device):
+    return Measure("KDE", AdjacencyKDEMeasure(utils.KDE), compilable=False)
+
+
+@register("IXZ", registry='graph')
+def _graph_ixz(device):
+    return Measure("IXZ", AdjacencyKDEMeasure(utils.IXZ), compilable=False)
+
+
+@register("linear_CKA", registry='graph')
+def _graph_linear_cka(device):
+    return CenteredMeasure("linear_CKA", CudaCKA(device=device), normalized=True)
+
+
+@register("linear_HSIC", registry='graph')
+def _graph_linear_hsic(device):
+    return CenteredMeasure("linear_HSIC", CudaCKA(device=device))
+
+
+@register("DP", registry='graph')
+def _graph_dp(device):
+    return Measure("DP", utils.DP)
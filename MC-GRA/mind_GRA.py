@@ -274,7 +274,7 @@ model.attack(
     epochs=args.epochs,
 )
 
-inference_adj = model.modified_adj.cpu()
+inference_adj = model.modified_adj.dense().cpu()
 test(adj, features, labels, victim_model)
 auc = metric_pool(adj, inference_adj, idx_attack, index_delete)
 auc_train = metric_pool(adj, inference_adj, idx_train, index_delete_train)
@@ -2,6 +2,7 @@ import numpy as np
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
+import sparse_graph
 import utils
 import torch.optim as optim
 
@@ -32,18 +33,33 @@ class GraphAttentionLayer(nn.Module):
         self.leakyrelu = nn.LeakyReLU(self.alpha)
 
     def forward(self, input, adj):
+        """Attention alpha_ij ~ adj_ij * exp(e_ij) over the neighbours j of i,
+        with e_ij = LeakyReLU(a_1^T h_i + a_2^T h_j) built from two per-node
+        scalars. For a binary adj this is the usual masked softmax, and it
+        stays differentiable in the edge weights of a perturbed adj.
+
+        A dense adj is scored densely (N x N scores, no N x N x 2F input); an
+        (edge_index, edge_weight) edge list or a torch sparse adj only scores
+        its edges, with a segment softmax, in O(E * F).
+        """
         h = torch.mm(input, self.W)
-        N = h.size()[0]
-
-        a_input = torch.cat([h.repeat(1, N).view(N * N, -1), h.repeat(N, 1)], dim=1).view(N, -1, 2 * self.out_features)
-        e = self.leakyrelu(torch.matmul(a_input, self.a).squeeze(2))
-
-        zero_vec = -9e15 * torch.ones_like(e)
-        attention = torch.where(adj > 0, e, zero_vec)
-        attention = F.softmax(attention, dim=1)
-        attention = F.dropout(attention, self.dropout, training=self.training)
-        h_prime = torch.matmul(attention, h)
-        h_prime = torch.matmul(adj, h)
+        score_src = torch.mm(h, self.a[:self.out_features]).squeeze(1)
+        score_dst = torch.mm(h, self.a[self.out_features:]).squeeze(1)
+
+        if isinstance(adj, torch.Tensor) and not adj.is_sparse:
+            e = self.leakyrelu(score_src.unsqueeze(1) + score_dst.unsqueeze(0))
+            shift = torch.where(adj != 0, e, torch.full_like(e, -float('inf'))).amax(1, keepdim=True)
+            shift = torch.where(torch.isinf(shift), torch.zeros_like(shift), shift).detach()
+            attention = adj * torch.exp(e - shift)
+            attention = attention / attention.sum(1, keepdim=True).clamp(min=1e-16)
+            attention = F.dropout(attention, self.dropout, training=self.training)
+            h_prime = torch.matmul(attention, h)
+        else:
+            edge_index, edge_weight = sparse_graph.as_edge_list(adj)
+            e = self.leakyrelu(score_src[edge_index[0]] + score_dst[edge_index[1]])
+            attention = sparse_graph.segment_softmax(e, edge_index[0], h.shape[0], weight=edge_weight)
+            attention = F.dropout(attention, self.dropout, training=self.training)
+            h_prime = sparse_graph.propagate(edge_index, attention, h, h.shape[0])
 
         if self.concat:
             return F.elu(h_prime)
@@ -149,8 +165,11 @@ class SpGraphAttentionLayer(nn.Module):
 
 
 class embedding_gat(nn.Module):
+    # forward() also takes an (edge_index, edge_weight) edge list as adj
+    edge_list_input = True
+
     def __init__(self, nfeat, nhid, nclass, dropout, alpha, nheads, device, nlayer=2):
-        """Dense version of GAT."""
+        """GAT embedding, adj is dense, torch sparse or an edge list."""
         super(embedding_gat, self).__init__()
         self.dropout = dropout
         self.device = device
@@ -179,8 +198,10 @@ class embedding_gat(nn.Module):
 
 
 class GAT(nn.Module):
+    edge_list_input = True
+
     def __init__(self, nfeat, nhid, nclass, dropout, alpha, nheads, device, nlayer=2):
-        """Dense version of GAT."""
+        """GAT, adj is dense, torch sparse or an edge list."""
         super(GAT, self).__init__()
         self.dropout = dropout
         self.device = device
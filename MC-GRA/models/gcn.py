@@ -5,6 +5,7 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 import torch.optim as optim
+import sparse_graph
 import utils
 from torch.nn.modules.module import Module
 from torch.nn.parameter import Parameter
@@ -34,12 +35,19 @@ class GraphConvolution(Module):
 
     def forward(self, input, adj):
         """ Graph Convolutional Layer forward function
+
+        `adj` is a dense / torch sparse (normalized) adjacency, or an
+        (edge_index, edge_weight) edge list that is propagated by message
+        passing in O(E * h), with gradients flowing back to edge_weight.
         """
         if input.data.is_sparse:
             support = torch.spmm(input, self.weight)
         else:
             support = torch.mm(input, self.weight)
-        output = torch.spmm(adj, support)
+        if isinstance(adj, tuple):
+            output = sparse_graph.propagate(adj[0], adj[1], support, support.shape[0])
+        else:
+            output = torch.spmm(adj, support)
         if self.bias is not None:
             return output + self.bias
         else:
@@ -52,6 +60,9 @@ class GraphConvolution(Module):
 
 
 class embedding_GCN(nn.Module):
+    # forward() also takes an (edge_index, edge_weight) edge list as adj
+    edge_list_input = True
+
     def __init__(self, nfeat, nhid, nlayer=2, with_bias=True, device=None):
 
         super(embedding_GCN, self).__init__()
@@ -108,6 +119,9 @@ class GCN(nn.Module):
     device: str
         'cpu' or 'cuda'.
 
+    `forward` takes the adjacency as a dense or torch sparse tensor, or as an
+    (edge_index, edge_weight) edge list, see `GraphConvolution.forward`.
+
     Examples
     --------
         We can first load dataset and then train GCN.
@@ -127,6 +141,8 @@ class GCN(nn.Module):
 
     """
 
+    edge_list_input = True
+
     def __init__(self, nfeat, nhid, nclass, nlayer=2, dropout=0.5, lr=0.01, weight_decay=5e-4, with_relu=True, with_bias=True, device=None):
 
         super(GCN, self).__init__()
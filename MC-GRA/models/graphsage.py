@@ -1,11 +1,14 @@
 import torch.nn as nn
 import torch.nn.functional as F
 import math
+import numpy as np
+import sparse_graph
 import torch
 import torch.optim as optim
 from torch.nn.parameter import Parameter
 from torch.nn.modules.module import Module
 import utils
+import scipy.sparse as sp
 from copy import deepcopy
 from sklearn.metrics import f1_score
 
@@ -36,8 +39,17 @@ class GraphConvolution(Module):
 
     def forward(self, input, adj):
         """ Graph Convolutional Layer forward function
+
+        `adj` is a dense / torch sparse adjacency, an (edge_index, edge_weight)
+        edge list aggregated in O(E * d), or an (edge_index, edge_weight,
+        num_dst) block from `sparse_graph.sample_blocks`, which only updates
+        the first num_dst rows of `input`.
         """
-        if input.data.is_sparse:
+        if isinstance(adj, tuple):
+            num_dst = adj[2] if len(adj) == 3 else input.shape[0]
+            support = sparse_graph.propagate(adj[0], adj[1], input, num_dst)
+            input = input[:num_dst]
+        elif input.data.is_sparse:
             support = torch.spmm(adj, input)
         else:
             support = torch.mm(adj, input)
@@ -55,6 +67,9 @@ class GraphConvolution(Module):
                + str(self.out_features) + ')'
 
 class embedding_graphsage(nn.Module):
+    # forward() also takes an edge list, or one sampled block per layer
+    edge_list_input = True
+
     def __init__(self, nfeat, nhid, nlayer=2, with_bias=False, device=None):
 
         super(embedding_graphsage, self).__init__()
@@ -76,11 +91,29 @@ class embedding_graphsage(nn.Module):
     def forward(self, x, adj):
         # self.gc[0].to(self.device)
         # x = F.relu(self.gc1(x, adj)) 
+        adjs = adj if isinstance(adj, list) else [adj] * self.nlayer
         for i in range(self.nlayer):
             #print(i)
             layer=self.gc[i].to(self.device)
-            x = F.relu(layer(x, adj))
+            x = F.relu(layer(x, adjs[i]))
         return x
+
+    def embed(self, features, adj, batch_size=1024, fanouts=None):
+        """Embeddings of all nodes, computed `batch_size` nodes at a time on
+        their (sampled, see `sparse_graph.sample_blocks`) neighbourhoods, so
+        memory is bounded by the neighbourhood of a batch. `adj` is the
+        unnormalized adjacency, the blocks carry the gcn normalization.
+        """
+        fanouts = fanouts or [None] * self.nlayer
+        adj = sparse_graph.to_scipy_adj(adj)
+        out = []
+        with torch.no_grad():
+            for batch in np.array_split(np.arange(features.shape[0]),
+                                        max(1, int(np.ceil(features.shape[0] / batch_size)))):
+                nodes, blocks = sparse_graph.sample_blocks(adj, batch, fanouts)
+                blocks = [(e.to(self.device), w.to(self.device), n) for e, w, n in blocks]
+                out.append(self.forward(features[nodes.to(features.device)].to(self.device), blocks))
+        return torch.cat(out)
     # def __init__(self, nfeat, nhid,nlayer=2, with_bias=True, device=None):
 
     #     super(embedding_GCN, self).__init__()
@@ -106,6 +139,7 @@ class embedding_graphsage(nn.Module):
         self.nlayer = nlayer
 
 class graphsage(nn.Module):
+    edge_list_input = True
 
     def __init__(self, nfeat, nhid, nclass, nlayer=2, dropout=0.5, lr=0.01, weight_decay=5e-4, with_relu=True, with_bias=False, device=None):
 
@@ -141,12 +175,15 @@ class graphsage(nn.Module):
         self.features = None
 
     def forward(self, x, adj):
+        """`adj` is a (normalized) adjacency or edge list shared by all
+        layers, or a list with one sampled block per layer."""
+        adjs = adj if isinstance(adj, list) else [adj] * len(self.gc)
         for i,layer in enumerate(self.gc):
             layer=layer.to(self.device)
             if self.with_relu:
-                x=F.relu(layer(x, adj))
+                x=F.relu(layer(x, adjs[i]))
             else:
-                x=layer(x, adj)
+                x=layer(x, adjs[i])
             if i!= len(self.gc)-1:
                 x=F.dropout(x,self.dropout, training=self.training)
         x = self.linear1(x)
@@ -157,7 +194,7 @@ class graphsage(nn.Module):
         for layers in self.gc:
             layers.reset_parameters()
 
-    def fit(self, features, adj, labels, idx_train, idx_val=None, train_iters=200, initialize=True, verbose=True, normalize=True, patience=500, **kwargs):
+    def fit(self, features, adj, labels, idx_train, idx_val=None, train_iters=200, initialize=True, verbose=True, normalize=True, patience=500, batch_size=None, fanouts=None, **kwargs):
         """Train the gcn model, when idx_val is not None, pick the best model according to the validation loss.
 
         Parameters
@@ -182,12 +219,23 @@ class graphsage(nn.Module):
             whether to normalize the input adjacency matrix.
         patience : int
             patience for early stopping, only valid when `idx_val` is given
+        batch_size : int
+            if given, train on mini-batches of `batch_size` training nodes
+            on gcn-normalized sampled neighbourhoods (`train_iters` epochs)
+        fanouts : list
+            neighbours sampled per node and layer in mini-batch mode, None
+            keeps all of them
         """
 
         self.device = self.gc1.weight.device
         if initialize:
             self.initialize()
 
+        if batch_size is not None:
+            self._train_minibatch(features, adj, labels, idx_train, idx_val, train_iters,
+                                  batch_size, fanouts or [None] * len(self.gc), verbose)
+            return
+
         if type(adj) is not torch.Tensor:
             features, adj, labels = utils.to_tensor(features, adj, labels, device=self.device)
         else:
@@ -215,6 +263,53 @@ class graphsage(nn.Module):
             else:
                 self._train_with_val(labels, idx_train, idx_val, train_iters, verbose)
 
+    def _train_minibatch(self, features, adj, labels, idx_train, idx_val, train_iters, batch_size, fanouts, verbose):
+        # the sampler reads the edge list, a sparse adjacency is never densified
+        adj = sparse_graph.to_scipy_adj(adj)
+        self.features = torch.as_tensor(features if not sp.issparse(features) else features.todense()).float()
+        self.labels = torch.as_tensor(labels).to(self.device)
+        # the blocks are gcn-normalized like the full-graph forwards (predict, attacks)
+        self.adj_norm = sparse_graph.gcn_norm(*sparse_graph.adj_to_edge_index(adj, device=self.device),
+                                              adj.shape[0])
+        optimizer = optim.Adam(self.parameters(), lr=self.lr, weight_decay=self.weight_decay)
+
+        def run(batch, fanouts):
+            nodes, blocks = sparse_graph.sample_blocks(adj, batch, fanouts)
+            blocks = [(e.to(self.device), w.to(self.device), n) for e, w, n in blocks]
+            return self.forward(self.features[nodes].to(self.device), blocks)
+
+        num_batches = max(1, int(np.ceil(len(idx_train) / batch_size)))
+        best_loss_val = 100
+        weights = None
+        for i in range(train_iters):
+            self.train()
+            for batch in np.array_split(np.random.permutation(idx_train), num_batches):
+                optimizer.zero_grad()
+                loss_train = F.nll_loss(run(batch, fanouts), self.labels[batch])
+                loss_train.backward()
+                optimizer.step()
+
+            if idx_val is None:
+                if verbose and i % 10 == 0:
+                    print('Epoch {}, training loss: {}'.format(i, loss_train.item()))
+                continue
+
+            self.eval()
+            with torch.no_grad():
+                output = torch.cat([run(batch, [None] * len(fanouts)) for batch in
+                                    np.array_split(idx_val, max(1, int(np.ceil(len(idx_val) / batch_size))))])
+            loss_val = F.nll_loss(output, self.labels[idx_val])
+            if verbose and i % 10 == 0:
+                print('Epoch {}, training loss: {}, val acc: {}'.format(
+                    i, loss_train.item(), utils.accuracy(output, self.labels[idx_val])))
+            if best_loss_val > loss_val:
+                best_loss_val = loss_val
+                weights = deepcopy(self.state_dict())
+
+        if weights is not None:
+            self.load_state_dict(weights)
+        self.eval()
+
     def _train_without_val(self, labels, idx_train, train_iters, verbose):
         self.train()
         optimizer = optim.Adam(self.parameters(), lr=self.lr, weight_decay=self.weight_decay)
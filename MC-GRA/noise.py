@@ -0,0 +1,133 @@
+import math
+
+import torch
+
+_MASK = 0xFFFFFFFF
+
+
+def hash32(x):
+    """Integer hash of the low 32 bits of every entry of an int64 tensor
+    (lowbias32), the same on every device."""
+    x = x & _MASK
+    x = x ^ (x >> 16)
+    x = (x * 0x7feb352d) & _MASK
+    x = x ^ (x >> 15)
+    x = (x * 0x846ca68b) & _MASK
+    return x ^ (x >> 16)
+
+
+def mix(seed, epoch):
+    """Seed of `epoch` derived from the run seed."""
+    key = torch.tensor([epoch], dtype=torch.int64)
+    return int(hash32(key ^ hash32(torch.tensor([seed], dtype=torch.int64)))[0])
+
+
+def counter_normal(keys, seed):
+    """Counter-based standard normal noise: the value of an entry only depends
+    on (seed, key), not on how many entries are drawn, their order or the
+    device.
+
+    Parameters
+    ----------
+    keys : torch.LongTensor
+        one non-negative key per value, e.g. row * N + col
+    seed : int
+        seed of the draw (see `mix`)
+    """
+    h = hash32(keys ^ hash32(torch.full_like(keys, seed)))
+    h = hash32(h ^ (keys >> 32))
+    u1 = (hash32(h).double() + 0.5) / 2 ** 32
+    u2 = (hash32(h ^ 0x9e3779b9).double() + 0.5) / 2 ** 32
+    return torch.sqrt(-2 * torch.log(u1)) * torch.cos(2 * math.pi * u2)
+
+
+class AdjacencyNoise(object):
+    """Gaussian noise added to the perturbed adjacency of every epoch,
+    A + eps * noise clamped to [0, 1].
+
+    Every epoch draws from its own seed, mix(seed, epoch), so a run gives the
+    same noise whatever else consumed the global RNG, e.g. another trial of a
+    parallel search. With eps == 0 nothing is drawn and the adjacency is
+    returned as is.
+
+    Parameters
+    ----------
+    eps : float
+        noise scale
+    mode : str
+        'dense' - i.i.d. noise on every entry, drawn into a buffer reused
+        across epochs;
+        'lowrank' - U V^T / sqrt(rank) with [N, rank] Gaussian factors (unit
+        variance per entry), fused into the addition, no N x N noise;
+        'sparse' - counter-based noise on the given `pairs` only (both (i, j)
+        and (j, i)), only these entries are clamped
+    pairs : torch.LongTensor
+        [2, M] lower-triangle pairs of the 'sparse' mode, the attack's
+        candidates; `on_pairs` perturbs values given on these pairs
+    rank : int
+        rank of the 'lowrank' mode
+    seed : int
+        run seed, by default the current torch seed (set per search trial)
+    """
+
+    def __init__(self, eps=0, mode='dense', pairs=None, rank=8, seed=None, device='cpu'):
+        assert mode in ('dense', 'lowrank', 'sparse'), 'Unknown noise mode {}'.format(mode)
+        assert mode != 'sparse' or pairs is not None or eps == 0, 'sparse noise needs the pairs'
+        self.eps = eps
+        self.mode = mode
+        self.rank = rank
+        self.seed = torch.initial_seed() & _MASK if seed is None else seed
+        self.device = device
+        self.buffer = None
+        self.lower = None
+        self.pairs = None
+        if pairs is not None:
+            self.lower = pairs.to(device)
+            self.pairs = (torch.cat([self.lower[0], self.lower[1]]), torch.cat([self.lower[1], self.lower[0]]))
+
+    @classmethod
+    def from_args(cls, args, pairs=None, device='cpu', mode=None):
+        """--eps, --noise, --noise_rank and --noise_seed. `pairs` are the
+        candidate pairs of the attack, which the sparse noise perturbs;
+        `mode` overrides --noise."""
+        mode = mode or getattr(args, 'noise', 'dense')
+        return cls(args.eps, mode, pairs=pairs if mode == 'sparse' and args.eps != 0 else None,
+                   rank=getattr(args, 'noise_rank', 8), seed=getattr(args, 'noise_seed', None), device=device)
+
+    def generator(self, epoch):
+        return torch.Generator(device=self.device).manual_seed(mix(self.seed, epoch))
+
+    def pair_noise(self, row, col, num_nodes, epoch):
+        # keyed by the pair, (i, j) and (j, i) get the same noise
+        keys = torch.maximum(row, col) * num_nodes + torch.minimum(row, col)
+        return counter_normal(keys, mix(self.seed, epoch))
+
+    def on_pairs(self, values, num_nodes, epoch=0):
+        """`values` of the adjacency at the construction pairs ([M], or
+        [B, M] for a batch of graphs) plus the noise, clamped to [0, 1]: the
+        entries `__call__` gives in 'sparse' mode, without the N x N matrix."""
+        if self.eps == 0:
+            return values
+        noise = self.pair_noise(self.lower[0], self.lower[1], num_nodes, epoch).to(values.dtype)
+        return torch.clamp(values + self.eps * noise, min=0, max=1)
+
+    def __call__(self, modified_adj, epoch=0):
+        if self.eps == 0:
+            return modified_adj
+        if self.mode == 'sparse':
+            row, col = self.pairs
+            noise = self.pair_noise(row, col, modified_adj.shape[0], epoch).to(modified_adj.dtype)
+            values = torch.clamp(modified_adj[row, col] + self.eps * noise, min=0, max=1)
+            return modified_adj.index_put((row, col), values)
+        if self.mode == 'lowrank':
+            n = modified_adj.shape[0]
+            generator = self.generator(epoch)
+            factors = torch.randn(2, n, self.rank, generator=generator, device=self.device,
+                                  dtype=modified_adj.dtype)
+            noise = torch.addmm(modified_adj, factors[0], factors[1].t(),
+                                alpha=self.eps / math.sqrt(self.rank))
+            return torch.clamp(noise, min=0, max=1)
+        if self.buffer is None or self.buffer.shape != modified_adj.shape:
+            self.buffer = torch.empty_like(modified_adj)
+        torch.randn(modified_adj.shape, generator=self.generator(epoch), out=self.buffer)
+        return torch.clamp(torch.add(modified_adj, self.buffer, alpha=self.eps), min=0, max=1)
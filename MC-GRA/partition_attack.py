@@ -0,0 +1,207 @@
+import numpy as np
+import scipy.sparse as sp
+import sparse_graph
+import torch
+import torch.multiprocessing as mp
+import torch.nn.functional as F
+from sparse_attack import SparsePGDAttack
+
+
+def partition_nodes(idx, num_parts, features=None, labels=None, method='kmeans', iters=20, seed=0):
+    """Split `idx` into `num_parts` clusters.
+
+    Parameters
+    ----------
+    idx : numpy.array
+        nodes to partition (idx_attack)
+    method : str
+        'kmeans' -- k-means on the L2-normalized features
+        'label'  -- group by (known) label, large classes split evenly
+        'random' -- random balanced split
+    """
+    idx = np.asarray(idx)
+    # no empty clusters when there are fewer nodes than parts
+    num_parts = min(num_parts, len(idx))
+    if num_parts == 0:
+        return []
+    rng = np.random.RandomState(seed)
+    if method == 'random' or num_parts <= 1:
+        return [np.sort(part) for part in np.array_split(rng.permutation(idx), max(num_parts, 1))]
+
+    if method == 'label':
+        y = np.asarray(labels)[idx]
+        size = int(np.ceil(len(idx) / num_parts))
+        parts = []
+        for c in np.unique(y):
+            members = idx[y == c]
+            parts.extend(np.array_split(members, max(1, int(np.ceil(len(members) / size)))))
+        return [np.sort(part) for part in parts if len(part)]
+
+    X = F.normalize(features[torch.as_tensor(idx)].float(), p=2, dim=1)
+    centers = X[torch.as_tensor(rng.choice(len(idx), num_parts, replace=False))]
+    for _ in range(iters):
+        assign = torch.argmax(torch.matmul(X, centers.t()), dim=1)
+        for c in range(num_parts):
+            members = X[assign == c]
+            if len(members):
+                centers[c] = F.normalize(members.mean(0), p=2, dim=0)
+    assign = assign.numpy()
+    return [np.sort(idx[assign == c]) for c in range(num_parts) if np.any(assign == c)]
+
+
+def k_hop_halo(adj, nodes, hops):
+    """`nodes` plus every node within `hops` hops of them in `adj` (scipy)."""
+    adj = sp.csr_matrix(adj)
+    mask = np.zeros(adj.shape[0], dtype=bool)
+    mask[nodes] = True
+    frontier = mask.copy()
+    for _ in range(hops):
+        frontier = (adj[frontier].sum(0).A1 > 0) & ~mask
+        if not frontier.any():
+            break
+        mask |= frontier
+    return np.nonzero(mask)[0]
+
+
+# inherited by the forked workers, see PartitionAttack.attack
+_state = None
+
+
+def _attack_block(block):
+    s = _state
+    sub = block['nodes']
+    local = -np.ones(s['nnodes'], dtype=np.int64)
+    local[sub] = np.arange(len(sub))
+
+    candidates = torch.as_tensor(local[block['pairs']])
+    model = SparsePGDAttack(model=s['victim_model'], embedding=s['embedding'],
+                            H_A=s['H_A'][sub], Y_A=s['Y_A'][sub], nnodes=len(sub),
+                            candidates=candidates, features=s['features'][sub],
+                            parameterization=s['parameterization'], loss_type='CE',
+                            device=s['device'])
+    model = model.to(s['device'])
+    model.attack(s['args'], s['lr'], s['weight_supervised'], s['weight_param'],
+                 s['features'][sub], s['ori_adj'][sub][:, sub], s['labels'][sub],
+                 local[block['attack']], block['num_edges'], epochs=s['epochs'])
+    return block['pairs'], model.edge_score.detach().cpu().numpy()
+
+
+class PartitionAttack(object):
+    """Run `SparsePGDAttack` independently on the induced subgraph of every
+    cluster of `idx_attack` plus its k-hop halo, then merge the per-block
+    pair scores into one global sparse score.
+
+    Per-step memory is bounded by the largest block, and the blocks are
+    attacked in parallel by forked workers (CPU only).
+
+    Parameters
+    ----------
+    partitions : list
+        node arrays from `partition_nodes`
+    halo_adj : scipy.sparse matrix
+        graph the halo is grown on, e.g. the attacker's known edges or a
+        feature kNN graph (the true adjacency is the attack target)
+    hops : int
+        halo size
+
+    Without candidates, a block attacks every pair among its attack nodes;
+    with the global `candidates` (e.g. from `candidate_index`), only the
+    candidate pairs that fall inside the block.
+    """
+
+    def __init__(self, model, embedding, H_A, Y_A, nnodes, partitions, halo_adj, hops=1,
+                 parameterization='edge', n_workers=1, device='cpu'):
+        self.victim_model = model
+        self.embedding = embedding
+        self.H_A = H_A
+        self.Y_A = Y_A
+        self.nnodes = nnodes
+        self.partitions = partitions
+        self.halo_adj = halo_adj
+        self.hops = hops
+        self.parameterization = parameterization
+        self.n_workers = n_workers
+        self.device = device
+        self.edge_index = None
+        self.edge_score = None
+
+    def blocks(self, idx_attack, num_edges, candidates=None):
+        in_attack = np.zeros(self.nnodes, dtype=bool)
+        in_attack[idx_attack] = True
+        if candidates is not None:
+            candidates = np.asarray(candidates)
+            total = candidates.shape[1]
+        else:
+            total = len(idx_attack) * (len(idx_attack) - 1) / 2
+        blocks = []
+        for part in self.partitions:
+            nodes = k_hop_halo(self.halo_adj, part, self.hops)
+            # attack nodes of the halo take part in the pairs as well, the
+            # overlapping pairs of neighbouring blocks are averaged in merge()
+            attack = nodes[in_attack[nodes]]
+            if candidates is None:
+                pairs = sparse_graph.pairs_within(attack).numpy()
+            else:
+                in_block = np.zeros(self.nnodes, dtype=bool)
+                in_block[attack] = True
+                pairs = candidates[:, in_block[candidates[0]] & in_block[candidates[1]]]
+            if pairs.shape[1] == 0:
+                continue
+            share = pairs.shape[1] / max(total, 1)
+            blocks.append({'nodes': nodes, 'attack': attack, 'pairs': pairs,
+                           'num_edges': max(1, int(num_edges * share))})
+        return blocks
+
+    def attack(self, args, lr_ori, weight_supervised, weight_param, features, ori_adj,
+               labels, idx_attack, num_edges, epochs=200, candidates=None, callback=None):
+        '''
+            candidates:             global [2, M] candidate pairs, None for every pair
+                                    among the attack nodes of a block.
+            callback:               called as callback(step, (edge_index, edge_score)) with
+                                    the merged scores of the first `step` blocks, may raise
+                                    TrialPruned.
+        '''
+        global _state
+        _state = {'victim_model': self.victim_model, 'embedding': self.embedding,
+                  'H_A': self.H_A.detach(), 'Y_A': self.Y_A.detach(), 'nnodes': self.nnodes,
+                  'features': features, 'ori_adj': sp.csr_matrix(ori_adj), 'labels': labels,
+                  'parameterization': self.parameterization, 'args': args, 'lr': lr_ori,
+                  'weight_supervised': weight_supervised, 'weight_param': weight_param,
+                  'epochs': epochs, 'device': self.device}
+        blocks = self.blocks(idx_attack, num_edges, candidates)
+
+        # search workers are daemonic and cannot fork again, blocks then run in turn
+        if self.n_workers > 1 and torch.device(self.device).type == 'cpu' \
+                and not mp.current_process().daemon:
+            threads = max(1, torch.get_num_threads() // self.n_workers)
+            with mp.get_context('fork').Pool(self.n_workers, initializer=torch.set_num_threads,
+                                             initargs=(threads, )) as pool:
+                self.collect(pool.imap(_attack_block, blocks), callback)
+        else:
+            self.collect(map(_attack_block, blocks), callback)
+        return 0, 0, 0, 0
+
+    def collect(self, results, callback=None):
+        """Merge the block results as they come, reporting the partial merge."""
+        done = []
+        for result in results:
+            done.append(result)
+            if callback is not None:
+                self.merge(done)
+                callback(len(done), (self.edge_index, self.edge_score))
+        self.merge(done)
+
+    def merge(self, results):
+        if not results:
+            results = [(np.zeros((2, 0), dtype=np.int64), np.zeros(0))]
+        pairs = np.concatenate([p for p, _ in results], axis=1)
+        scores = np.concatenate([s for _, s in results])
+        keys = pairs[0] * self.nnodes + pairs[1]
+        keys, inverse = np.unique(keys, return_inverse=True)
+        total = np.bincount(inverse, weights=scores)
+        count = np.bincount(inverse)
+        self.edge_index = torch.from_numpy(
+            np.vstack((keys // self.nnodes, keys % self.nnodes)))
+        self.edge_score = torch.from_numpy(total / count).float()
+        self.modified_adj = sp.coo_matrix((total / count, (keys // self.nnodes, keys % self.nnodes)),
+                                          shape=(self.nnodes, self.nnodes))
@@ -0,0 +1,327 @@
+import glob
+import json
+import os
+import random
+import time
+import traceback
+
+import numpy as np
+import torch
+import torch.multiprocessing as mp
+
+
+class TrialPruned(Exception):
+    """Raised inside an objective to stop a hopeless trial early."""
+
+
+class Uniform(object):
+    def __init__(self, low, high):
+        self.low = low
+        self.high = high
+
+    def sample(self, rng):
+        return float(rng.uniform(self.low, self.high))
+
+
+class LogUniform(object):
+    """10**U(low, high); with probability `zero_prob` the term is switched off (0)."""
+
+    def __init__(self, low, high, zero_prob=0.):
+        self.low = low
+        self.high = high
+        self.zero_prob = zero_prob
+
+    def sample(self, rng):
+        if rng.rand() < self.zero_prob:
+            return 0.
+        return float(10 ** rng.uniform(self.low, self.high))
+
+
+class Choice(object):
+    def __init__(self, options):
+        self.options = list(options)
+
+    def sample(self, rng):
+        return self.options[rng.randint(len(self.options))]
+
+
+def sample_params(space, rng):
+    """Draw one configuration; entries of `space` that are not samplers are fixed values."""
+    return {name: value.sample(rng) if hasattr(value, 'sample') else value
+            for name, value in space.items()}
+
+
+class ResultStore(object):
+    """Lock-free trial store: every trial owns one JSON file under `root`,
+    replaced atomically on each update, so workers never share a file handle.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, number):
+        return os.path.join(self.root, 'trial_{:05d}.json'.format(number))
+
+    def write(self, record):
+        path = self.path(record['number'])
+        tmp = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump(record, f)
+        os.replace(tmp, path)
+
+    def load(self):
+        records = []
+        for path in sorted(glob.glob(os.path.join(self.root, 'trial_*.json'))):
+            with open(path) as f:
+                records.append(json.load(f))
+        return records
+
+    def best(self):
+        done = [r for r in self.load() if r['state'] == 'complete']
+        return min(done, key=lambda r: r['loss']) if done else None
+
+
+class MedianPruner(object):
+    """Prune a trial whose intermediate loss is worse than the median of the
+    completed trials at the same step.
+
+    Only completed trials are compared against: pruned trials never report
+    the later steps and running ones are partial, so counting them would
+    turn the median into the one of the survivors (successive halving).
+
+    Parameters
+    ----------
+    n_startup_trials : int
+        no pruning until this many trials have completed
+    n_warmup_steps : int
+        no pruning before this step
+    """
+
+    def __init__(self, n_startup_trials=5, n_warmup_steps=0):
+        self.n_startup_trials = n_startup_trials
+        self.n_warmup_steps = n_warmup_steps
+
+    def prune(self, store, trial, step, value):
+        if step < self.n_warmup_steps:
+            return False
+        key = str(step)
+        done = [r for r in store.load() if r['state'] == 'complete' and r['number'] != trial.number]
+        others = [r['intermediate'][key] for r in done if key in r['intermediate']]
+        if len(done) < self.n_startup_trials or not others:
+            return False
+        return value > np.median(others)
+
+
+class Trial(object):
+    """Handle given to the objective (as arg["trial"]) to report intermediate
+    values and attach extra metrics to the stored record.
+    """
+
+    def __init__(self, number, params, store, pruner=None):
+        self.number = number
+        self.params = params
+        self.store = store
+        self.pruner = pruner
+        self.record = {'number': number, 'params': params, 'state': 'running',
+                       'loss': None, 'intermediate': {}, 'attrs': {}, 'duration': None}
+
+    def report(self, step, value):
+        self.record['intermediate'][str(step)] = float(value)
+        self.store.write(self.record)
+
+    def should_prune(self, step, value):
+        """Report `value` (lower is better) at `step`, True if the trial should stop."""
+        self.report(step, value)
+        return self.pruner is not None and self.pruner.prune(self.store, self, step, value)
+
+    def set_attrs(self, **attrs):
+        self.record['attrs'].update({k: float(v) for k, v in attrs.items()})
+
+
+# set in the parent before the pool forks, so that the objective and the
+# state it closes over (victim model, embeddings, ...) are inherited, not pickled
+_objective = None
+_store = None
+_pruner = None
+
+
+def _init_worker(num_threads):
+    torch.set_num_threads(num_threads)
+
+
+def _seed(seed):
+    random.seed(seed)
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+
+
+def _fail(trial, error):
+    # a crashing configuration is recorded, it does not take the pool down
+    traceback.print_exception(type(error), error, error.__traceback__)
+    trial.record['state'] = 'fail'
+    trial.record['error'] = repr(error)
+
+
+def _run_trial(number, params, seed):
+    _seed(seed)
+    trial = Trial(number, params, _store, _pruner)
+    _store.write(trial.record)
+    start = time.time()
+    try:
+        arg = dict(params)
+        arg["trial"] = trial
+        trial.record['loss'] = float(_objective(arg))
+        trial.record['state'] = 'complete'
+    except TrialPruned:
+        trial.record['state'] = 'pruned'
+    except Exception as error:
+        _fail(trial, error)
+    trial.record['duration'] = time.time() - start
+    _store.write(trial.record)
+    return trial.record
+
+
+def _run_batch(numbers, params, seed):
+    """Run several trials with one call of a batched objective, which takes
+    the list of configurations and returns one loss per configuration
+    (None for a pruned one). If it raises, every trial of the batch fails."""
+    _seed(seed)
+    trials = [Trial(number, p, _store, _pruner) for number, p in zip(numbers, params)]
+    for trial in trials:
+        _store.write(trial.record)
+    start = time.time()
+    args = []
+    for trial in trials:
+        arg = dict(trial.params)
+        arg["trial"] = trial
+        args.append(arg)
+    try:
+        losses = _objective(args)
+    except Exception as error:
+        losses = [error] * len(trials)
+    for trial, loss in zip(trials, losses):
+        if isinstance(loss, Exception):
+            _fail(trial, loss)
+        elif loss is None:
+            trial.record['state'] = 'pruned'
+        else:
+            trial.record['loss'] = float(loss)
+            trial.record['state'] = 'complete'
+        trial.record['duration'] = time.time() - start
+        _store.write(trial.record)
+    return [trial.record for trial in trials]
+
+
+def share_memory(*objects):
+    """Move tensors / modules into shared memory before the workers fork."""
+    for obj in objects:
+        if isinstance(obj, torch.nn.Module):
+            obj.share_memory()
+        elif isinstance(obj, torch.Tensor) and not obj.is_sparse and not obj.is_cuda:
+            obj.share_memory_()
+
+
+class SearchEngine(object):
+    """Random search over `space` with a process pool.
+
+    The workers are forked from the process that already built the victim
+    model, the embeddings and the prior matrices, so these are computed
+    once; call `share_memory` on them first so they are not copied on write.
+    A trial whose objective raises is recorded with state 'fail' (and the
+    error), the search goes on.
+
+    Parameters
+    ----------
+    objective : callable
+        objective(arg) -> loss, arg is a sampled configuration plus arg["trial"]
+    space : dict
+        name -> sampler (Uniform / LogUniform / Choice) or fixed value
+    store : ResultStore
+        where the trial records go
+    n_workers : int
+        number of processes, 0 uses every core
+    patience : int
+        stop submitting trials after this many completed trials without
+        improvement, 0 disables early stopping
+    pruner : MedianPruner
+        trial-level pruning of intermediate values reported by the objective
+    batch_size : int
+        trials per objective call; when > 1 the objective is batched, it
+        takes a list of configurations and returns a list of losses
+    """
+
+    def __init__(self, objective, space, store, n_workers=1, max_eval=100, patience=0,
+                 pruner=None, seed=0, device='cpu', batch_size=1):
+        self.objective = objective
+        self.space = space
+        self.store = store
+        self.n_workers = n_workers if n_workers > 0 else os.cpu_count()
+        # CUDA state cannot be forked, trials on the GPU run in-process
+        if torch.device(device).type == 'cuda':
+            self.n_workers = 1
+        self.max_eval = max_eval
+        self.patience = patience
+        self.pruner = pruner
+        self.seed = seed
+        self.batch_size = batch_size
+        self.rng = np.random.RandomState(seed)
+        self._best = None
+        self._since_best = 0
+
+    def run(self):
+        global _objective, _store, _pruner
+        _objective, _store, _pruner = self.objective, self.store, self.pruner
+
+        if self.n_workers == 1:
+            number = 0
+            while number < self.max_eval and not self._stop():
+                fn, task, count = self._task(number)
+                self._finish(fn(*task))
+                number += count
+            return self.store.best()
+
+        threads = max(1, torch.get_num_threads() // self.n_workers)
+        ctx = mp.get_context('fork')
+        with ctx.Pool(self.n_workers, initializer=_init_worker, initargs=(threads, )) as pool:
+            running, submitted = [], 0
+            while submitted < self.max_eval or running:
+                while submitted < self.max_eval and len(running) < self.n_workers and not self._stop():
+                    fn, task, count = self._task(submitted)
+                    running.append(pool.apply_async(fn, task))
+                    submitted += count
+                if self._stop():
+                    submitted = self.max_eval
+                done = [r for r in running if r.ready()]
+                for r in done:
+                    running.remove(r)
+                    self._finish(r.get())
+                if not done:
+                    time.sleep(0.1)
+        return self.store.best()
+
+    def _task(self, number):
+        """Next call: a single trial, or up to `batch_size` trials of a batched objective."""
+        if self.batch_size == 1:
+            return _run_trial, (number, sample_params(self.space, self.rng), self.seed + number), 1
+        count = min(self.batch_size, self.max_eval - number)
+        params = [sample_params(self.space, self.rng) for _ in range(count)]
+        return _run_batch, (list(range(number, number + count)), params, self.seed + number), count
+
+    def _finish(self, record):
+        if isinstance(record, list):
+            for r in record:
+                self._finish(r)
+            return
+        print('trial {} {}: loss={}'.format(
+            record['number'], record['state'], record['loss']))
+        if record['state'] != 'complete':
+            return
+        if self._best is None or record['loss'] < self._best:
+            self._best = record['loss']
+            self._since_best = 0
+        else:
+            self._since_best += 1
+
+    def _stop(self):
+        return self.patience > 0 and self._since_best >= self.patience
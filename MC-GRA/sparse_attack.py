@@ -0,0 +1,312 @@
+from copy import deepcopy
+
+import decoder
+import measures
+import scipy.sparse as sp
+import sparse_graph
+import torch
+from base_attack import BaseAttack
+from noise import AdjacencyNoise
+from torch.nn import functional as F
+from torch.nn.parameter import Parameter
+from tqdm import tqdm
+from utils import Align_Parameter_Cora, project_budget
+
+
+def Info_entropy(prob):
+    prob = torch.clamp(prob, 1e-4, 1-1e-4)
+    entropy = prob * torch.log2(prob)
+    return -torch.mean(entropy)
+
+
+class SparsePGDAttack(BaseAttack):
+    """Edge-list version of `topology_attack.PGDAttack`.
+
+    Only the node pairs in `candidates` are optimized, so memory and per-epoch
+    time scale with the number of candidate pairs instead of N^2. The
+    normalized adjacency and the GCN propagation are computed on the edge
+    list and handed to the victim model as a torch sparse tensor.
+
+    Parameters
+    ----------
+    candidates : torch.LongTensor
+        [2, M] lower-triangle node pairs to optimize (`candidate_index`)
+    parameterization : str
+        'edge'     -- one weight per candidate pair (topology_attack)
+        'gcn'      -- cosine similarity of a GCN embedding of the features,
+                      evaluated on the candidates only (gcn_parameterized)
+        'gaussian' -- reparameterized Gaussian weight per candidate pair
+                      (gaussian_parameterized)
+    """
+
+    def __init__(self, model=None, embedding=None, H_A=None, Y_A=None, nnodes=None, candidates=None,
+                 features=None, parameterization='edge', loss_type='CE', attack_structure=True,
+                 attack_features=False, device='cpu'):
+        super(SparsePGDAttack, self).__init__(model, nnodes,
+                                              attack_structure, attack_features, device)
+
+        assert attack_features or attack_structure, 'attack_features or attack_structure cannot be both False'
+        assert parameterization in ['edge', 'gcn', 'gaussian'], \
+            'parameterization should be edge, gcn or gaussian'
+
+        self.loss_type = loss_type
+        self.parameterization = parameterization
+        self.embedding = embedding
+        self.H_A = H_A
+        self.Y_A = Y_A
+        self.modified_adj = None
+        self.edge_index = None
+        self.edge_score = None
+
+        assert candidates is not None, 'Please give candidates='
+        self.candidates = candidates.to(device)
+        ncand = self.candidates.shape[1]
+
+        if attack_structure:
+            assert nnodes is not None, 'Please give nnodes='
+            if parameterization == 'edge':
+                self.adj_changes = Parameter(torch.zeros(ncand))
+            elif parameterization == 'gcn':
+                assert features is not None, 'Please give features='
+                self.features = features.to(device)
+                self.gc = deepcopy(embedding.gc)
+            else:
+                self.mu = Parameter(torch.randn(ncand))
+                self.logvar = Parameter(torch.randn(ncand))
+
+        if attack_features:
+            assert True, 'Topology Attack does not support attack feature'
+
+    def parameters_to_optimize(self):
+        if self.parameterization == 'gcn':
+            return [p for layer in self.gc for p in layer.parameters()]
+        if self.parameterization == 'gaussian':
+            return [self.mu, self.logvar]
+        return [self.adj_changes]
+
+    def get_edge_weight(self):
+        """Weights of the candidate pairs under the chosen parameterization.
+        """
+        if self.parameterization == 'edge':
+            return self.adj_changes
+
+        if self.parameterization == 'gcn':
+            eye = sparse_graph.to_sparse_adj(
+                torch.arange(self.nnodes, device=self.device).unsqueeze(
+                    0).repeat(2, 1),
+                torch.ones(self.nnodes, device=self.device), self.nnodes)
+            x = self.features.detach()
+            for layer in self.gc:
+                x = F.relu(layer(x, eye))
+            return torch.clamp(sparse_graph.pair_scores(x, self.candidates), 0, 1)
+
+        std = torch.exp(0.5 * self.logvar)
+        eps = torch.randn_like(std)
+        return torch.sigmoid(eps * std + self.mu)
+
+    def get_modified_adj(self, ori_edge_index, ori_edge_weight, edge_weight=None):
+        """Symmetric (edge_index, edge_weight) of the perturbed graph.
+        """
+        if edge_weight is None:
+            edge_weight = self.get_edge_weight()
+        edge_index, edge_weight = sparse_graph.symmetrize(
+            self.candidates, edge_weight)
+        edge_index = torch.cat([ori_edge_index, edge_index], dim=1)
+        edge_weight = torch.cat([ori_edge_weight, edge_weight])
+        return edge_index, edge_weight
+
+    def noisy_weight(self, noise, ori_candidate, edge_weight, epoch):
+        """Candidate weights of the graph seen by the loss terms: `noise` is
+        added to the perturbed entries (ori_candidate + edge_weight) and
+        clamped to [0, 1], as the dense attacks clamp A + eps * noise.
+        """
+        if noise.eps == 0:
+            return edge_weight
+        return noise.on_pairs(ori_candidate + edge_weight, self.nnodes, epoch) - ori_candidate
+
+    def candidate_norm(self, edge_index, edge_weight, candidate_weight):
+        """Entries of D^-1/2 (A + I) D^-1/2 at the candidate pairs, where
+        (edge_index, edge_weight) is the unnormalized perturbed graph and
+        `candidate_weight` its weights at the candidates.
+        """
+        deg = edge_weight.new_ones(self.nnodes).index_add(0, edge_index[0], edge_weight)
+        deg_inv_sqrt = deg.pow(-0.5)
+        row, col = self.candidates
+        return deg_inv_sqrt[row] * candidate_weight * deg_inv_sqrt[col]
+
+    def embed_perturbation(self, features, edge_weight):
+        """Depth-2 embedding of the perturbation alone, the input of c2, c7
+        and c9. As in the dense attacks, which embed modified_adj - ori_adj,
+        the weights are neither normalized nor given self loops.
+        """
+        self.embedding.set_layers(2)
+        return self.embedding(features, self.model_input(*sparse_graph.symmetrize(self.candidates, edge_weight)))
+
+    def decode_perturbation(self, em):
+        """Inner-product decoder of `embed_perturbation`, on the candidates."""
+        return torch.relu(sparse_graph.pair_scores(em, self.candidates))
+
+    def decode_source(self, Z):
+        """Per-dataset inner-product decoder of the final fusion, that of the
+        dense attack of the same parameterization."""
+        return decoder.embedding_source(Z, self.args, self.parameterization)
+
+    def fused_score(self, features, labels, embeddings):
+        """Decoded priors and `embeddings` of the final fusion, summed on the
+        candidates with the transforms of the dense attacks.
+        """
+        sources = [decoder.feature_source(features, self.args.dataset)] + \
+            [self.decode_source(Z) for Z in embeddings]
+        if self.args.useH_A:
+            sources.append(self.decode_source(self.H_A.to(self.device)))
+        if self.args.useY_A:
+            sources.append(self.decode_source(self.Y_A.to(self.device)))
+        if self.args.useY:
+            sources.append(decoder.LabelSource(labels))
+        return decoder.FusedDecoder(sources, nnodes=self.nnodes).pairs(self.candidates)
+
+    def normalize(self, edge_index, edge_weight):
+        edge_index, edge_weight = sparse_graph.gcn_norm(
+            edge_index, edge_weight, self.nnodes)
+        return self.model_input(edge_index, edge_weight)
+
+    def model_input(self, edge_index, edge_weight, num_nodes=None):
+        """Normalized adjacency for the victim and the embedding model, an edge
+        list for the models that propagate on it, a sparse tensor otherwise."""
+        return sparse_graph.model_input([self.surrogate, self.embedding], edge_index, edge_weight,
+                                        num_nodes or self.nnodes)
+
+    def attack(self, args, lr_ori, weight_supervised, weight_param, features, ori_adj,
+               labels, idx_attack, num_edges, epochs=200, callback=None, report_every=20, **kwargs):
+        '''
+            Parameters:
+            lr_ori:                 learning rate
+            weight_supervised:      weight of the supervised loss
+            weight_param:           weights (w1..w10) of the constraint terms
+            features:               node features (torch.Tensor)
+            ori_adj:                initial adjacency, scipy matrix or tensor
+            labels:                 node labels (torch.LongTensor)
+            idx_attack:             index of nodes for recovery.
+            num_edges:              edge budget of the projection.
+            epochs:                 epochs for recovery training.
+            callback:               called as callback(epoch, (edge_index, edge_weight))
+                                    every `report_every` epochs, e.g. to prune a search trial.
+        '''
+        self.args = args
+        optimizer = torch.optim.Adam(self.parameters_to_optimize(), lr=lr_ori)
+
+        victim_model = self.surrogate
+        victim_model.eval()
+        self.embedding.eval()
+        features = features.to(self.device)
+        labels = labels.to(self.device)
+        ori_edge_index, ori_edge_weight = sparse_graph.adj_to_edge_index(
+            ori_adj, device=self.device)
+
+        w1, w2, _, _, _, w6, w7, w8, w9, w10 = weight_param
+        calc_pairs, calc = self.get_measure(args.measure)
+        if calc_pairs is None and (w1 != 0 or w2 != 0):
+            raise ValueError('--measure {} has no form on the candidate pairs, c1 / c2 (w1, w2) '
+                             'need HSIC, CKA, MSELoss, KL or DP'.format(args.measure))
+
+        # the prior terms are compared on the candidate pairs only
+        feature_score = decoder.feature_source(features, args.dataset).pairs(self.candidates)
+        H_A = self.H_A.detach().to(self.device)
+        Y_A = self.Y_A.detach().to(self.device)
+        ori_candidate = sparse_graph.edge_lookup(ori_edge_index, ori_edge_weight,
+                                                 self.candidates, self.nnodes)
+        # --eps noise on the candidate entries only, whatever --noise is
+        noise = AdjacencyNoise.from_args(args, self.candidates, self.device, mode='sparse')
+
+        for t in tqdm(range(epochs)):
+            optimizer.zero_grad()
+            edge_weight = self.get_edge_weight()
+            # the graph terms see the noisy weights, the size penalties the parameters
+            graph_weight = self.noisy_weight(noise, ori_candidate, edge_weight, t)
+            modified_index, modified_weight = self.get_modified_adj(
+                ori_edge_index, ori_edge_weight, graph_weight)
+            edge_index, norm_weight = sparse_graph.gcn_norm(
+                modified_index, modified_weight, self.nnodes)
+            adj_norm = self.model_input(edge_index, norm_weight)
+            output = victim_model(features, adj_norm)
+
+            loss = weight_supervised * (self._loss(output[idx_attack], labels[idx_attack])
+                                        + torch.norm(edge_weight, p=2) * 0.001)
+
+            if w1 != 0:
+                loss += w1 * calc_pairs(feature_score, graph_weight) * \
+                    1000 * Align_Parameter_Cora["c1"]
+            if w2 != 0 or w7 != 0 or w9 != 0:
+                em = self.embed_perturbation(features, graph_weight)
+            if w2 != 0 or w7 != 0:
+                # the decoded graph of the perturbation, on the candidates
+                decoded = self.decode_perturbation(em) + ori_candidate
+            if w2 != 0:
+                cand_norm = self.candidate_norm(modified_index, modified_weight,
+                                                ori_candidate + graph_weight)
+                loss += w2 * calc_pairs(cand_norm, decoded) * \
+                    100 * Align_Parameter_Cora["c2"]
+            if w6 != 0:
+                loss += w6 * Info_entropy(norm_weight) * \
+                    100 * Align_Parameter_Cora["c6"]
+            if w7 != 0:
+                loss += w7 * Info_entropy(decoded) * Align_Parameter_Cora["c7"]
+            if w8 != 0:
+                loss += w8 * torch.clamp(torch.sum(torch.abs(edge_weight)),
+                                         min=0.01) * 0.0001 * Align_Parameter_Cora["c8"]
+            if w9 != 0:
+                loss += w9 * calc(H_A[idx_attack], em[idx_attack]) * \
+                    Align_Parameter_Cora["c9"]
+            if w10 != 0:
+                loss += w10 * calc(Y_A[idx_attack], torch.softmax(
+                    output[idx_attack], dim=1)) * Align_Parameter_Cora["c10"]
+
+            loss.backward()
+            optimizer.step()
+
+            if self.parameterization == 'edge':
+                self.projection(num_edges)
+
+            if callback is not None and (t + 1) % report_every == 0:
+                callback(t + 1, (self.candidates, self.get_edge_weight().detach()))
+
+        with torch.no_grad():
+            edge_weight = self.get_edge_weight().detach()
+            adj_norm = self.normalize(
+                *self.get_modified_adj(ori_edge_index, ori_edge_weight, edge_weight))
+            self.embedding.set_layers(1)
+            H_A1 = self.embedding(features, adj_norm)
+            self.embedding.set_layers(2)
+            H_A2 = self.embedding(features, adj_norm)
+            Y_A2 = victim_model(features, adj_norm)
+
+            score = edge_weight + self.fused_score(features, labels, [H_A1, H_A2, Y_A2])
+
+        self.edge_index = self.candidates
+        self.edge_score = score
+        row, col = self.candidates.cpu().numpy()
+        self.modified_adj = sp.coo_matrix((score.cpu().numpy(), (row, col)),
+                                          shape=(self.nnodes, self.nnodes))
+
+        return 0, 0, 0, 0
+
+    def get_measure(self, measure):
+        """Measures of c1 / c2, which compare [M] vectors over the candidate
+        pairs, and of c9 / c10, which compare [len(idx_attack), d] embeddings.
+        HSIC and CKA take a pair vector as a single feature column. The KDE
+        has no form on the pair vectors, its c1 / c2 measure is None.
+        """
+        calc = measures.resolve(measure, self.device)
+        if measure == "KDE":
+            return None, calc
+        if isinstance(calc, measures.CenteredMeasure):
+            return (lambda X, Y: calc(X.unsqueeze(1), Y.unsqueeze(1))), calc
+        return calc, calc
+
+    def _loss(self, output, labels):
+        if self.loss_type == "CE":
+            loss = F.nll_loss(output, labels)
+        return loss
+
+    def projection(self, num_edges):
+        self.adj_changes.data.copy_(project_budget(self.adj_changes.data, num_edges))
@@ -0,0 +1,237 @@
+import numpy as np
+import scipy.sparse as sp
+import torch
+
+
+def pairs_within(idx, device='cpu'):
+    """All lower-triangle node pairs (row > col) among the nodes in `idx`.
+
+    Parameters
+    ----------
+    idx : numpy.array
+        node indices
+    device : str
+        'cpu' or 'cuda'
+
+    Returns
+    -------
+    torch.LongTensor
+        candidate pairs of shape [2, len(idx) * (len(idx) - 1) / 2]
+    """
+    idx = torch.as_tensor(np.sort(np.asarray(idx)), dtype=torch.long)
+    local = torch.tril_indices(len(idx), len(idx), offset=-1)
+    return idx[local].to(device)
+
+
+def adj_to_edge_index(adj, device='cpu'):
+    """Convert a scipy / dense / torch sparse adjacency into (edge_index, edge_weight).
+    """
+    if sp.issparse(adj):
+        adj = adj.tocoo()
+        edge_index = torch.from_numpy(
+            np.vstack((adj.row, adj.col)).astype(np.int64))
+        edge_weight = torch.from_numpy(adj.data.astype(np.float32))
+    elif isinstance(adj, torch.Tensor) and adj.is_sparse:
+        adj = adj.coalesce()
+        edge_index, edge_weight = adj.indices(), adj.values().float()
+    else:
+        adj = torch.as_tensor(np.asarray(adj) if not isinstance(
+            adj, torch.Tensor) else adj)
+        edge_index = adj.nonzero().t()
+        edge_weight = adj[edge_index[0], edge_index[1]].float()
+    return edge_index.to(device), edge_weight.to(device)
+
+
+def to_scipy_adj(adj):
+    """scipy CSR copy of a scipy / dense / torch sparse adjacency, built from
+    its edge list (a torch sparse adjacency is never densified).
+    """
+    if sp.issparse(adj):
+        return adj.tocsr()
+    edge_index, edge_weight = adj_to_edge_index(adj)
+    return sp.csr_matrix((edge_weight.numpy(), (edge_index[0].numpy(), edge_index[1].numpy())),
+                         shape=tuple(adj.shape))
+
+
+def symmetrize(edge_index, edge_weight):
+    """Mirror lower-triangle pairs so that both (i, j) and (j, i) are present.
+    """
+    edge_index = torch.cat([edge_index, edge_index.flip(0)], dim=1)
+    edge_weight = torch.cat([edge_weight, edge_weight])
+    return edge_index, edge_weight
+
+
+def gcn_norm(edge_index, edge_weight, num_nodes, fill_value=1.):
+    """Edge-list version of `utils.normalize_adj_tensor`,
+    A' = D^-1/2 * (A + I) * D^-1/2, computed in O(E) without dense intermediates.
+
+    Parameters
+    ----------
+    edge_index : torch.LongTensor
+        [2, E] edge list
+    edge_weight : torch.Tensor
+        [E] (differentiable) edge weights
+    num_nodes : int
+        number of nodes in the graph
+    fill_value : float
+        weight of the added self loops
+
+    Returns
+    -------
+    tuple
+        (edge_index, edge_weight) of the normalized adjacency with self loops
+    """
+    loop_index = torch.arange(num_nodes, device=edge_index.device)
+    loop_index = loop_index.unsqueeze(0).repeat(2, 1)
+    loop_weight = edge_weight.new_full((num_nodes, ), fill_value)
+    edge_index = torch.cat([edge_index, loop_index], dim=1)
+    edge_weight = torch.cat([edge_weight, loop_weight])
+
+    row, col = edge_index
+    deg = edge_weight.new_zeros(num_nodes).index_add(0, row, edge_weight)
+    deg_inv_sqrt = deg.pow(-0.5)
+    deg_inv_sqrt = deg_inv_sqrt.masked_fill(torch.isinf(deg_inv_sqrt), 0.)
+
+    return edge_index, deg_inv_sqrt[row] * edge_weight * deg_inv_sqrt[col]
+
+
+def to_sparse_adj(edge_index, edge_weight, num_nodes):
+    """Wrap an edge list as a torch sparse COO tensor. Gradients flow back to
+    `edge_weight` through `torch.spmm`, which is what `GraphConvolution` calls.
+    """
+    return torch.sparse_coo_tensor(edge_index, edge_weight, (num_nodes, num_nodes))
+
+
+def model_input(models, edge_index, edge_weight, num_nodes):
+    """Adjacency in the form the given models take: the edge list itself if
+    all of them propagate on edge lists (`edge_list_input`), otherwise a
+    torch sparse tensor.
+    """
+    if all(getattr(model, 'edge_list_input', False) for model in models):
+        return edge_index, edge_weight
+    return to_sparse_adj(edge_index, edge_weight, num_nodes)
+
+
+def as_edge_list(adj):
+    """(edge_index, edge_weight) of an edge-list tuple, a torch sparse or a
+    dense adjacency; the weights keep their gradients.
+    """
+    if isinstance(adj, tuple):
+        return adj
+    if adj.is_sparse:
+        adj = adj.coalesce()
+        return adj.indices(), adj.values()
+    edge_index = adj.nonzero().t()
+    return edge_index, adj[edge_index[0], edge_index[1]]
+
+
+def segment_softmax(src, index, num_nodes, weight=None):
+    """Softmax of the edge scores `src` over the edges that share `index`
+    (their target row); with `weight`, alpha_e ~ weight_e * exp(src_e).
+    """
+    shift = src.detach().new_full((num_nodes, ), -float('inf')).scatter_reduce(
+        0, index, src.detach(), 'amax')
+    out = torch.exp(src - shift[index])
+    if weight is not None:
+        out = out * weight
+    denom = out.new_zeros(num_nodes).index_add(0, index, out)
+    return out / denom[index].clamp(min=1e-16)
+
+
+def sample_blocks(adj, seeds, fanouts, rng=np.random):
+    """GraphSAGE mini-batch neighbourhood of the nodes in `seeds`.
+
+    Parameters
+    ----------
+    adj : scipy.sparse matrix
+        adjacency the neighbours are drawn from (unnormalized)
+    seeds : numpy.array
+        output nodes of the batch
+    fanouts : list
+        neighbours sampled per node for every layer, input layer first;
+        None keeps all neighbours
+    rng : numpy.random.RandomState
+        random state of the sampling
+
+    Returns
+    -------
+    tuple
+        (nodes, blocks): the input nodes of the first layer, and one
+        (edge_index, edge_weight, num_dst) block per layer. The dst nodes of
+        a block are the first num_dst of its src nodes. The weights are those
+        of `gcn_norm` on the whole graph, self loops included, so that
+        mini-batch and full-graph forwards agree; the weights of sampled
+        neighbours are scaled by (neighbours / sampled) of their dst node.
+    """
+    adj = sp.csr_matrix(adj)
+    deg_inv_sqrt = np.power(np.asarray(adj.sum(1)).ravel() + 1., -0.5)
+    local = -np.ones(adj.shape[0], dtype=np.int64)
+    dst = np.asarray(seeds, dtype=np.int64)
+    blocks = []
+    for fanout in reversed(fanouts):
+        deg = adj.indptr[dst + 1] - adj.indptr[dst]
+        offset = np.cumsum(deg) - deg
+        seg = np.repeat(np.arange(len(dst)), deg)
+        pos = np.repeat(adj.indptr[dst] - offset, deg) + np.arange(deg.sum())
+        if fanout is not None:
+            # random order within every node's neighbours, keep the first `fanout`
+            order = np.lexsort((rng.random_sample(len(pos)), seg))
+            keep = order[np.arange(len(order)) - offset[seg] < fanout]
+            seg, pos = seg[keep], pos[keep]
+        nbrs = adj.indices[pos]
+
+        local[dst] = np.arange(len(dst))
+        extra = np.unique(nbrs[local[nbrs] < 0])
+        local[extra] = len(dst) + np.arange(len(extra))
+        scale = deg / np.maximum(np.bincount(seg, minlength=len(dst)), 1)
+        weight = deg_inv_sqrt[dst[seg]] * adj.data[pos] * deg_inv_sqrt[nbrs] * scale[seg]
+        loops = np.arange(len(dst))
+        edge_index = np.hstack((np.vstack((seg, local[nbrs])), np.vstack((loops, loops))))
+        weight = np.concatenate([weight, deg_inv_sqrt[dst] ** 2])
+        blocks.append((torch.from_numpy(edge_index), torch.from_numpy(weight).float(), len(dst)))
+        src = np.concatenate([dst, extra])
+        local[src] = -1
+        dst = src
+    return torch.from_numpy(dst), blocks[::-1]
+
+
+def propagate(edge_index, edge_weight, x, num_nodes):
+    """Weighted sum aggregation out[i] = sum_j w_ij * x[j] in O(E * d).
+    """
+    row, col = edge_index
+    out = x.new_zeros((num_nodes, x.shape[1]))
+    return out.index_add(0, row, x[col] * edge_weight.unsqueeze(1))
+
+
+def pair_scores(Z, edge_index, normalize=True, block_size=2 ** 20):
+    """Inner-product decoder evaluated only on the given pairs, `block_size`
+    pairs at a time so that at most [block_size, d] rows are gathered.
+    """
+    if normalize:
+        Z = torch.nn.functional.normalize(Z, p=2, dim=1)
+    if edge_index.shape[1] <= block_size:
+        return (Z[edge_index[0]] * Z[edge_index[1]]).sum(1)
+    return torch.cat([(Z[row] * Z[col]).sum(1)
+                      for row, col in zip(edge_index[0].split(block_size), edge_index[1].split(block_size))])
+
+
+def edge_lookup(edge_index, edge_weight, pairs, num_nodes):
+    """Weights of the edge list at the given pairs, 0 where there is no edge.
+    """
+    query = pairs[0] * num_nodes + pairs[1]
+    out = edge_weight.new_zeros(query.shape[0])
+    if edge_index.shape[1] == 0:
+        return out
+    keys, order = torch.sort(edge_index[0] * num_nodes + edge_index[1])
+    pos = torch.searchsorted(keys, query).clamp(max=keys.shape[0] - 1)
+    found = keys[pos] == query
+    out[found] = edge_weight[order][pos[found]]
+    return out
+
+
+def lookup_pairs(adj, edge_index):
+    """Read the entries of a scipy adjacency at the given pairs.
+    """
+    adj = adj.tocsr()
+    row, col = edge_index.cpu().numpy()
+    return np.asarray(adj[row, col]).reshape(-1)
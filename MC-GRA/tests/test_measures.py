@@ -0,0 +1,36 @@
+import importlib.util
+import os
+import sys
+
+import measures
+import torch
+
+GPB_MEASURES = os.path.join(os.path.dirname(os.path.abspath(measures.__file__)),
+                            os.pardir, 'MC-GPB', 'measures.py')
+
+
+def load_gpb_measures():
+    # as `import measures` from MC-GPB, under another name to keep ours
+    spec = importlib.util.spec_from_file_location('gpb_measures', GPB_MEASURES)
+    spec.loader.exec_module(importlib.util.module_from_spec(spec))
+    return sys.modules.pop('gpb_measures')
+
+
+def test_mc_gpb_resolves_the_same_registry():
+    gpb = load_gpb_measures()
+    assert os.path.samefile(gpb.__file__, measures.__file__)
+    assert set(gpb._builders) == set(measures._builders)
+    for registry, builders in measures._builders.items():
+        assert set(gpb._builders[registry]) == set(builders)
+        for name, builder in builders.items():
+            assert gpb._builders[registry][name].__code__ == builder.__code__
+
+
+def test_registries_are_separate():
+    # the 'graph' builders use the MC-GPB utils, they are only compared here
+    assert measures._builders['node']['DP'] is not measures._builders['graph']['DP']
+    node = measures.resolve('DP')
+    assert node is measures.resolve('DP')
+    X, Y = torch.rand(10, 3), torch.rand(10, 4)
+    assert torch.allclose(node(X, Y), torch.norm(Y.t() @ X))
+    assert {'KDE', 'IXZ', 'DP', 'linear_CKA', 'linear_HSIC'} == set(measures._builders['graph'])
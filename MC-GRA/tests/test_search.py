@@ -0,0 +1,51 @@
+import search
+
+# intermediate losses (1 - sampled AUC) at the --prune_every steps, then the final loss
+STEADY = [0.6, 0.6, 0.6]
+EARLY = [0.05, 0.95, 0.95]
+LATE = [0.63, 0.3, 0.1]
+
+
+def curve(number):
+    if number < 5:
+        return [v + 0.02 * number for v in STEADY]
+    if number < 11:
+        return EARLY
+    return LATE
+
+
+def objective(arg):
+    trial = arg["trial"]
+    *steps, final = curve(trial.number)
+    for step, value in enumerate(steps, 1):
+        if trial.should_prune(step, value):
+            raise search.TrialPruned()
+    return final
+
+
+def test_late_improver_is_not_pruned(tmp_path):
+    # trials 5..10 look good at step 1 and are pruned at step 2; their step-1
+    # values must not lower the median the late improver is judged against
+    store = search.ResultStore(str(tmp_path))
+    engine = search.SearchEngine(objective, {'x': 0}, store, n_workers=1, max_eval=12,
+                                 pruner=search.MedianPruner(n_startup_trials=5))
+    engine.run()
+    states = {r['number']: r['state'] for r in store.load()}
+    assert all(states[n] == 'pruned' for n in range(5, 11))
+    assert states[11] == 'complete'
+    assert store.best()['number'] == 11
+
+
+def test_median_of_completed_trials_only(tmp_path):
+    store = search.ResultStore(str(tmp_path))
+    for number, (state, value) in enumerate([('complete', 0.4), ('complete', 0.5), ('complete', 0.6),
+                                             ('pruned', 0.1), ('pruned', 0.1), ('running', 0.1)]):
+        trial = search.Trial(number, {}, store)
+        trial.record['state'] = state
+        trial.report(1, value)
+    pruner = search.MedianPruner(n_startup_trials=3)
+    trial = search.Trial(6, {}, store, pruner)
+    assert not trial.should_prune(1, 0.45)
+    assert trial.should_prune(1, 0.55)
+    # startup counted over completed trials, not over every record
+    assert not search.MedianPruner(n_startup_trials=4).prune(store, trial, 1, 0.55)
@@ -1,9 +1,14 @@
+import decoder
+from forward_cache import frozen_forward
 import matplotlib.pyplot as plt
+import measures
 import numpy as np
 import scipy.sparse as sp
 import torch
+import triangular
 import utils
 from base_attack import BaseAttack
+from constraints import ConstraintEngine, add_mcgra_terms
 from torch.nn import KLDivLoss
 from mindspore.nn import MSELoss
 from torch.nn import functional as F
@@ -33,10 +38,7 @@ def metric(ori_adj, inference_adj, idx, index_delete):
 
 
 def dot_product_decode(Z):
-    Z = ops.L2Normalize(axis=1)(Z)
-    Z = ops.matmul(Z, Z.t())
-    adj = ops.relu(Z-ops.eye(Z.shape[0]))
-    return adj
+    return decoder.dot_product_decode(Z, normalize=True)
 
 
 def sampling_MI(prob, tau=0.5, reduction='mean'):
@@ -83,6 +85,7 @@ class PGDAttack(BaseAttack):
         self.Y_A = Y_A
         self.adj_changes_after = torch.zeros(
             int(nnodes * (nnodes - 1) / 2), requires_grad=True)
+        self.constraints = None
         if attack_structure:
             assert nnodes is not None, 'Please give nnodes='
             self.adj_changes = Parameter(ops.zeros(
@@ -130,109 +133,36 @@ class PGDAttack(BaseAttack):
         loss = weight_supervised*origin_loss
 
 
-        self.embedding.set_layers(1)
-        H_A1 = self.embedding(ori_features, adj)
+        if self.constraints is None:
+            calc, calc2 = self.get_measure(args.measure)
+            # this attack has no c8 term
+            self.constraints = add_mcgra_terms(
+                ConstraintEngine(), self, self.victim_model, calc,
+                [w1, w2, 0, 0, 0, w6, w7, 0, w9, w10], ori_adj, adj, ori_features,
+                feature_adj, idx_attack, Info_entropy, calc2=calc2)
+        # zero-weight terms are skipped, shared intermediates are computed once
         self.embedding.set_layers(2)
-        H_A2 = self.embedding(ori_features, adj)
-
-        Y_A = self.victim_model(ori_features, adj)
-
-
-        em = self.embedding(ori_features, modified_adj-ori_adj)
-
-        self.adj_changes_after = self.dot_product_decode(em)
-        modified_adj1 = self.get_modified_adj_after(ori_adj)
-
-        # CKA = CudaCKA(device=self.device)
-        calc = MSELoss() # CKA.linear_HSIC
-        calc2 = MSELoss()
+        loss, values = self.constraints.evaluate(loss, modified_adj=modified_adj, adj_norm=adj_norm)
 
-        if args.measure == "MSELoss":
-            calc = MSELoss()
+        return loss, values.get('output2')
 
-        elif args.measure == "KL":
+    def get_measure(self, measure):
+        """Measures of c1 / c2 and of c9 / c10 as loss terms, HSIC is maximized."""
+        calc = MSELoss()  # CKA.linear_HSIC
+        if measure == "KL":
             calc = self.calc_kl
-        # if args.measure == "KDE":
-        #     calc = MutualInformation(
-        #         sigma=0.4, num_bins=feature_adj.shape[0], normalize=True)
-
-        # if args.measure == "CKA":
-        #     CKA = CudaCKA(device=self.device)
-        #     calc = CKA.linear_CKA
-
-        elif args.measure == "DP":
+        elif measure == "DP":
             calc = self.dot_product
-
-        # 10 constrains area:
-        c1 = c2 = _ = _ = _ = c6 = c7 = c8 = c9 = c10 = 0
-        if w1 != 0 and feature_adj.max() != feature_adj.min():
-            c1 = w1 * calc(feature_adj, adj_norm)*1000 * \
-                Align_Parameter_Cora["c1"]
-            if args.measure == "KDE":
-                loss += c1[0]
-            elif args.measure == "HSIC":
-                loss += -c1
-            else:
-                loss += c1
-        if w2 != 0:
-            c2 = w2 * calc(adj_norm, modified_adj1) * \
-                100*Align_Parameter_Cora["c2"]
-            if args.measure == "KDE":
-                loss += c2[0]
-            elif args.measure == "HSIC":
-                loss += -c2
-            else:
-                loss += c2
-        if w6 != 0:
-            c6 = w6 * Info_entropy(adj_norm)*100*Align_Parameter_Cora["c6"]
-            loss += c6
-        if w7 != 0:
-            c7 = w7 * Info_entropy(modified_adj1) * \
-                Align_Parameter_Cora["c7"]
-            loss += c7
-        if w9 != 0:
-            num_layers = self.embedding.nlayer
-            for i in range(num_layers-1, num_layers):
-                self.embedding.set_layers(i+1)
-                em_cur = self.embedding(
-                    ori_features, modified_adj - ori_adj)
-                H_A_cur = self.embedding(ori_features, adj)
-                if args.measure == "KDE":
-                    calc2 = MutualInformation(
-                        sigma=0.4, num_bins=H_A1.shape[1], normalize=True)
-                    c9 = w9 * \
-                        (calc2(H_A_cur[idx_attack], em_cur[idx_attack])[
-                         0])*Align_Parameter_Cora["c9"]
-                elif args.measure == "HSIC":
-                    c9 = -1 * w9 * \
-                        (calc(H_A_cur[idx_attack], em_cur[idx_attack])
-                         )*Align_Parameter_Cora["c9"]
-                else:
-                    c9 = w9 * \
-                        (calc(H_A_cur[idx_attack], em_cur[idx_attack])
-                         )*Align_Parameter_Cora["c9"]
-                loss += c9
-        output2 = self.victim_model(ori_features, modified_adj)
-        if w10 != 0:
-            if args.measure == "KDE":
-                calc2 = MutualInformation(
-                    sigma=0.4, num_bins=Y_A.shape[1], normalize=True)
-                c10 = w10 * calc2(Y_A[idx_attack], torch.softmax(output2[idx_attack], dim=1))[
-                    0]*Align_Parameter_Cora["c10"]
-            elif args.measure == "HSIC":
-                c10 = -w10 * calc(Y_A[idx_attack], torch.softmax(
-                    output2[idx_attack], dim=1))*Align_Parameter_Cora["c10"]
-            else:
-                c10 = w10 * calc(Y_A[idx_attack], torch.softmax(
-                    output2[idx_attack], dim=1))*Align_Parameter_Cora["c10"]
-            loss += c10
-
-        return loss, output2
+        if measure == "HSIC":
+            return (lambda X, Y: -calc(X, Y)), (lambda X, Y: -calc(X, Y))
+        if measure == "KDE":
+            return calc, measures.resolve("KDE", self.device)
+        return calc, calc
     
     def attack(self, args, index_delete, lr_ori, weight_aux, weight_supervised, weight_param, feature_adj,
                aux_adj, aux_feature, aux_num_edges, idx_train, idx_val, idx_test, adj,
                ori_features, ori_adj, labels, idx_attack, num_edges,
-               dropout_rate, epochs=200, sample=False, **kwargs):
+               dropout_rate, epochs=200, sample=False, callback=None, report_every=20, **kwargs):
         '''
             Parameters:
             index_delete:           deleted zero edges, for metric
@@ -250,6 +180,8 @@ class PGDAttack(BaseAttack):
             num_edges:              no use in attack.
             epochs:                 epochs for recovery training.
             dropout_rate:           dropout rate in testing.
+            callback:               called as callback(epoch, modified_adj) every
+                                    `report_every` epochs, e.g. to prune a search trial.
         '''
         
         
@@ -259,6 +191,7 @@ class PGDAttack(BaseAttack):
             
         self.args = args
         optimizer = optim.Adam([self.adj_changes], lr=lr_ori)
+        self.constraints = None
         plt.cla()
         self.victim_model = self.surrogate
         self.sparse_features = sp.issparse(ori_features)
@@ -269,9 +202,6 @@ class PGDAttack(BaseAttack):
         # self.victim_model.set_train(False)
         # self.embedding.set_train(False)
 
-        label_adj = np.load("./saved_data/"+args.dataset+".npy")
-        label_adj = Tensor(label_adj)
-
         # lists for drawing
         acc_test_list = []
         origin_loss_list = []
@@ -304,6 +234,7 @@ class PGDAttack(BaseAttack):
             w10 = args.w10
             
         print("Start Attacking")
+        normalizer = None
         for t in tqdm(range(epochs)):
 
             if self.loss_type == 'CE':
@@ -328,14 +259,17 @@ class PGDAttack(BaseAttack):
             self.adj_changes.data.copy_(ops.clamp(
                 self.adj_changes.data, min=0, max=1))
 
-            em = self.embedding(ori_features, adj_norm)
-            adj_changes = self.dot_product_decode(em)
+            em = frozen_forward(self.embedding, ori_features, adj_norm)
+            adj_changes = frozen_forward.apply(self.dot_product_decode, em)
             modified_adj = self.get_modified_adj2(
                 ori_adj, adj_changes).detach()
             self.victim_model.set_train(False)
             modified_adj = self.get_modified_adj(ori_adj)
             sparsity_list.append(modified_adj.detach().cpu().mean())
-            adj_norm2 = utils.normalize_adj_tensor(modified_adj)
+            # only the entries moved by this step are renormalized
+            if normalizer is None:
+                normalizer = utils.IncrementalNormalizer(modified_adj)
+            adj_norm2 = normalizer.update_from(modified_adj)
             output2 = self.victim_model(ori_features, adj_norm2)
             cur_acc = mind_utils.accuracy(
                 output2[idx_test], labels[idx_test]).item()
@@ -343,6 +277,9 @@ class PGDAttack(BaseAttack):
 
             x_axis.append(t)
 
+            if callback is not None and (t + 1) % report_every == 0:
+                callback(t + 1, modified_adj.detach())
+
         em = self.embedding(ori_features, adj_norm)
         self.adj_changes.data = self.dot_product_decode(em)
         self.modified_adj = self.get_modified_adj(ori_adj).detach()
@@ -352,20 +289,18 @@ class PGDAttack(BaseAttack):
         self.embedding.set_layers(2)
         H_A2 = self.embedding(ori_features, self.modified_adj)
         Y_A2 = self.victim_model(ori_features, self.modified_adj)
-        ori_HA = self.dot_product_decode2(self.H_A.detach())
-        ori_YA = self.dot_product_decode2(self.Y_A.detach())
-        H_A1 = self.dot_product_decode2(H_A1.detach())
-        H_A2 = self.dot_product_decode2(H_A2.detach())
-        Y_A2 = self.dot_product_decode2(Y_A2.detach())
-        cur_adj = self.modified_adj + H_A1 + H_A2 + feature_adj + Y_A2
+        # fuse the score sources one row block at a time
+        sources = [decoder.DenseSource(self.modified_adj), self.decode_source(H_A1),
+                   self.decode_source(H_A2), decoder.DenseSource(feature_adj),
+                   self.decode_source(Y_A2)]
         if args.useH_A:
-            cur_adj = cur_adj + ori_HA
+            sources.append(self.decode_source(self.H_A))
         if args.useY_A:
-            cur_adj = cur_adj + ori_YA
+            sources.append(self.decode_source(self.Y_A))
         if args.useY:
-            cur_adj = cur_adj + label_adj
-
-        self.modified_adj = cur_adj.detach()
+            sources.append(decoder.LabelSource(labels))
+        # kept as row blocks, the evaluator streams them; .dense() if the matrix is needed
+        self.modified_adj = decoder.FusedDecoder(sources, nnodes=self.nnodes)
 
         return 0, 0, 0, 0
 
@@ -383,29 +318,12 @@ class PGDAttack(BaseAttack):
         return loss
 
     def projection(self, num_edges):
-        if torch.clamp(self.adj_changes, 0, 1).sum() > num_edges:
-            left = (self.adj_changes - 1).min()
-            right = self.adj_changes.max()
-            miu = self.bisection(left, right, num_edges, epsilon=1e-5)
-            self.adj_changes.data.copy_(torch.clamp(
-                self.adj_changes.data - miu, min=0, max=1))
-        else:
-            self.adj_changes.data.copy_(torch.clamp(
-                self.adj_changes.data, min=0, max=1))
+        self.adj_changes.data.copy_(utils.project_budget(self.adj_changes.data, num_edges))
 
     def get_modified_adj2(self, ori_adj, adj_changes):
 
-        if self.complementary is None:
-            self.complementary = torch.ones_like(
-                ori_adj) - torch.eye(self.nnodes).to(self.device)
-
-        m = torch.zeros((self.nnodes, self.nnodes)).to(self.device)
-        tril_indices = torch.tril_indices(
-            row=self.nnodes, col=self.nnodes, offset=-1)
-        m[tril_indices[0], tril_indices[1]] = adj_changes
-        m = m + m.t()
-
-        modified_adj = self.complementary * m + ori_adj
+        # sym(changes) has a zero diagonal, no complementary mask is needed
+        modified_adj = triangular.unpack(adj_changes, self.nnodes) + ori_adj
 
         return modified_adj
 
@@ -445,23 +363,6 @@ class PGDAttack(BaseAttack):
 
         return modified_adj
 
-    def bisection(self, a, b, num_edges, epsilon):
-        def func(x):
-            return torch.clamp(self.adj_changes - x, 0, 1).sum() - num_edges
-
-        miu = a
-        while ((b - a) >= epsilon):
-            miu = (a + b) / 2
-            # Check if middle point is root
-            if (func(miu) == 0.0):
-                break
-            # Decide the side to repeat the steps
-            if (func(miu) * func(a) < 0):
-                b = miu
-            else:
-                a = miu
-        return miu
-
     def dot_product_decode(self, Z):
         
         Z = ops.L2Normalize(axis=1)(Z)
@@ -470,53 +371,9 @@ class PGDAttack(BaseAttack):
             row=self.nnodes, col=self.nnodes, offset=-1)
         return A_pred[tril_indices[0], tril_indices[1]]
 
-    def dot_product_decode2(self, Z):
-        if self.args.dataset in ['cora', 'AIDS']:
-            Z = ops.matmul(Z, Z.t())
-            adj = ops.relu(Z-ops.eye(Z.shape[0]))
-            adj = ops.sigmoid(adj)
-
-        elif self.args.dataset == 'citeseer':            
-            Z = F.normalize(Z, p=2, dim=1) 
-            Z = torch.matmul(Z, Z.t())
-            adj = torch.relu(Z-torch.eye(Z.shape[0]).to(self.device))
-            adj = torch.sigmoid(adj)
-
-        elif self.args.dataset == 'brazil':
-            Z = torch.matmul(Z, Z.t())
-            adj = torch.relu(Z-torch.eye(Z.shape[0]).to(self.device))
-
-        elif self.args.dataset in ['polblogs', 'usair']:
-            if self.args.dataset == 'polblogs' and \
-                self.args.useH_A and self.args.useY_A and \
-                self.args.useY:
-                Z = torch.matmul(Z, Z.t())
-                Z = F.normalize(Z, p=2, dim=1) 
-
-            elif self.args.dataset == 'usair' and \
-                self.args.useY and not self.args.useH_A \
-                and not self.args.useY_A:
-                Z = F.normalize(Z, p=3, dim=1)
-                Z = torch.matmul(Z, Z.t())
-
-            elif (self.args.dataset == 'usair' and \
-                not self.args.useY and self.args.useH_A \
-                and self.args.useY_A):
-                Z = F.normalize(Z, p=2, dim=1)
-                Z = torch.matmul(Z, Z.t())
-            elif (self.args.dataset == 'usair' and \
-                self.args.useY and self.args.useH_A \
-                and not self.args.useY_A):
-                Z = F.normalize(Z, p=5, dim=1)
-                Z = torch.matmul(Z, Z.t())
-            else:
-                
-                Z = torch.matmul(Z, Z.t())
-                Z = F.normalize(Z, p=2, dim=1)
-                
-            adj = torch.relu(Z-torch.eye(Z.shape[0]).to(self.device))
-
-        return adj
+    def decode_source(self, Z):
+        """Per-dataset inner-product decoder of the final fusion."""
+        return decoder.embedding_source(Z, self.args, 'edge')
 
     def delete_eye(self, A):
         complementary = ops.ones_like(
@@ -524,6 +381,9 @@ class PGDAttack(BaseAttack):
         A = A*complementary
 
     def adding_noise(self, modified_adj, eps=0):
+        if eps == 0:
+            # modified_adj can exceed 1 (ori_adj + changes), the clamp is kept
+            return ops.clamp(modified_adj, max=1, min=0)
         noise = ops.randn_like(modified_adj)
         modified_adj += noise*eps
         modified_adj = ops.clamp(modified_adj, max=1, min=0)
@@ -2,10 +2,11 @@ import math
 
 import numpy as np
 import scipy.sparse as sp
-# import torch
+import torch
 # import torch.nn as nn
 import torch.nn.functional as F
 import torch.sparse as ts
+from torch.utils.checkpoint import checkpoint
 from sklearn.model_selection import train_test_split
 import mindspore
 import numpy as np
@@ -180,24 +181,23 @@ def normalize_adj(mx):
 
 
 def normalize_sparse_tensor(adj, fill_value=1):
-    """Normalize sparse tensor. Need to import torch_scatter
+    """Normalize a sparse (COO) tensor, D^-1/2 (A + I) D^-1/2, per edge.
+    Gradients flow back to the values of `adj`.
     """
-    edge_index = adj._indices()
-    edge_weight = adj._values()
+    adj = adj.coalesce()
+    edge_index = adj.indices()
+    edge_weight = adj.values()
     num_nodes = adj.size(0)
     edge_index, edge_weight = add_self_loops(
         edge_index, edge_weight, fill_value, num_nodes)
 
     row, col = edge_index
-    from torch_scatter import scatter_add
-    deg = scatter_add(edge_weight, row, dim=0, dim_size=num_nodes)
+    deg = edge_weight.new_zeros(num_nodes).index_add(0, row, edge_weight)
     deg_inv_sqrt = deg.pow(-0.5)
-    deg_inv_sqrt[deg_inv_sqrt == float('inf')] = 0
+    deg_inv_sqrt = deg_inv_sqrt.masked_fill(torch.isinf(deg_inv_sqrt), 0.)
 
     values = deg_inv_sqrt[row] * edge_weight * deg_inv_sqrt[col]
-
-    shape = adj.shape
-    return torch.sparse.FloatTensor(edge_index, values, shape)
+    return torch.sparse_coo_tensor(edge_index, values, adj.shape).coalesce()
 
 
 def add_self_loops(edge_index, edge_weight=None, fill_value=1, num_nodes=None):
@@ -215,26 +215,88 @@ def add_self_loops(edge_index, edge_weight=None, fill_value=1, num_nodes=None):
     return edge_index, edge_weight
 
 
-def normalize_adj_tensor(adj, sparse=False):
-    """Normalize adjacency tensor matrix.
+def normalize_adj_tensor(adj, sparse=False, fill_value=1):
+    """Normalize adjacency tensor matrix, D^-1/2 (A + I) D^-1/2.
+
+    The degree scaling is applied by broadcasting (dense input) or per edge
+    (sparse COO input), so neither an identity nor a diagonal N x N matrix
+    is built or multiplied.
+
+    Parameters
+    ----------
+    adj : torch.Tensor
+        dense or sparse COO adjacency
+    sparse : bool
+        treat `adj` as sparse (implied by a sparse COO input)
+    fill_value : float
+        weight of the added self loops
     """
-    # # device = torch.device("cuda" if adj.is_cuda else "cpu")
-    # if sparse:
-    #     # TODO if this is too slow, uncomment the following code,
-    #     # but you need to install torch_scatter
-    #     # return normalize_sparse_tensor(adj)
-    #     adj = to_scipy(adj)
-    #     mx = normalize_adj(adj)
-    #     return sparse_mx_to_torch_sparse_tensor(mx)# .to(device)
-    # else:
-    mx = adj + ops.eye(adj.shape[0])# .to(device)
-    rowsum = mx.sum(1)
-    r_inv = rowsum.pow(-1/2).flatten()
-    r_inv[ops.isinf(r_inv)] = 0.
-    r_mat_inv = ops.diag(r_inv)
-    mx = r_mat_inv @ mx
-    mx = mx @ r_mat_inv
-    return Tensor(mx, dtype=mindspore.float32)
+    if sparse or is_sparse_tensor(adj):
+        return normalize_sparse_tensor(adj.to_sparse() if not adj.is_sparse else adj, fill_value)
+    deg = adj.sum(1) + fill_value
+    r_inv = deg.pow(-1/2).flatten()
+    r_inv = r_inv.masked_fill(torch.isinf(r_inv), 0.)
+    mx = r_inv.unsqueeze(1) * adj * r_inv.unsqueeze(0)
+    # the self loops only touch the diagonal: + fill_value * D^-1
+    mx.diagonal().add_(fill_value * r_inv * r_inv)
+    return mx
+
+
+class IncrementalNormalizer(object):
+    """D^-1/2 (A + I) D^-1/2 of a dense adjacency that changes in a few
+    entries at a time (no gradients).
+
+    Keeps the degrees of the last adjacency; `update` adds the degree change
+    of the modified entries and rescales only the rows and columns of the
+    nodes whose degree changed, O(k * N) instead of O(N^2) for k such nodes.
+
+    >>> normalizer = IncrementalNormalizer(modified_adj)
+    >>> adj_norm = normalizer.update(rows, cols, new_values)
+    >>> adj_norm = normalizer.update_from(modified_adj)  # diff + update
+    """
+
+    def __init__(self, adj, fill_value=1, max_fraction=0.25):
+        self.fill_value = fill_value
+        self.max_fraction = max_fraction
+        self.reset(adj)
+
+    def reset(self, adj):
+        self.adj = adj.detach().clone()
+        self.deg = self.adj.sum(1) + self.fill_value
+        self.norm = normalize_adj_tensor(self.adj, fill_value=self.fill_value)
+        return self.norm
+
+    def _r_inv(self, nodes):
+        r_inv = self.deg[nodes].pow(-1/2)
+        return r_inv.masked_fill(torch.isinf(r_inv), 0.)
+
+    def update(self, rows, cols, values):
+        """Set adj[rows, cols] = values and return the updated normalization."""
+        values = values.detach().to(self.adj.dtype)
+        delta = values - self.adj[rows, cols]
+        self.adj[rows, cols] = values
+        self.deg.index_add_(0, rows, delta)
+
+        touched = torch.unique(rows[delta != 0])
+        if len(touched) > self.max_fraction * self.adj.shape[0]:
+            return self.reset(self.adj)
+        r_all = self._r_inv(slice(None))
+        r_touched = r_all[touched]
+        self.norm[touched] = r_touched.unsqueeze(1) * self.adj[touched] * r_all.unsqueeze(0)
+        self.norm[:, touched] = r_all.unsqueeze(1) * self.adj[:, touched] * r_touched.unsqueeze(0)
+        self.norm[touched, touched] += self.fill_value * r_touched * r_touched
+        # the diagonal of the untouched rows is unchanged
+        return self.norm
+
+    def update_from(self, adj):
+        """Diff `adj` against the stored adjacency and apply the changed entries."""
+        adj = adj.detach()
+        rows, cols = torch.nonzero(adj != self.adj, as_tuple=True)
+        if len(rows) == 0:
+            return self.norm
+        if len(rows) > self.max_fraction * adj.numel():
+            return self.reset(adj)
+        return self.update(rows, cols, adj[rows, cols])
 
 
 def degree_normalize_adj(mx):
@@ -559,6 +621,39 @@ def get_splits_each_class(labels, train_size):
         np.random.permutation(idx_test)
 
 
+def budget_threshold(values, budget):
+    """Exact miu with sum(clamp(values - miu, 0, 1)) == budget.
+
+    The sum is piecewise linear and decreasing in miu, with breakpoints at
+    `values` and `values - 1`: one sort of the breakpoints and a cumulative
+    sum give it at every breakpoint, and miu is interpolated on the segment
+    that crosses `budget`.
+    """
+    x = values.detach().flatten().double()
+    points, order = torch.sort(torch.cat([x, x - 1]), descending=True)
+    # number of entries strictly inside (0, 1) right below each breakpoint
+    count = torch.cumsum(torch.cat([torch.ones_like(x), -torch.ones_like(x)])[order], 0)
+    total = torch.cat([x.new_zeros(1), torch.cumsum(count[:-1] * (points[:-1] - points[1:]), 0)])
+    k = torch.searchsorted(total, x.new_tensor([budget])).clamp(1, len(total) - 1)
+    miu = points[k - 1] - (budget - total[k - 1]) / count[k - 1]
+    return miu.to(values.dtype)
+
+
+def project_budget(values, num_edges):
+    """Euclidean projection of the edge scores onto {0 <= x <= 1, sum(x) <= num_edges}.
+
+    Sparse tensors (candidate pairs) project their stored values, the
+    implicit zeros stay in the set.
+    """
+    if values.is_sparse:
+        values = values.coalesce()
+        return torch.sparse_coo_tensor(values.indices(), project_budget(values.values(), num_edges),
+                                       values.shape)
+    if torch.clamp(values, 0, 1).sum() > num_edges:
+        values = values - budget_threshold(values, num_edges)
+    return torch.clamp(values, 0, 1)
+
+
 def unravel_index(index, array_shape):
     rows = index // array_shape[1]
     cols = index % array_shape[1]
@@ -984,22 +1079,61 @@ class GaussianKernel():
 #         return torch.mean(kernel_x) + torch.mean(kernel_y) - torch.mean(kernel_xy) - torch.mean(kernel_yx)
 
 
-class MutualInformation(nn.Cell):
+class MutualInformation(torch.nn.Module):
+    """Normalized KDE mutual information between two (B x) N x M inputs,
+    with one Gaussian bin per column.
 
-    def __init__(self, sigma=0.4, num_bins=256, normalize=True):
+    Only the active bins, i.e. the columns whose kernel value exceeds `tol`
+    for some row, are materialized: for adjacency-like inputs in [0, 1] these
+    are a handful of the M columns. The joint pdf is accumulated over the
+    active bins in `chunk_size` x `chunk_size` blocks that are recomputed in
+    the backward pass, so memory no longer grows with M^2.
+
+    Parameters
+    ----------
+    tol : float
+        kernel value below which a bin is dropped, the result differs from
+        the dense estimate by O(M * tol)
+    max_bins : int
+        keep at most this many active bins per input, largest mass first
+    estimator : str
+        'kde' (differentiable) or 'histogram' (hard nearest-bin counts on
+        sparse co-occurrences, no gradient, for monitoring)
+    """
+
+    def __init__(self, sigma=0.4, num_bins=256, normalize=True, chunk_size=1024, tol=1e-12,
+                 max_bins=None, estimator='kde'):
         super(MutualInformation, self).__init__()
+        assert estimator in ['kde', 'histogram'], 'estimator should be kde or histogram'
 
         self.sigma = 2*sigma**2
         self.num_bins = num_bins
         self.normalize = normalize
         self.epsilon = 1e-10
-
-        self.bins = nn.Parameter(torch.linspace(
-            0, num_bins, num_bins, device='cuda:0').float(), requires_grad=True)
-
-    def marginalPdf(self, values):
-
-        residuals = values - self.bins.unsqueeze(0).unsqueeze(0)
+        self.chunk_size = chunk_size
+        self.tol = tol
+        self.max_bins = max_bins
+        self.estimator = estimator
+
+        # a buffer, so the bins follow .to(device) instead of being copied every call
+        self.register_buffer('bins', torch.linspace(0, num_bins, num_bins), persistent=False)
+
+    def active_bins(self, values):
+        """Indices of the columns whose kernel exceeds `tol` somewhere."""
+        radius = self.sigma * math.sqrt(-2 * math.log(self.tol))
+        bins = self.bins.to(values.device, values.dtype)
+        with torch.no_grad():
+            dist = torch.cat([(values[:, :, i:i + self.chunk_size] - bins[i:i + self.chunk_size]
+                               ).abs().amin(dim=(0, 1))
+                              for i in range(0, values.shape[2], self.chunk_size)])
+            active = torch.nonzero(dist < radius).flatten()
+            if self.max_bins is not None and len(active) > self.max_bins:
+                mass = torch.exp(-0.5*(dist[active] / self.sigma).pow(2))
+                active = active[torch.topk(mass, self.max_bins).indices.sort().values]
+        return active
+
+    def marginalPdf(self, values, active):
+        residuals = values[:, :, active] - self.bins.to(values.device, values.dtype)[active]
         kernel_values = torch.exp(-0.5*(residuals / self.sigma).pow(2))
 
         pdf = torch.mean(kernel_values, dim=1)
@@ -1008,41 +1142,68 @@ class MutualInformation(nn.Cell):
 
         return pdf, kernel_values
 
-    def jointPdf(self, kernel_values1, kernel_values2):
-
-        joint_kernel_values = torch.matmul(
-            kernel_values1.transpose(1, 2), kernel_values2)
-        normalization = torch.sum(joint_kernel_values, dim=(
-            1, 2)).view(-1, 1, 1) + self.epsilon
-        pdf = joint_kernel_values / normalization
-
-        return pdf
+    def _block_entropy(self, kernel_values1, kernel_values2, normalization):
+        pdf = torch.matmul(kernel_values1.transpose(1, 2), kernel_values2) / normalization
+        return -torch.sum(pdf*torch.log2(pdf + self.epsilon), dim=(1, 2))
+
+    def jointEntropy(self, kernel_values1, kernel_values2):
+        # sum_ij (K1^T K2)_ij = sum_n rowsum1_n * rowsum2_n, without the joint
+        normalization = torch.sum(kernel_values1.sum(2) * kernel_values2.sum(2), dim=1
+                                  ).view(-1, 1, 1) + self.epsilon
+        entropy = 0
+        for i in range(0, kernel_values1.shape[2], self.chunk_size):
+            for j in range(0, kernel_values2.shape[2], self.chunk_size):
+                block = (kernel_values1[:, :, i:i + self.chunk_size],
+                         kernel_values2[:, :, j:j + self.chunk_size], normalization)
+                if torch.is_grad_enabled() and any(x.requires_grad for x in block):
+                    entropy = entropy + checkpoint(self._block_entropy, *block, use_reentrant=False)
+                else:
+                    entropy = entropy + self._block_entropy(*block)
+        return entropy
+
+    def histogramEntropies(self, input1, input2):
+        """Marginal and joint entropies of hard nearest-bin assignments."""
+        step = self.num_bins / max(self.num_bins - 1, 1)
+
+        def hits(values, b):
+            active = self.active_bins(values[b:b + 1])
+            v = values[b][:, active].detach()
+            rows, cols = torch.nonzero(
+                (v - self.bins.to(v.device, v.dtype)[active]).abs() < step / 2, as_tuple=True)
+            return sp.csr_matrix((np.ones(len(rows)), (rows.cpu().numpy(), active[cols].cpu().numpy())),
+                                 shape=(values.shape[1], values.shape[2]))
+
+        def entropy(counts):
+            p = counts[counts > 0] / max(counts.sum(), self.epsilon)
+            return -np.sum(p * np.log2(p + self.epsilon))
+
+        H = []
+        for b in range(input1.shape[0]):
+            hits1, hits2 = hits(input1, b), hits(input2, b)
+            H.append([entropy(np.asarray(hits1.sum(0)).ravel()),
+                      entropy(np.asarray(hits2.sum(0)).ravel()),
+                      entropy((hits1.T @ hits2).data)])
+        H = torch.tensor(H, device=input1.device, dtype=input1.dtype)
+        return H[:, 0], H[:, 1], H[:, 2]
 
     def getMutualInformation(self, input1, input2):
         '''
-                input1: B, C, H, W
-                input2: B, C, H, W
-                return: scalar
+                input1: (B,) N, M
+                input2: (B,) N, M
+                return: B
         '''
+        if input1.dim() == 2:
+            input1, input2 = input1.unsqueeze(0), input2.unsqueeze(0)
 
-        # Torch tensors for images between (0, 1)
-        # input1 = input1*255
-        # input2 = input2*255
-
-        # B, C, H, W = input1.shape
-        # assert((input1.shape == input2.shape))
-
-        # x1 = input1.view(B, H*W, C)
-        # x2 = input2.view(B, H*W, C)
-
-        pdf_x1, kernel_values1 = self.marginalPdf(input1)
-        pdf_x2, kernel_values2 = self.marginalPdf(input2)
-        pdf_x1x2 = self.jointPdf(kernel_values1, kernel_values2)
+        if self.estimator == 'histogram':
+            H_x1, H_x2, H_x1x2 = self.histogramEntropies(input1, input2)
+        else:
+            pdf_x1, kernel_values1 = self.marginalPdf(input1, self.active_bins(input1))
+            pdf_x2, kernel_values2 = self.marginalPdf(input2, self.active_bins(input2))
 
-        H_x1 = -torch.sum(pdf_x1*torch.log2(pdf_x1 + self.epsilon), dim=1)
-        H_x2 = -torch.sum(pdf_x2*torch.log2(pdf_x2 + self.epsilon), dim=1)
-        H_x1x2 = -torch.sum(pdf_x1x2*torch.log2(pdf_x1x2 +
-                            self.epsilon), dim=(1, 2))
+            H_x1 = -torch.sum(pdf_x1*torch.log2(pdf_x1 + self.epsilon), dim=1)
+            H_x2 = -torch.sum(pdf_x2*torch.log2(pdf_x2 + self.epsilon), dim=1)
+            H_x1x2 = self.jointEntropy(kernel_values1, kernel_values2)
 
         mutual_information = H_x1 + H_x2 - H_x1x2
 
@@ -1052,24 +1213,30 @@ class MutualInformation(nn.Cell):
         return mutual_information
 
     def forward(self, input1, input2):
-        '''
-                input1: B, C, H, W
-                input2: B, C, H, W
-                return: scalar
-        '''
         return self.getMutualInformation(input1, input2)
 
 
 class CudaCKA(object):
-    def __init__(self, device):
+    """HSIC / CKA between two sets of node representations.
+
+    The linear estimators work in feature space: with column-centered X_c
+    and Y_c, HSIC(X, Y) = ||X_c^T Y_c||_F^2, which costs O(N * d * e) and
+    builds no N x N centering or Gram matrix. `kernel_HSIC` centers the RBF
+    Gram matrices by subtracting row / column means, or, with
+    `approx='rff'` (random Fourier features) or `approx='nystrom'`, runs the
+    same feature-space estimator on an explicit `n_components` feature map.
+    """
+
+    def __init__(self, device, approx=None, n_components=256, seed=0):
+        assert approx in [None, 'rff', 'nystrom'], 'approx should be None, rff or nystrom'
         self.device = device
+        self.approx = approx
+        self.n_components = n_components
+        self.seed = seed
 
     def centering(self, K):
-        n = K.shape[0]
-        unit = torch.ones([n, n], device=self.device)
-        I = torch.eye(n, device=self.device)
-        H = I - unit / n
-        return torch.matmul(torch.matmul(H, K), H)
+        """H K H with H = I - 11^T / n, without forming H."""
+        return K - K.mean(0, keepdim=True) - K.mean(1, keepdim=True) + K.mean()
 
     def rbf(self, X, sigma=None):
         GX = torch.matmul(X, X.T)
@@ -1081,14 +1248,51 @@ class CudaCKA(object):
         KX = torch.exp(KX)
         return KX
 
+    def median_sigma(self, X, max_samples=1000):
+        """Median heuristic of `rbf`, on a fixed subsample of the rows."""
+        generator = torch.Generator().manual_seed(self.seed)
+        idx = torch.randperm(X.shape[0], generator=generator)[:max_samples].to(X.device)
+        dist = torch.cdist(X[idx], X[idx]).pow(2)
+        return math.sqrt(torch.median(dist[dist != 0]).item())
+
+    def feature_map(self, X, sigma=None):
+        """Explicit features phi(X) with phi(x)^T phi(y) ~ rbf(x, y)."""
+        X = X.float()
+        if sigma is None:
+            sigma = self.median_sigma(X)
+        # fixed per input dimension, so the estimate is a smooth function across steps
+        generator = torch.Generator().manual_seed(self.seed + X.shape[1])
+        if self.approx == 'rff':
+            W = torch.randn(X.shape[1], self.n_components,
+                            generator=generator).to(X.device) / sigma
+            b = torch.rand(self.n_components, generator=generator).to(X.device) * 2 * math.pi
+            return math.sqrt(2. / self.n_components) * torch.cos(torch.matmul(X, W) + b)
+
+        idx = torch.randperm(X.shape[0], generator=generator)[:self.n_components].to(X.device)
+        K_nm = torch.exp(-torch.cdist(X, X[idx]).pow(2) * 0.5 / (sigma * sigma))
+        K_mm = K_nm[idx]
+        eigval, eigvec = torch.linalg.eigh(K_mm)
+        inv_sqrt = eigvec * eigval.clamp(min=1e-8).rsqrt().unsqueeze(0)
+        return torch.matmul(K_nm, torch.matmul(inv_sqrt, eigvec.T))
+
+    def feature_HSIC(self, X, Y):
+        """||X_c^T Y_c||_F^2, evaluated in the cheaper of feature / sample space."""
+        return self.centered_HSIC(X - X.mean(0, keepdim=True), Y - Y.mean(0, keepdim=True))
+
+    def centered_HSIC(self, X, Y):
+        """`feature_HSIC` of inputs whose columns are already centered."""
+        n = X.shape[0]
+        if X.shape[1] * Y.shape[1] <= n * (X.shape[1] + Y.shape[1]):
+            return torch.sum(torch.matmul(X.T, Y) ** 2)
+        return torch.sum(torch.matmul(X, X.T) * torch.matmul(Y, Y.T))
+
     def kernel_HSIC(self, X, Y, sigma):
+        if self.approx is not None:
+            return self.feature_HSIC(self.feature_map(X, sigma), self.feature_map(Y, sigma))
         return torch.sum(self.centering(self.rbf(X, sigma)) * self.centering(self.rbf(Y, sigma)))
 
     def linear_HSIC(self, X, Y):
-        L_X = torch.matmul(X, X.T)
-        L_Y = torch.matmul(Y, Y.T)
-        # L_Y = Y
-        return torch.sum(self.centering(L_X) * self.centering(L_Y))
+        return self.feature_HSIC(X, Y)
 
     def linear_CKA(self, X, Y):
         hsic = self.linear_HSIC(X, Y)